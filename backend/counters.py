@@ -0,0 +1,224 @@
+"""
+Engagement Counters Module
+Maintains engagement totals for users and the whole platform at write time, plus
+per-day buckets, so analytics dashboards read a few small documents instead of
+scanning every post and reel. Tribe totals are summed from their members' counters
+at read time, so they follow membership changes.
+"""
+
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Metrics tracked per scope. Likes, comments, shares and views are credited to the
+# author of the content that received them; followers to the followed user.
+COUNTER_METRICS = ["posts", "reels", "likes", "comments", "shares", "views", "checkins", "followers"]
+
+PLATFORM_SCOPE_ID = "platform"
+
+
+def empty_totals() -> Dict[str, int]:
+    """Return a zeroed totals dict with every tracked metric"""
+    return {metric: 0 for metric in COUNTER_METRICS}
+
+
+def day_key(moment: Optional[datetime] = None) -> str:
+    """Return the UTC day bucket key (YYYY-MM-DD) for a moment"""
+    return (moment or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+
+
+class EngagementCounters:
+    """
+    Write-time engagement counters.
+
+    Totals live in `engagement_counters` (one document per scope) and daily
+    buckets in `engagement_daily` (one document per scope per day). Scopes are
+    "user" and "platform"; tribes are read through tribe().
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self.totals = db.engagement_counters
+        self.daily = db.engagement_daily
+
+    async def create_indexes(self):
+        """Create the lookup indexes used by record() and the dashboard reads"""
+        await self.totals.create_index([("scope", 1), ("scopeId", 1)], unique=True)
+        await self.daily.create_index([("scope", 1), ("scopeId", 1), ("day", -1)], unique=True)
+        # Tribe counters were once kept at write time and drifted with membership
+        await self.totals.delete_many({"scope": "tribe"})
+        await self.daily.delete_many({"scope": "tribe"})
+
+    async def record(self, userId: Optional[str], metric: str, amount: int = 1):
+        """
+        Apply a counter delta for a user and the platform.
+
+        Failures are logged and swallowed so a counter hiccup never fails the write
+        that triggered it.
+
+        Args:
+            userId: User credited with the metric (content author, or actor for check-ins)
+            metric: One of COUNTER_METRICS
+            amount: Delta to apply (negative for unlikes, deletes, etc.)
+        """
+        if metric not in COUNTER_METRICS:
+            raise ValueError(f"Unknown counter metric: {metric}")
+        if amount == 0:
+            return
+
+        try:
+            now = datetime.now(timezone.utc)
+            day = day_key(now)
+
+            scopes = [("platform", PLATFORM_SCOPE_ID)]
+            if userId:
+                scopes.append(("user", userId))
+
+            total_ops = []
+            daily_ops = []
+            for scope, scope_id in scopes:
+                total_ops.append(UpdateOne(
+                    {"scope": scope, "scopeId": scope_id},
+                    {"$inc": {f"totals.{metric}": amount}, "$set": {"updatedAt": now.isoformat()}},
+                    upsert=True
+                ))
+                daily_ops.append(UpdateOne(
+                    {"scope": scope, "scopeId": scope_id, "day": day},
+                    {"$inc": {metric: amount}},
+                    upsert=True
+                ))
+
+            await self.totals.bulk_write(total_ops, ordered=False)
+            await self.daily.bulk_write(daily_ops, ordered=False)
+        except Exception as e:
+            logger.warning(f"Failed to record {metric} counter for {userId}: {str(e)}")
+
+    async def get(self, scope: str, scope_id: str, author_ids: Optional[List[str]] = None) -> dict:
+        """
+        Read a scope's counter document, seeding it from history on first access.
+
+        Args:
+            scope: "user" or "platform"
+            scope_id: User ID or PLATFORM_SCOPE_ID
+            author_ids: Authors whose history seeds the scope (None means everyone)
+
+        Returns:
+            Dict with "totals" (every metric present)
+        """
+        doc = await self.totals.find_one({"scope": scope, "scopeId": scope_id}, {"_id": 0})
+        if not doc or not doc.get("seeded"):
+            doc = await self._seed(scope, scope_id, author_ids)
+
+        totals = empty_totals()
+        totals.update(doc.get("totals", {}))
+        return {"totals": totals}
+
+    async def tribe(self, members: List[str]) -> dict:
+        """
+        Sum a tribe's current members' counters (one indexed read; members
+        never counted before are seeded once).
+
+        Returns:
+            Dict with "totals" (every metric present) and "contributors"
+            (post count per member)
+        """
+        docs = await self.totals.find(
+            {"scope": "user", "scopeId": {"$in": members}, "seeded": True},
+            {"_id": 0, "scopeId": 1, "totals": 1}
+        ).to_list(None)
+        by_member = {doc["scopeId"]: doc.get("totals", {}) for doc in docs}
+        for userId in set(members) - set(by_member):
+            by_member[userId] = (await self._seed("user", userId, [userId]))["totals"]
+
+        totals = empty_totals()
+        for member_totals in by_member.values():
+            for metric in COUNTER_METRICS:
+                totals[metric] += member_totals.get(metric, 0)
+        contributors = {userId: member_totals.get("posts", 0) for userId, member_totals in by_member.items()}
+        return {"totals": totals, "contributors": contributors}
+
+    async def window(self, scope: str, scope_id: str, days: int = 7) -> Dict[str, int]:
+        """
+        Sum the daily buckets of the last `days` days (today included).
+
+        Reads at most `days` small documents regardless of history length.
+        """
+        since = day_key(datetime.now(timezone.utc) - timedelta(days=days - 1))
+        buckets = await self.daily.find(
+            {"scope": scope, "scopeId": scope_id, "day": {"$gte": since}},
+            {"_id": 0}
+        ).to_list(days)
+
+        totals = empty_totals()
+        for bucket in buckets:
+            for metric in COUNTER_METRICS:
+                totals[metric] += bucket.get(metric, 0)
+        return totals
+
+    async def _seed(self, scope: str, scope_id: str, author_ids: Optional[List[str]]) -> dict:
+        """
+        One-time backfill of a scope's totals from existing posts, reels, check-ins
+        and follower lists.
+
+        Runs the full aggregation once per scope; afterwards record() keeps the
+        document current. Overwrites (rather than adds to) any deltas recorded
+        before seeding, since those events are already part of the history.
+        Daily buckets are not backfilled.
+        """
+        author_match = {} if author_ids is None else {"authorId": {"$in": author_ids}}
+        user_match = {} if author_ids is None else {"userId": {"$in": author_ids}}
+
+        totals = empty_totals()
+
+        async for row in self.db.posts.aggregate([
+            {"$match": author_match},
+            {"$group": {
+                "_id": None,
+                "posts": {"$sum": 1},
+                "likes": {"$sum": {"$ifNull": ["$stats.likes", 0]}},
+                "comments": {"$sum": {"$ifNull": ["$stats.replies", 0]}},
+                "shares": {"$sum": {"$ifNull": ["$stats.reposts", 0]}}
+            }}
+        ]):
+            for metric in ("posts", "likes", "comments", "shares"):
+                totals[metric] += row.get(metric, 0)
+
+        async for row in self.db.reels.aggregate([
+            {"$match": author_match},
+            {"$group": {
+                "_id": None,
+                "reels": {"$sum": 1},
+                "likes": {"$sum": {"$ifNull": ["$stats.likes", 0]}},
+                "comments": {"$sum": {"$ifNull": ["$stats.comments", 0]}},
+                "views": {"$sum": {"$ifNull": ["$stats.views", 0]}}
+            }}
+        ]):
+            for metric in ("reels", "likes", "comments", "views"):
+                totals[metric] += row.get(metric, 0)
+
+        totals["checkins"] = await self.db.checkins.count_documents(user_match)
+
+        id_match = {} if author_ids is None else {"id": {"$in": author_ids}}
+        async for row in self.db.users.aggregate([
+            {"$match": id_match},
+            {"$group": {"_id": None, "followers": {"$sum": {"$size": {"$ifNull": ["$followers", []]}}}}}
+        ]):
+            totals["followers"] = row.get("followers", 0)
+
+        doc = {
+            "scope": scope,
+            "scopeId": scope_id,
+            "totals": totals,
+            "seeded": True,
+            "updatedAt": datetime.now(timezone.utc).isoformat()
+        }
+        await self.totals.update_one({"scope": scope, "scopeId": scope_id}, {"$set": doc}, upsert=True)
+        return doc
@@ -0,0 +1,284 @@
+"""
+Geo Discovery Module
+Stores venue and event locations as GeoJSON points behind a 2dsphere index and
+answers "near me" queries with radius, category and open-now filters. Small
+radius queries are served from a short-lived per-grid-cell candidate cache so
+dense city centers do not re-run the same $geoNear for every nearby user.
+"""
+
+import logging
+import math
+import os
+import re
+from datetime import datetime, timezone, timedelta
+from typing import List, Optional, Tuple
+
+from cachetools import TTLCache
+from fastapi import HTTPException
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Venue opening hours are local times; the catalog is in India (IST)
+VENUE_UTC_OFFSET_MINUTES = int(os.environ.get('VENUE_UTC_OFFSET_MINUTES', 330))
+
+MAX_RADIUS_KM = 50
+MAX_NEARBY_RESULTS = 100
+
+# Grid cells are CELL_DEGREES on a side (~1.1 km north-south). Queries up to
+# MAX_CACHED_RADIUS_KM share one candidate list per (cell, radius, filters).
+CELL_DEGREES = 0.01
+MAX_CACHED_RADIUS_KM = 10
+MAX_CELL_CANDIDATES = 500
+CELL_CACHE_SECONDS = 60
+CELL_CACHE_SIZE = 4096
+
+# Collections searchable by kind
+KIND_COLLECTIONS = {
+    "venue": "venues",
+    "event": "events",
+}
+
+# Approximate centers of known localities, used to place documents that only
+# carry a free-text `location`. Keys are matched as lowercase substrings.
+LOCALITY_COORDINATES = {
+    "t-hub": (78.3762, 17.4474),
+    "hitec city": (78.3811, 17.4435),
+    "gachibowli": (78.3489, 17.4401),
+    "jubilee hills": (78.4071, 17.4326),
+    "banjara hills": (78.4483, 17.4156),
+    "somajiguda": (78.4594, 17.4239),
+    "naubat pahad": (78.4691, 17.4062),
+    "necklace road": (78.4676, 17.4139),
+    "lamakaan": (78.4378, 17.4224),
+    "rtc cross roads": (78.4967, 17.4062),
+    "secunderabad": (78.4983, 17.4399),
+    "charminar": (78.4747, 17.3616),
+    "golconda": (78.4011, 17.3833),
+    "gmr arena": (78.4294, 17.2403),
+    "moinabad": (78.2650, 17.3310),
+    "sanghi nagar": (78.6861, 17.2329),
+    "keesara": (78.6650, 17.5185),
+}
+
+_TIME = r"(\d{1,2})(?::(\d{2}))?\s*([AP]M)"
+_WINDOW = re.compile(_TIME + r"\s*-\s*" + _TIME, re.IGNORECASE)
+
+
+def point(lng: float, lat: float) -> dict:
+    """GeoJSON point (note the [longitude, latitude] order)"""
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    return {"type": "Point", "coordinates": [float(lng), float(lat)]}
+
+
+def locate(location: str) -> Optional[dict]:
+    """GeoJSON point for a known locality named in a location string"""
+    text = (location or "").lower()
+    for name, (lng, lat) in LOCALITY_COORDINATES.items():
+        if name in text:
+            return point(lng, lat)
+    return None
+
+
+def _minutes(hour: str, minute: Optional[str], meridiem: str) -> int:
+    hour = int(hour) % 12 + (12 if meridiem.upper() == "PM" else 0)
+    return hour * 60 + int(minute or 0)
+
+
+def parse_timings(timings: str) -> Optional[List[dict]]:
+    """
+    Opening windows for a timings string such as "7:00 AM - 12:00 PM, 3:00 PM - 9:00 PM".
+
+    Returns:
+        List of {"open", "close"} minute-of-day windows (overnight windows are
+        split at midnight), or None when the string cannot be read
+    """
+    if not timings:
+        return None
+    if "24 hours" in timings.lower():
+        return [{"open": 0, "close": 1440}]
+
+    windows = []
+    for match in _WINDOW.finditer(timings):
+        start = _minutes(*match.group(1, 2, 3))
+        end = _minutes(*match.group(4, 5, 6))
+        if end > start:
+            windows.append({"open": start, "close": end})
+        else:
+            # Past midnight, e.g. "6:00 PM - 1:00 AM"
+            windows.append({"open": start, "close": 1440})
+            if end:
+                windows.append({"open": 0, "close": end})
+    return windows or None
+
+
+def local_minute(now: Optional[datetime] = None) -> int:
+    """Current minute of the day in venue local time"""
+    now = (now or datetime.now(timezone.utc)) + timedelta(minutes=VENUE_UTC_OFFSET_MINUTES)
+    return now.hour * 60 + now.minute
+
+
+def distance_km(a: List[float], b: List[float]) -> float:
+    """Great-circle distance between two [lng, lat] pairs"""
+    lng1, lat1, lng2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def grid_cell(lng: float, lat: float) -> Tuple[int, int]:
+    return math.floor(lng / CELL_DEGREES), math.floor(lat / CELL_DEGREES)
+
+
+class GeoDiscovery:
+    """
+    Nearby venues and events.
+
+    Documents carry `geo` (a GeoJSON point) and, for venues, `openHours`
+    parsed from `timings` so open-now is a cheap check. Queries run as one
+    $geoNear over the 2dsphere index, nearest first, with every filter in
+    its query so the candidate window is never spent on documents the
+    filters drop (past events pile up in dense areas).
+
+    For radii up to MAX_CACHED_RADIUS_KM the $geoNear runs from the center of
+    the caller's grid cell with the radius widened by the cell's half
+    diagonal, so the cached candidates cover every point in the cell; each
+    request then only measures exact distances to that short list.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self._cells = TTLCache(maxsize=CELL_CACHE_SIZE, ttl=CELL_CACHE_SECONDS)
+
+    async def create_indexes(self):
+        for collection in KIND_COLLECTIONS.values():
+            await self.db[collection].create_index([("geo", "2dsphere")])
+        await self.db.venues.create_index("category")
+
+    @staticmethod
+    def annotate(doc: dict) -> dict:
+        """Fill in `geo` (from the location string) and `openHours` (from timings) where missing"""
+        if "geo" not in doc:
+            geo = locate(doc.get("location", ""))
+            if geo:
+                doc["geo"] = geo
+        if "openHours" not in doc and doc.get("timings"):
+            hours = parse_timings(doc["timings"])
+            if hours:
+                doc["openHours"] = hours
+        return doc
+
+    async def backfill(self):
+        """Annotate documents written before locations were stored as points"""
+        for collection in KIND_COLLECTIONS.values():
+            ops = []
+            async for doc in self.db[collection].find(
+                {"$or": [{"geo": {"$exists": False}}, {"timings": {"$exists": True}, "openHours": {"$exists": False}}]},
+                {"_id": 0, "id": 1, "location": 1, "timings": 1, "geo": 1, "openHours": 1}
+            ):
+                fields = {k: v for k, v in self.annotate(dict(doc)).items() if k in ("geo", "openHours") and k not in doc}
+                if fields:
+                    ops.append(UpdateOne({"id": doc["id"]}, {"$set": fields}))
+            if ops:
+                await self.db[collection].bulk_write(ops, ordered=False)
+                logger.info(f"Placed {len(ops)} {collection} on the map")
+
+    def invalidate(self, kind: str):
+        """Drop cached cells for a kind after its documents change"""
+        for key in [k for k in self._cells.keys() if k[0] == kind]:
+            self._cells.pop(key, None)
+
+    async def nearby(self, kind: str, lng: float, lat: float, radius_km: float = 5,
+                     category: Optional[str] = None, open_now: bool = False,
+                     upcoming: bool = False, limit: int = 20) -> List[dict]:
+        """
+        Documents within `radius_km`, nearest first, each with `distanceKm`.
+
+        Args:
+            kind: "venue" or "event"
+            category: Only documents of this category (venues match category or type)
+            open_now: Venues only - drop venues closed right now (or with unknown hours)
+            upcoming: Events only - drop events dated before today
+
+        Raises:
+            HTTPException: 400 for invalid coordinates or radius
+        """
+        origin = point(lng, lat)["coordinates"]
+        if not 0 < radius_km <= MAX_RADIUS_KM:
+            raise HTTPException(status_code=400, detail=f"radiusKm must be between 0 and {MAX_RADIUS_KM}")
+        limit = max(1, min(limit, MAX_NEARBY_RESULTS))
+
+        minute = local_minute() if open_now else None
+        today = (
+            (datetime.now(timezone.utc) + timedelta(minutes=VENUE_UTC_OFFSET_MINUTES)).date().isoformat()
+            if upcoming else None
+        )
+        query = {}
+        if category:
+            query["$or"] = [{"category": category}, {"type": category}]
+        if open_now:
+            query["openHours"] = {"$elemMatch": {"open": {"$lte": minute}, "close": {"$gt": minute}}}
+        if upcoming:
+            query["date"] = {"$gte": today}
+
+        if radius_km <= MAX_CACHED_RADIUS_KM:
+            filters = (category, minute, today)
+            candidates = await self._cell_candidates(kind, origin, radius_km, filters, query)
+        else:
+            candidates = None
+        if candidates is None:
+            candidates = await self._geo_near(kind, origin, radius_km, query, MAX_CELL_CANDIDATES)
+
+        results = []
+        for doc in candidates:
+            distance = distance_km(origin, doc["geo"]["coordinates"])
+            if distance > radius_km:
+                continue
+            results.append({**doc, "distanceKm": round(distance, 3)})
+        results.sort(key=lambda d: d["distanceKm"])
+        return results[:limit]
+
+    async def _cell_candidates(self, kind: str, origin: List[float], radius_km: float,
+                               filters: tuple, query: dict) -> Optional[List[dict]]:
+        """
+        Cached superset of matches for any point in the origin's cell; None if it would be truncated.
+
+        Args:
+            filters: The values `query` was built from (category, open minute, today), part of the cache key
+        """
+        cell = grid_cell(*origin)
+        key = (kind, cell, radius_km) + filters
+        if key in self._cells:
+            return self._cells[key]
+
+        center = [(cell[0] + 0.5) * CELL_DEGREES, (cell[1] + 0.5) * CELL_DEGREES]
+        corner = [cell[0] * CELL_DEGREES, cell[1] * CELL_DEGREES]
+        reach = radius_km + distance_km(center, corner)
+        candidates = await self._geo_near(kind, center, reach, query, MAX_CELL_CANDIDATES + 1)
+        if len(candidates) > MAX_CELL_CANDIDATES:
+            # Too dense to cache the whole cell; the caller queries its own point
+            return None
+        self._cells[key] = candidates
+        return candidates
+
+    async def _geo_near(self, kind: str, origin: List[float], radius_km: float, query: dict,
+                        limit: int) -> List[dict]:
+        return await self.db[KIND_COLLECTIONS[kind]].aggregate([
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": origin},
+                "distanceField": "distanceKm",
+                "distanceMultiplier": 0.001,
+                "maxDistance": radius_km * 1000,
+                "spherical": True,
+                "key": "geo",
+                "query": query
+            }},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "attendees": 0}}
+        ]).to_list(limit)
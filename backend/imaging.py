@@ -0,0 +1,83 @@
+"""
+Image Derivatives Module
+CPU-bound image work that runs in worker processes, away from the event loop.
+Kept free of server imports so process-pool workers start quickly.
+"""
+
+import io
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import qrcode
+from PIL import Image, ImageOps
+
+# Variant name -> maximum width in pixels, smallest first
+IMAGE_VARIANTS: List[Tuple[str, int]] = [
+    ("thumb", 320),
+    ("feed", 1080),
+    ("full", 2048),
+]
+
+WEBP_QUALITY = 80
+
+# Refuse to decode anything larger than ~50 megapixels (decompression bombs)
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+
+def render_variants(src_path: str, dest_stem: str) -> Dict[str, dict]:
+    """
+    Write resized WebP variants of an image next to the original.
+
+    Variants are never upscaled; when several would end up the same width they
+    share one file. Animated images are skipped.
+
+    Args:
+        src_path: Absolute path of the original image
+        dest_stem: Absolute path prefix for variants ("<stem>_<name>.webp" is appended)
+
+    Returns:
+        {variant name: {"file", "width", "height", "size"}} where "file" is the
+        variant's file name, or {} when the image is not eligible
+    """
+    with Image.open(src_path) as img:
+        if getattr(img, "is_animated", False):
+            return {}
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "P") else "RGB")
+
+        variants = {}
+        rendered = {}
+        for name, max_width in IMAGE_VARIANTS:
+            width = min(max_width, img.width)
+            if width not in rendered:
+                height = max(1, round(img.height * width / img.width))
+                resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+
+                dest = Path(f"{dest_stem}_{name}.webp")
+                resized.save(dest, "WEBP", quality=WEBP_QUALITY, method=4)
+                rendered[width] = {
+                    "file": dest.name,
+                    "width": width,
+                    "height": height,
+                    "size": dest.stat().st_size
+                }
+            variants[name] = rendered[width]
+
+    return variants
+
+
+def render_qr_png(data: str, box_size: int = 10, border: int = 4) -> bytes:
+    """Encode `data` as a black-on-white QR code and return the PNG bytes"""
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -0,0 +1,133 @@
+"""
+Event Loop Monitor Module
+Measures event-loop lag with a sampling task and runs a watchdog thread
+that, when the loop stops turning for longer than a threshold, captures
+the loop thread's stack: the synchronous call (bcrypt, gspread, file
+copies, image encoding, ...) that is blocking every other request.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from metrics import MetricsRegistry, registry
+
+logger = logging.getLogger(__name__)
+
+# How often the loop is sampled, and how long a stall must last to be reported
+LOOP_LAG_INTERVAL_MS = float(os.environ.get('LOOP_LAG_INTERVAL_MS', 100))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', 250))
+BLOCK_LOG_SIZE = 100
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def blocking_site(frame) -> str:
+    """`file:function` of the innermost application frame, for a bounded metric label"""
+    for summary in reversed(traceback.extract_stack(frame)):
+        filename = os.path.abspath(summary.filename)
+        if filename.startswith(APP_DIR) and filename != os.path.abspath(__file__):
+            return f"{os.path.basename(filename)}:{summary.name}"
+    return "<other>"
+
+
+class LoopLagMonitor:
+    """
+    Lag sampler plus blocked-loop watchdog.
+
+    The sampler sleeps `interval` on the loop and observes how late it
+    wakes up (event_loop_lag_seconds), refreshing a heartbeat. The watchdog
+    thread checks the heartbeat; once it is older than interval + threshold
+    the loop is blocked, and the loop thread's current stack is logged,
+    counted by blocking site and kept for /api/metrics/loop/blocks. Each
+    stall is reported once.
+    """
+
+    def __init__(self, registry: MetricsRegistry = registry, interval_ms: float = LOOP_LAG_INTERVAL_MS,
+                 threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.blocks = deque(maxlen=BLOCK_LOG_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+        self._reported_beat: Optional[float] = None
+
+        self.lag = registry.histogram(
+            "event_loop_lag_seconds", "Delay of a scheduled event loop wakeup", buckets=LAG_BUCKETS)
+        self.last_lag = registry.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+        self.blocked = registry.counter(
+            "event_loop_blocked_total", "Event loop stalls past the block threshold", ("site",))
+
+    def start(self):
+        """Start the sampler and the watchdog (idempotent); call on the loop"""
+        if self._task and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread:
+            await asyncio.to_thread(self._thread.join, self.interval + self.threshold)
+            self._thread = None
+
+    async def _sample(self):
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - scheduled - self.interval)
+            self._heartbeat = now
+            self.lag.observe(value=lag)
+            self.last_lag.set(value=lag)
+
+    def _watch(self):
+        limit = self.interval + self.threshold
+        while not self._stopping.wait(min(self.threshold, self.interval) / 2):
+            beat = self._heartbeat
+            stalled = time.monotonic() - beat
+            if stalled > limit and beat != self._reported_beat:
+                self._reported_beat = beat
+                self._report(stalled - self.interval)
+
+    def _report(self, blocked_seconds: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        site = blocking_site(frame)
+        stack = "".join(traceback.format_stack(frame))
+        self.blocked.inc(site)
+        self.blocks.append({
+            "site": site,
+            "blockedMs": round(blocked_seconds * 1000),
+            "stack": stack,
+            "at": datetime.now(timezone.utc).isoformat()
+        })
+        logger.warning(f"Event loop blocked for {blocked_seconds * 1000:.0f}+ ms in {site}:\n{stack}")
+
+    def recent_blocks(self, limit: int = 20) -> List[dict]:
+        """Most recent stalls with the blocking stack, newest first"""
+        return list(self.blocks)[::-1][:limit]
@@ -0,0 +1,701 @@
+"""
+Media Upload Module
+Streams uploaded images and videos to disk without blocking the event loop.
+Chunks are written and hashed on a dedicated I/O thread pool, per-type size limits
+are enforced while copying, the real file type is sniffed from its leading bytes,
+and large reels can be sent as resumable chunked upload sessions.
+
+Multipart uploads (/upload) are spooled by Starlette before the handler runs, so
+their per-type limit is only checked when copying out of the spool;
+UploadSizeGuard rejects oversized bodies up front from Content-Length. Chunked
+sessions stream the request body directly and are limited as bytes arrive.
+
+Files are content-addressed: each is stored once under its SHA-256 in a sharded
+layout (uploads/ab/cd/<sha256>.<ext>), so identical uploads share one file and a
+stable URL. A reference table ties files to the posts, reels, capsules, stories,
+direct messages and profiles using them, and a periodic garbage-collection pass removes orphans.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+from cachetools import LRUCache
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from imaging import IMAGE_VARIANTS, render_variants
+from media_http import DEFAULT_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, PROVISIONAL_CACHE_CONTROL
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Canonical content type -> file extension. The extension is always derived from
+# the sniffed content type, never from the client's filename.
+ALLOWED_UPLOAD_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'video/mp4': 'mp4',
+    'video/quicktime': 'mov',
+    'video/x-msvideo': 'avi',
+    'video/webm': 'webm',
+}
+
+# Extensions of uploads that get resized variants
+IMAGE_EXTENSIONS = {ext for content_type, ext in ALLOWED_UPLOAD_TYPES.items() if content_type.startswith('image/')}
+
+# Client-declared aliases accepted on upload
+CONTENT_TYPE_ALIASES = {'image/jpg': 'image/jpeg'}
+
+UPLOAD_SIZE_LIMITS = {
+    'image': int(os.environ.get('MAX_IMAGE_UPLOAD_MB', 10)) * 1024 * 1024,
+    'video': int(os.environ.get('MAX_VIDEO_UPLOAD_MB', 200)) * 1024 * 1024,
+}
+
+# Largest multipart body accepted before parsing: the biggest per-type limit plus form overhead
+MAX_MULTIPART_BODY = max(UPLOAD_SIZE_LIMITS.values()) + 1024 * 1024
+
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+
+# A session lock older than this is assumed to belong to a dead request
+UPLOAD_SESSION_LOCK_TIMEOUT = timedelta(minutes=2)
+
+# Unreferenced files are kept this long so a fresh upload can be attached to its post
+MEDIA_GC_GRACE = timedelta(hours=24)
+MEDIA_GC_INTERVAL = timedelta(hours=6)
+
+# Reference owner type -> collection holding the owner (used to prune dangling refs)
+MEDIA_REF_OWNERS = {
+    "post": "posts",
+    "reel": "reels",
+    "capsule": "vibe_capsules",
+    "story": "stories",
+    "avatar": "users",
+    "cover": "users",
+    "message": "messages",
+}
+
+# Striped per-hash locks serializing file placement against GC unlinks
+MEDIA_LOCK_STRIPES = 64
+
+CONTENT_ADDRESSED_URL = re.compile(r'/uploads/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Identify an allowed media type from a file's leading bytes"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'video/x-msvideo'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video/webm'
+    if head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:12] == b'qt  ' else 'video/mp4'
+    if head[4:8] in (b'moov', b'mdat', b'wide', b'free'):
+        return 'video/quicktime'
+    return None
+
+
+def normalize_content_type(content_type: Optional[str]) -> str:
+    """Validate a client-declared content type and map aliases to canonical types"""
+    content_type = CONTENT_TYPE_ALIASES.get(content_type, content_type)
+    if content_type not in ALLOWED_UPLOAD_TYPES:
+        raise HTTPException(status_code=400, detail="File type not supported")
+    return content_type
+
+
+def upload_size_limit(content_type: str) -> int:
+    """Maximum upload size in bytes for a content type"""
+    return UPLOAD_SIZE_LIMITS[content_type.split('/')[0]]
+
+
+def _write_chunk(fh, hasher, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so hashing here runs alongside the loop
+    fh.write(chunk)
+    if hasher:
+        hasher.update(chunk)
+
+
+def _hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(UPLOAD_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def media_hash_from_url(url: Optional[str]) -> Optional[str]:
+    """Extract the content hash from a content-addressed upload URL (absolute or relative)"""
+    match = CONTENT_ADDRESSED_URL.search(url or "")
+    return match.group(1) if match else None
+
+
+def _place_file(tmp_path: Path, dest: Path) -> bool:
+    # Returns False when identical content is already stored (the temp file is dropped)
+    if dest.exists():
+        tmp_path.unlink()
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, dest)
+    return True
+
+
+def _open_at(path: Path, offset: int):
+    # Reopen a partial file and drop any bytes past the last acknowledged offset
+    fh = open(path, 'r+b' if path.exists() else 'w+b')
+    fh.truncate(offset)
+    fh.seek(offset)
+    return fh
+
+
+class MediaStore:
+    """
+    Upload pipeline writing into the uploads directory served at /uploads.
+
+    Partial files live in a sibling directory so the static mounts never serve
+    incomplete uploads.
+    """
+
+    def __init__(self, db, upload_dir: Path, io_workers: int = 4, image_workers: int = 2):
+        """
+        Args:
+            db: Motor database handle (for resumable upload sessions)
+            upload_dir: Directory served at /uploads
+            io_workers: Threads reserved for upload disk I/O, kept separate from
+                the default executor so uploads cannot starve other requests
+            image_workers: Processes used to render image variants
+        """
+        self.db = db
+        self.upload_dir = upload_dir
+        self.tmp_dir = upload_dir.parent / "upload_tmp"
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.sessions = db.upload_sessions
+        self.media = db.media
+        self.refs = db.media_refs
+        self._io_pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="upload-io")
+        self._image_workers = image_workers
+        self._image_pool = None  # created on first use; workers are spawned, never forked
+        self._variant_tasks = set()
+        self._variant_cache = LRUCache(maxsize=10000)  # hash -> variants, once rendered
+        self._gc_task = None
+        self._hash_locks = [asyncio.Lock() for _ in range(MEDIA_LOCK_STRIPES)]
+
+    def _hash_lock(self, media_hash: str) -> asyncio.Lock:
+        return self._hash_locks[int(media_hash[:8], 16) % MEDIA_LOCK_STRIPES]
+
+    async def _io(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io_pool, fn, *args)
+
+    async def create_indexes(self):
+        await self.sessions.create_index("id", unique=True)
+        await self.sessions.create_index("expiresAt", expireAfterSeconds=0)  # TTL on a BSON date
+        await self.media.create_index("hash", unique=True)
+        await self.media.create_index([("refCount", 1), ("updatedAt", 1)])  # GC candidates
+        await self.refs.create_index([("hash", 1), ("ownerType", 1), ("ownerId", 1)], unique=True)
+        await self.refs.create_index([("ownerType", 1), ("ownerId", 1)])
+
+    def start(self):
+        """Start the periodic garbage-collection loop (idempotent)"""
+        if self._gc_task is None or self._gc_task.done():
+            self._gc_task = asyncio.create_task(self._gc_forever())
+
+    async def shutdown(self):
+        if self._gc_task:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+        self._io_pool.shutdown(wait=False)
+        if self._image_pool:
+            self._image_pool.shutdown(wait=False, cancel_futures=True)
+
+    # ----- Single-request uploads -----
+
+    async def save_upload(self, file) -> dict:
+        """
+        Copy a (Starlette-spooled) multipart UploadFile into the uploads directory.
+
+        Returns:
+            Dict with url, filename, content_type, size and sha256
+
+        Raises:
+            HTTPException: 400 for unsupported or mismatched content, 413 when the
+                per-type size limit is exceeded
+        """
+        declared_type = normalize_content_type(file.content_type)
+        limit = upload_size_limit(declared_type)
+        if file.size is not None and file.size > limit:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {limit // (1024 * 1024)} MB limit")
+
+        async def chunks():
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+        tmp_path = self.tmp_dir / f"{uuid.uuid4()}.part"
+        try:
+            content_type, size, digest = await self._stream_to(tmp_path, chunks(), declared_type, limit)
+            return await self._finalize(tmp_path, content_type, size, digest)
+        finally:
+            await self._io(self._unlink, tmp_path)
+
+    async def _stream_to(self, path: Path, chunks: AsyncIterator[bytes], declared_type: str, limit: int,
+                         offset: int = 0, hash_content: bool = True):
+        """
+        Append an async chunk stream to `path` starting at `offset`.
+
+        The first chunk of a file is sniffed and must match the declared type family.
+
+        Returns:
+            (content_type, total_size, sha256 hex digest or None)
+        """
+        hasher = hashlib.sha256() if hash_content else None
+        fh = await self._io(_open_at, path, offset)
+        size = offset
+        content_type = declared_type
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if size == 0:
+                    content_type = self._check_signature(chunk, declared_type)
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {limit // (1024 * 1024)} MB limit")
+                await self._io(_write_chunk, fh, hasher, chunk)
+        finally:
+            await self._io(fh.close)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+        return content_type, size, hasher.hexdigest() if hasher else None
+
+    @staticmethod
+    def _check_signature(head: bytes, declared_type: str) -> str:
+        sniffed = sniff_content_type(head)
+        if not sniffed or sniffed.split('/')[0] != declared_type.split('/')[0]:
+            raise HTTPException(status_code=400, detail="File content does not match its declared type")
+        return sniffed
+
+    async def _finalize(self, tmp_path: Path, content_type: str, size: int, digest: str) -> dict:
+        """Store a completed upload under its content hash, deduplicating identical files"""
+        filename = f"{digest[:2]}/{digest[2:4]}/{digest}.{ALLOWED_UPLOAD_TYPES[content_type]}"
+        url = f"/uploads/{filename}"
+        now = datetime.now(timezone.utc).isoformat()
+
+        # Register (or touch) the media record and place the file under the hash lock,
+        # so a GC pass cannot unlink the file between the exists-check and the upsert
+        async with self._hash_lock(digest):
+            media, created = await self._register(tmp_path, digest, filename, url, content_type, size, now)
+
+        if content_type.startswith("image/") and not media.get("variants"):
+            self._schedule_variants(digest, filename)
+
+        return {
+            "url": url,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size,
+            "sha256": digest,
+            "deduplicated": not created
+        }
+
+    async def _register(self, tmp_path: Path, digest: str, filename: str, url: str, content_type: str,
+                        size: int, now: str):
+        media = await self.media.find_one_and_update(
+            {"hash": digest},
+            {
+                "$setOnInsert": {
+                    "hash": digest,
+                    "path": filename,
+                    "url": url,
+                    "contentType": content_type,
+                    "size": size,
+                    "refCount": 0,
+                    "createdAt": now
+                },
+                "$set": {"updatedAt": now}
+            },
+            upsert=True,
+            projection={"_id": 0, "variants": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        created = await self._io(_place_file, tmp_path, self.upload_dir / filename)
+        return media, created
+
+    # ----- Image variants -----
+
+    def _schedule_variants(self, media_hash: str, rel_path: str):
+        task = asyncio.create_task(self._generate_variants(media_hash, rel_path))
+        self._variant_tasks.add(task)
+        task.add_done_callback(self._variant_tasks.discard)
+
+    async def _generate_variants(self, media_hash: str, rel_path: str):
+        """Render WebP variants in the process pool and record them on the media record"""
+        try:
+            if self._image_pool is None:
+                # Spawned: forking would copy locks held by Motor, watchdog and profiler threads
+                self._image_pool = ProcessPoolExecutor(
+                    max_workers=self._image_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            src = self.upload_dir / rel_path
+            rendered = await asyncio.get_running_loop().run_in_executor(
+                self._image_pool, render_variants, str(src), str(src.with_suffix(""))
+            )
+            if not rendered:
+                return
+
+            rel_dir = Path(rel_path).parent
+            variants = {
+                name: {"path": str(rel_dir / v["file"]), "width": v["width"], "height": v["height"], "size": v["size"]}
+                for name, v in rendered.items()
+            }
+            await self.media.update_one({"hash": media_hash}, {"$set": {"variants": variants}})
+        except Exception as e:
+            logger.warning(f"Failed to render variants for {rel_path}: {str(e)}")
+
+    async def _variants_for(self, media_hash: str) -> dict:
+        variants = self._variant_cache.get(media_hash)
+        if variants is None:
+            media = await self.media.find_one({"hash": media_hash}, {"_id": 0, "variants": 1}) or {}
+            variants = media.get("variants") or {}
+            if variants:
+                self._variant_cache[media_hash] = variants
+        return variants
+
+    async def resolve_upload(self, file_path: str, width: Optional[int] = None) -> dict:
+        """
+        Map a path under /uploads to a file on disk plus its caching metadata.
+
+        With a `width` hint, content-addressed images resolve to the smallest
+        rendered variant at least that wide (or the largest one available);
+        until variants exist the original is served with a short max-age so
+        clients pick up the variant later. Other media ignore the hint.
+
+        Returns:
+            {"path": Path, "etag": quoted ETag or None (derive from stat),
+             "cacheControl": Cache-Control value}
+
+        Raises:
+            HTTPException: 404 for missing files or paths outside the uploads directory
+        """
+        root = self.upload_dir.resolve()
+        path = (root / file_path).resolve()
+        if not path.is_relative_to(root):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        etag = None
+        cache_control = DEFAULT_CACHE_CONTROL
+        media_hash = media_hash_from_url(f"/uploads/{file_path}")
+        if media_hash:
+            # Content-addressed: the bytes behind this URL can never change
+            etag = f'"{media_hash}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+            if width and path.suffix.lstrip('.').lower() in IMAGE_EXTENSIONS:
+                variants = await self._variants_for(media_hash)
+                cache_control = PROVISIONAL_CACHE_CONTROL
+                for name, _ in IMAGE_VARIANTS:
+                    variant = variants.get(name)
+                    if variant and (variant["width"] >= width or name == IMAGE_VARIANTS[-1][0]):
+                        path = root / variant["path"]
+                        etag = f'"{media_hash}-{name}"'
+                        cache_control = IMMUTABLE_CACHE_CONTROL
+                        break
+
+        if not path.is_file():
+            raise HTTPException(status_code=404, detail="File not found")
+        return {"path": path, "etag": etag, "cacheControl": cache_control}
+
+    @staticmethod
+    def _unlink(path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    # ----- Resumable chunked uploads -----
+
+    async def create_session(self, userId: Optional[str], content_type: str, total_size: int) -> dict:
+        """Open a resumable upload session for a file of known size"""
+        content_type = normalize_content_type(content_type)
+        limit = upload_size_limit(content_type)
+        if total_size <= 0:
+            raise HTTPException(status_code=400, detail="totalSize must be positive")
+        if total_size > limit:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {limit // (1024 * 1024)} MB limit")
+
+        now = datetime.now(timezone.utc)
+        session = {
+            "id": str(uuid.uuid4()),
+            "userId": userId,
+            "contentType": content_type,
+            "totalSize": total_size,
+            "received": 0,
+            "status": "uploading",
+            "locked": False,
+            "createdAt": now.isoformat(),
+            "expiresAt": now + UPLOAD_SESSION_TTL
+        }
+        await self.sessions.insert_one(session)
+        session.pop("_id", None)
+        return self._session_view(session)
+
+    async def get_session(self, session_id: str) -> dict:
+        session = await self.sessions.find_one({"id": session_id}, {"_id": 0})
+        if not session:
+            raise HTTPException(status_code=404, detail="Upload session not found or expired")
+        return self._session_view(session)
+
+    async def append_chunk(self, session_id: str, offset: int, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        Append a chunk stream at `offset` to a session's partial file.
+
+        Only one request may write a session at a time; a request whose offset does
+        not match the bytes already received gets 409 with the expected offset so the
+        client can resume from there. The file is finalized once totalSize bytes
+        have arrived.
+        """
+        now = datetime.now(timezone.utc)
+        session = await self.sessions.find_one_and_update(
+            {
+                "id": session_id,
+                "status": "uploading",
+                "received": offset,
+                "$or": [{"locked": False}, {"lockedAt": {"$lt": now - UPLOAD_SESSION_LOCK_TIMEOUT}}]
+            },
+            {"$set": {"locked": True, "lockedAt": now}},
+            projection={"_id": 0}
+        )
+        if not session:
+            current = await self.get_session(session_id)
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Offset mismatch or chunk already in progress", "offset": current["received"]}
+            )
+
+        part_path = self.tmp_dir / f"{session_id}.part"
+        released = False
+        try:
+            content_type, received, _ = await self._stream_to(
+                part_path, chunks, session["contentType"], session["totalSize"], offset=offset, hash_content=False
+            )
+
+            update = {"received": received, "locked": False, "updatedAt": datetime.now(timezone.utc).isoformat()}
+            if offset == 0:
+                update["contentType"] = content_type
+            if received < session["totalSize"]:
+                await self.sessions.update_one({"id": session_id}, {"$set": update})
+                released = True
+                return self._session_view({**session, **update})
+
+            digest = await self._io(_hash_file, part_path)
+            result = await self._finalize(part_path, update.get("contentType", session["contentType"]), received, digest)
+            await self.sessions.update_one(
+                {"id": session_id},
+                {"$set": {**update, "status": "complete", "result": result}}
+            )
+            released = True
+            return self._session_view({**session, **update, "status": "complete", "result": result})
+        finally:
+            if not released:
+                # Failed or cancelled (client disconnect): keep the acknowledged offset and
+                # unlock; the partial tail is truncated on retry. Shielded so a cancelled
+                # request still releases the session.
+                await asyncio.shield(self.sessions.update_one({"id": session_id}, {"$set": {"locked": False}}))
+
+    @staticmethod
+    def _session_view(session: dict) -> dict:
+        view = {k: session.get(k) for k in ("id", "contentType", "totalSize", "received", "status")}
+        if session.get("result"):
+            view["result"] = session["result"]
+        return view
+
+    def purge_stale_parts(self, max_age: timedelta = UPLOAD_SESSION_TTL) -> int:
+        """Delete partial files older than the session TTL (blocking; run in a thread)"""
+        cutoff = time.time() - max_age.total_seconds()
+        removed = 0
+        for path in self.tmp_dir.glob("*.part"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    # ----- References and garbage collection -----
+
+    async def set_refs(self, owner_type: str, owner_id: str, urls: List[Optional[str]]):
+        """
+        Make `urls` the complete set of media referenced by an owner.
+
+        Non content-addressed URLs (external links, legacy uploads) are ignored.
+        Failures are logged and swallowed so reference bookkeeping never fails the
+        write that triggered it; the GC grace period covers any missed reference.
+
+        Args:
+            owner_type: One of MEDIA_REF_OWNERS ("post", "reel", "capsule", "story", "avatar", "cover", "message")
+            owner_id: ID of the owning document
+            urls: Media URLs the owner now uses (pass [] when the owner is deleted)
+        """
+        try:
+            wanted = {h for h in (media_hash_from_url(url) for url in urls) if h}
+            existing = {
+                ref["hash"] for ref in
+                await self.refs.find({"ownerType": owner_type, "ownerId": owner_id}, {"_id": 0, "hash": 1}).to_list(None)
+            }
+            now = datetime.now(timezone.utc).isoformat()
+
+            for media_hash in wanted - existing:
+                result = await self.refs.update_one(
+                    {"hash": media_hash, "ownerType": owner_type, "ownerId": owner_id},
+                    {"$setOnInsert": {"createdAt": now}},
+                    upsert=True
+                )
+                if result.upserted_id is not None:
+                    await self.media.update_one({"hash": media_hash}, {"$inc": {"refCount": 1}, "$set": {"updatedAt": now}})
+
+            for media_hash in existing - wanted:
+                result = await self.refs.delete_one({"hash": media_hash, "ownerType": owner_type, "ownerId": owner_id})
+                if result.deleted_count:
+                    await self.media.update_one({"hash": media_hash}, {"$inc": {"refCount": -1}, "$set": {"updatedAt": now}})
+        except Exception as e:
+            logger.warning(f"Failed to update media refs for {owner_type} {owner_id}: {str(e)}")
+
+    async def collect_garbage(self, grace: timedelta = MEDIA_GC_GRACE, batch_size: int = 500) -> dict:
+        """
+        Drop references whose owners no longer exist, then delete media files that
+        have had no references for longer than `grace`.
+
+        Returns:
+            Counts of pruned references and removed files
+        """
+        pruned = 0
+        for owner_type, collection in MEDIA_REF_OWNERS.items():
+            last_id = None
+            while True:
+                query = {"ownerType": owner_type}
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                refs = await self.refs.find(query, {"_id": 1, "hash": 1, "ownerId": 1}).sort("_id", 1).to_list(batch_size)
+                if not refs:
+                    break
+                last_id = refs[-1]["_id"]
+
+                owner_ids = list({ref["ownerId"] for ref in refs})
+                alive = set(await self.db[collection].distinct("id", {"id": {"$in": owner_ids}}))
+                for ref in refs:
+                    if ref["ownerId"] not in alive:
+                        await self.set_refs(owner_type, ref["ownerId"], [])
+                        pruned += 1
+
+        cutoff = (datetime.now(timezone.utc) - grace).isoformat()
+        removed = 0
+        orphans = await self.media.find(
+            {"refCount": {"$lte": 0}, "updatedAt": {"$lt": cutoff}}, {"_id": 0, "hash": 1, "path": 1, "variants": 1}
+        ).to_list(batch_size)
+        for orphan in orphans:
+            # The conditional delete re-checks refCount and updatedAt atomically; the hash
+            # lock keeps an upload of the same content from reusing the file meanwhile
+            async with self._hash_lock(orphan["hash"]):
+                result = await self.media.delete_one(
+                    {"hash": orphan["hash"], "refCount": {"$lte": 0}, "updatedAt": {"$lt": cutoff}}
+                )
+                if not result.deleted_count:
+                    continue
+                await self._io(self._unlink, self.upload_dir / orphan["path"])
+                for variant_path in {v["path"] for v in (orphan.get("variants") or {}).values()}:
+                    await self._io(self._unlink, self.upload_dir / variant_path)
+            self._variant_cache.pop(orphan["hash"], None)
+            removed += 1
+
+        return {"prunedRefs": pruned, "removedFiles": removed}
+
+    async def backfill_message_refs(self, batch_size: int = 500) -> int:
+        """
+        Reference attachments of messages sent before messages owned media.
+        Runs until it completes once (recorded in `media_backfills`).
+        """
+        if await self.db.media_backfills.find_one({"id": "message_refs"}, {"_id": 1}):
+            return 0
+        backfilled = 0
+        last_id = None
+        while True:
+            query = {"mediaUrl": {"$regex": "/uploads/"}, "deletedAt": None}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            messages = await self.db.messages.find(query, {"_id": 1, "id": 1, "mediaUrl": 1}).sort("_id", 1).to_list(batch_size)
+            if not messages:
+                await self.db.media_backfills.update_one(
+                    {"id": "message_refs"},
+                    {"$set": {"completedAt": datetime.now(timezone.utc).isoformat(), "count": backfilled}},
+                    upsert=True
+                )
+                return backfilled
+            last_id = messages[-1]["_id"]
+            for message in messages:
+                await self.set_refs("message", message["id"], [message["mediaUrl"]])
+                backfilled += 1
+
+    async def _gc_forever(self):
+        try:
+            backfilled = await self.backfill_message_refs()
+            if backfilled:
+                logger.info(f"Media refs backfilled for {backfilled} messages")
+        except Exception as e:
+            # Collecting now would delete attachments that were never referenced
+            logger.error(f"Message media ref backfill failed, media GC disabled: {str(e)}")
+            return
+        while True:
+            try:
+                stats = await self.collect_garbage()
+                parts = await self._io(self.purge_stale_parts)
+                logger.info(f"Media GC: {stats}, stale partial uploads removed: {parts}")
+            except Exception as e:
+                logger.warning(f"Media GC failed: {str(e)}")
+            await asyncio.sleep(MEDIA_GC_INTERVAL.total_seconds())
+
+
+class UploadSizeGuard:
+    """
+    Pure ASGI middleware rejecting multipart uploads whose Content-Length is
+    over MAX_MULTIPART_BODY with 413, before Starlette spools the body.
+    """
+
+    def __init__(self, app, paths=("/api/upload",), limit: int = MAX_MULTIPART_BODY):
+        self.app = app
+        self.paths = set(paths)
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            length = dict(scope.get("headers", ())).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > self.limit:
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body",
+                            "body": b'{"detail":"Upload is too large"}'})
+                return
+        await self.app(scope, receive, send)
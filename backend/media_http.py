@@ -0,0 +1,184 @@
+"""
+Media HTTP Module
+Serves files from disk with HTTP caching semantics: strong ETags, Cache-Control,
+conditional requests (If-None-Match / If-Modified-Since / If-Range) and single
+byte-range (206) responses for video seeking. Bodies go out through the ASGI
+zero-copy sendfile extension when the server offers it, otherwise in chunks read
+off the event loop.
+"""
+
+import mimetypes
+import os
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+
+mimetypes.add_type("image/webp", ".webp")
+
+# Content-addressed URLs never change content, so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Legacy (uuid-named) uploads and anything else served from disk
+DEFAULT_CACHE_CONTROL = "public, max-age=86400"
+# A response that will change soon (e.g. the original served while variants render)
+PROVISIONAL_CACHE_CONTROL = "public, max-age=60"
+
+FILE_CHUNK_SIZE = 256 * 1024
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+def stat_etag(stat: os.stat_result) -> str:
+    """Strong validator for files without a content hash: size + mtime in nanoseconds"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2) as required for If-None-Match
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return int(mtime) <= since.timestamp()
+
+
+def etag_is_fresh(request: Request, etag: str) -> bool:
+    """True when the client's If-None-Match already covers `etag` (answer 304)"""
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and _etag_matches(if_none_match, etag)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" range into an inclusive (start, end) pair.
+
+    Returns:
+        (start, end), or None when the header should be ignored (multiple ranges,
+        other units, malformed)
+
+    Raises:
+        ValueError: When the range is well-formed but unsatisfiable
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = (part.strip() for part in spec.partition("-"))
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """Sends `length` bytes of a file starting at `start`"""
+
+    def __init__(self, path: Path, start: int, length: int, status_code: int, headers: dict,
+                 media_type: Optional[str], send_body: bool = True):
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({**headers, "content-length": str(length)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if ZERO_COPY_EXTENSION in scope.get("extensions", {}):
+            with open(self.path, "rb") as fh:
+                await send({
+                    "type": ZERO_COPY_EXTENSION,
+                    "file": fh,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+            return
+
+        async with await anyio.open_file(self.path, "rb") as fh:
+            await fh.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await fh.read(min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; close the response cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def media_file_response(request: Request, path: Path, etag: Optional[str] = None,
+                              cache_control: str = DEFAULT_CACHE_CONTROL) -> Response:
+    """
+    Build a cache-aware response for a file on disk.
+
+    Args:
+        request: Incoming request (conditional and Range headers are read from it)
+        path: File to serve
+        etag: Quoted strong ETag; derived from size and mtime when omitted
+        cache_control: Cache-Control header value
+    """
+    stat = await anyio.to_thread.run_sync(os.stat, path)
+    etag = etag or stat_etag(stat)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+    }
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    send_body = request.method != "HEAD"
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and _etag_matches(if_none_match, etag)) or \
+            (not if_none_match and if_modified_since and _not_modified_since(if_modified_since, stat.st_mtime)):
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() not in (etag, headers["last-modified"]):
+        range_header = None  # representation changed; send it whole
+
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return FileRangeResponse(path, start, end - start + 1, 206, headers, media_type, send_body)
+
+    return FileRangeResponse(path, 0, size, 200, headers, media_type, send_body)
@@ -0,0 +1,260 @@
+"""
+Metrics Module
+A small in-process metrics registry (counters, gauges, histograms with
+labels) rendered in the Prometheus text exposition format, plus an ASGI
+middleware recording per-route latency, throughput, status codes and
+payload sizes, and instrumentation for Socket.IO event handlers.
+"""
+
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds; covers fast reads through slow AI/LLM handlers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Observations also arrive from worker threads (e.g. Mongo command listeners)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *labels: str, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics.setdefault(name, cls(name, help, labels, **kwargs))
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry shared by every instrumented module
+registry = MetricsRegistry()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def route_template(scope: dict) -> str:
+    """Route path template ("/api/users/{userId}") of a routed request, never the raw path"""
+    route = scope.get("route")
+    if route is None and scope.get("endpoint") is not None:
+        # Mounted sub-application (e.g. Socket.IO): label by its mount point
+        return scope.get("root_path") or UNMATCHED_ROUTE
+    path = getattr(route, "path_format", None) or getattr(route, "path", None)
+    return path or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording, per (method, route template):
+    request latency, status codes and request/response body sizes, plus the
+    number of requests in flight. The route template is read from the scope
+    after routing, so label cardinality is bounded by the number of routes.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+        self.requests = registry.counter(
+            "http_requests_total", "HTTP requests by status code", ("method", "route", "status"))
+        self.in_flight = registry.gauge(
+            "http_requests_in_progress", "HTTP requests currently being served", ("method",))
+        self.request_size = registry.histogram(
+            "http_request_size_bytes", "HTTP request body size", ("method", "route"), buckets=SIZE_BUCKETS)
+        self.response_size = registry.histogram(
+            "http_response_size_bytes", "HTTP response body size", ("method", "route"), buckets=SIZE_BUCKETS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        self.in_flight.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight.dec(method)
+            route = route_template(scope)
+            self.latency.observe(method, route, value=elapsed)
+            self.requests.inc(method, route, str(status))
+            self.response_size.observe(method, route, value=sent)
+            length = _content_length(scope)
+            if length is not None:
+                self.request_size.observe(method, route, value=length)
+
+
+def _content_length(scope: dict) -> Optional[int]:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def instrument_socketio(sio, registry: MetricsRegistry = registry, namespace: str = "/"):
+    """
+    Wrap every registered Socket.IO event handler to count events and time
+    them. Call once, after all handlers are registered.
+    """
+    events = registry.counter("socketio_events_total", "Socket.IO events handled", ("event", "outcome"))
+    latency = registry.histogram("socketio_event_duration_seconds", "Socket.IO event handler latency", ("event",))
+
+    def wrap(event, handler):
+        if getattr(handler, "_instrumented", False):
+            return handler
+
+        @functools.wraps(handler)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "ok"
+            try:
+                result = handler(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            except BaseException:
+                outcome = "error"
+                raise
+            finally:
+                latency.observe(event, value=time.perf_counter() - start)
+                events.inc(event, outcome)
+
+        timed._instrumented = True
+        return timed
+
+    handlers = sio.handlers.get(namespace, {})
+    for event, handler in list(handlers.items()):
+        handlers[event] = wrap(event, handler)
@@ -0,0 +1,240 @@
+"""
+Mongo Monitoring Module
+A PyMongo command listener that times every command per collection, counts
+commands per HTTP request (attributed to the route template), logs slow
+commands with a normalized query shape, and flags N+1 patterns: the same
+query shape issued many times within one request.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import MetricsRegistry, registry, route_template
+
+logger = logging.getLogger(__name__)
+
+# Commands slower than this are logged with their query shape
+MONGO_SLOW_MS = float(os.environ.get('MONGO_SLOW_MS', 100))
+# A query shape repeated more than this many times in one request is an N+1
+MONGO_N_PLUS_ONE_THRESHOLD = int(os.environ.get('MONGO_N_PLUS_ONE_THRESHOLD', 20))
+SLOW_LOG_SIZE = 200
+
+COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Commands that are connection housekeeping, not application queries
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue",
+    "buildInfo", "endSessions", "killCursors", "getLastError",
+}
+
+# Where each command keeps the part of the query that defines its shape
+_SHAPE_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort"),
+    "aggregate": ("pipeline",),
+}
+
+
+def query_shape(value):
+    """
+    Normalize a query: keys and operators are kept, literal values become "?"
+    and arrays of literals collapse to ["?"], so `{"id": "u1"}` and
+    `{"id": "u2"}` share a shape.
+    """
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = [query_shape(v) for v in value]
+        if all(s == "?" for s in shapes):
+            return ["?"] if shapes else []
+        return shapes
+    return "?"
+
+
+def command_collection(name: str, command: dict) -> str:
+    if name == "getMore":
+        return str(command.get("collection", ""))
+    target = command.get(name)
+    return target if isinstance(target, str) else ""
+
+
+def command_fingerprint(name: str, command: dict) -> str:
+    """`collection.command {shape}` for a command as sent to the server"""
+    if name in ("update", "delete"):
+        statements = command.get("updates" if name == "update" else "deletes") or []
+        shape = {"q": query_shape(statements[0].get("q", {}))} if statements else {}
+    elif name == "insert":
+        shape = {}
+    else:
+        shape = {f: query_shape(command[f]) for f in _SHAPE_FIELDS.get(name, ()) if f in command}
+    collection = command_collection(name, command)
+    return f"{collection}.{name} {json.dumps(shape, sort_keys=True, default=str)}"
+
+
+class RequestStats:
+    """
+    Mongo activity of one HTTP request (commands may complete on Motor's
+    executor threads). Background tasks spawned by the request inherit it;
+    their commands are ignored once the request has finished.
+    """
+
+    __slots__ = ("scope", "commands", "seconds", "shapes", "finished", "_lock")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.commands = 0
+        self.seconds = 0.0
+        self.shapes: Dict[str, int] = {}
+        self.finished = False
+        self._lock = threading.Lock()
+
+    @property
+    def route(self) -> str:
+        return route_template(self.scope) if self.scope is not None else "<background>"
+
+    def record(self, fingerprint: str, seconds: float):
+        with self._lock:
+            if self.finished:
+                return
+            self.commands += 1
+            self.seconds += seconds
+            self.shapes[fingerprint] = self.shapes.get(fingerprint, 0) + 1
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("mongo_request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """Stats of the request being served, None outside one"""
+    return _current.get()
+
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """
+    Command listener; pass to the client as
+    AsyncIOMotorClient(url, event_listeners=[monitor]).
+
+    Motor runs PyMongo on executor threads with a copy of the caller's
+    context, so commands are attributed to the request that issued them via
+    a context variable set by MongoRequestMiddleware.
+    """
+
+    def __init__(self, registry: MetricsRegistry = registry, slow_ms: float = MONGO_SLOW_MS,
+                 n_plus_one_threshold: int = MONGO_N_PLUS_ONE_THRESHOLD):
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.slow_log = deque(maxlen=SLOW_LOG_SIZE)
+        # (connection, request id) -> (fingerprint, collection, request stats)
+        self._started: Dict[Tuple, Tuple[str, str, Optional[RequestStats]]] = {}
+
+        self.latency = registry.histogram(
+            "mongo_command_duration_seconds", "Mongo command latency", ("collection", "command"))
+        self.failures = registry.counter(
+            "mongo_command_failures_total", "Failed Mongo commands", ("collection", "command"))
+        self.slow = registry.counter(
+            "mongo_slow_commands_total", "Mongo commands slower than MONGO_SLOW_MS", ("collection", "command"))
+        self.per_request = registry.histogram(
+            "mongo_commands_per_request", "Mongo commands issued per HTTP request", ("route",),
+            buckets=COMMANDS_PER_REQUEST_BUCKETS)
+        self.request_seconds = registry.histogram(
+            "mongo_request_duration_seconds", "Total Mongo time per HTTP request", ("route",))
+        self.n_plus_one = registry.counter(
+            "mongo_n_plus_one_total", "Requests repeating one query shape past the N+1 threshold",
+            ("route", "collection", "command"))
+
+    # ----- CommandListener -----
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        self._started[(event.connection_id, event.request_id)] = (
+            command_fingerprint(event.command_name, event.command),
+            command_collection(event.command_name, event.command),
+            _current.get()
+        )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        fingerprint, collection, stats = started
+        name = event.command_name
+        seconds = event.duration_micros / 1e6
+
+        self.latency.observe(collection, name, value=seconds)
+        if failed:
+            self.failures.inc(collection, name)
+        if stats is not None:
+            stats.record(fingerprint, seconds)
+        if seconds >= self.slow_seconds:
+            self._log_slow(fingerprint, collection, name, seconds, stats)
+
+    def _log_slow(self, fingerprint: str, collection: str, name: str, seconds: float,
+                  stats: Optional[RequestStats]):
+        route = stats.route if stats is not None else "<background>"
+        self.slow.inc(collection, name)
+        self.slow_log.append({
+            "shape": fingerprint,
+            "route": route,
+            "durationMs": round(seconds * 1000, 1),
+            "at": datetime.now(timezone.utc).isoformat()
+        })
+        logger.warning(f"Slow Mongo command ({seconds * 1000:.0f} ms) from {route}: {fingerprint}")
+
+    # ----- Requests -----
+
+    def finish_request(self, stats: RequestStats):
+        """Record a finished request's totals and flag repeated query shapes"""
+        with stats._lock:
+            stats.finished = True
+            commands, seconds, shapes = stats.commands, stats.seconds, dict(stats.shapes)
+        route = stats.route
+        self.per_request.observe(route, value=commands)
+        self.request_seconds.observe(route, value=seconds)
+        for fingerprint, count in shapes.items():
+            # Many getMores are one large cursor, not repeated queries
+            if count > self.n_plus_one_threshold and ".getMore " not in fingerprint:
+                target = fingerprint.split(" ", 1)[0]
+                collection, _, name = target.rpartition(".")
+                self.n_plus_one.inc(route, collection, name)
+                logger.warning(f"N+1 query in {route}: {count} x {fingerprint}")
+
+    def slow_commands(self, limit: int = 50) -> List[dict]:
+        """Most recent slow commands, newest first"""
+        return list(self.slow_log)[::-1][:limit]
+
+
+class MongoRequestMiddleware:
+    """Pure ASGI middleware giving each HTTP request its own RequestStats"""
+
+    def __init__(self, app, monitor: MongoCommandMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            self.monitor.finish_request(stats)
@@ -0,0 +1,322 @@
+"""
+Notification Outbox Module
+Takes notification writes off the request path: handlers enqueue, and a
+background flusher writes them in batches, coalescing repeated actions on the
+same target ("Priya and 41 others liked your post") into one document, then
+pushes realtime updates to connected clients. Also keeps a per-user unread
+counter for badge polling and expires read notifications after a retention
+period.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Read notifications are deleted this long after being read (TTL on expireAt)
+READ_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_READ_RETENTION_DAYS', 30))
+
+# Notification types folded into one unread document per (recipient, link),
+# with the verb used to phrase the combined message
+COALESCED_TYPES = {
+    "like": "liked your post",
+    "follow": "started following you",
+}
+# Coalesced types grouped per recipient regardless of link (one "new followers" entry)
+RECIPIENT_WIDE_TYPES = {"follow"}
+
+FLUSH_INTERVAL = 0.5  # seconds between flushes
+MAX_BATCH = 500  # flush early once this many notifications are waiting
+MAX_RECENT_ACTORS = 10
+# Distinct actor IDs remembered per group, so repeat actions by one user count once
+MAX_TRACKED_ACTORS = 1000
+
+
+class UnreadCounters:
+    """
+    Materialized unread-notification count per user.
+
+    One `notification_counters` document per user ({_id: userId, unread}) is
+    adjusted on every insert, read and delete, so the badge is a single-key
+    read. A missing or drifted (negative) counter is rebuilt from the
+    notifications themselves on the next read.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.notifications = db.notifications
+        self.counters = db.notification_counters
+
+    async def create_indexes(self):
+        await self.notifications.create_index([("userId", 1), ("read", 1), ("createdAt", -1)])
+        # expireAt (a BSON date) is only set once a notification is read
+        await self.notifications.create_index("expireAt", expireAfterSeconds=0)
+
+    async def add(self, deltas: Dict[str, int]):
+        """Apply unread deltas per user; users without a counter yet are seeded on first read"""
+        ops = [UpdateOne({"_id": userId}, {"$inc": {"unread": delta}}) for userId, delta in deltas.items() if delta]
+        if ops:
+            await self.counters.bulk_write(ops, ordered=False)
+
+    async def get(self, userId: str) -> int:
+        doc = await self.counters.find_one({"_id": userId})
+        if doc is None or doc.get("unread", 0) < 0:
+            return await self.recount(userId)
+        return doc["unread"]
+
+    async def get_many(self, userIds: Iterable[str]) -> Dict[str, int]:
+        """Unread counts for users that already have a counter document"""
+        docs = await self.counters.find({"_id": {"$in": list(userIds)}}).to_list(None)
+        return {d["_id"]: max(d.get("unread", 0), 0) for d in docs}
+
+    async def recount(self, userId: str) -> int:
+        """Rebuild a user's counter from the (userId, read, createdAt) index"""
+        unread = await self.notifications.count_documents({"userId": userId, "read": False})
+        await self.counters.update_one({"_id": userId}, {"$set": {"unread": unread}}, upsert=True)
+        return unread
+
+    @staticmethod
+    def _read_fields() -> dict:
+        now = datetime.now(timezone.utc)
+        return {"read": True, "readAt": now.isoformat(), "expireAt": now + timedelta(days=READ_RETENTION_DAYS)}
+
+    async def mark_read(self, notificationId: str) -> bool:
+        """Mark one notification read; False if it was missing or already read"""
+        doc = await self.notifications.find_one_and_update(
+            {"id": notificationId, "read": False},
+            {"$set": self._read_fields()},
+            projection={"_id": 0, "userId": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if doc:
+            await self.add({doc["userId"]: -1})
+        return doc is not None
+
+    async def mark_all_read(self, userId: str) -> int:
+        """Mark a user's unread notifications read; returns how many changed"""
+        result = await self.notifications.update_many({"userId": userId, "read": False}, {"$set": self._read_fields()})
+        await self.add({userId: -result.modified_count})
+        return result.modified_count
+
+    async def delete(self, notificationId: str) -> bool:
+        doc = await self.notifications.find_one_and_delete({"id": notificationId}, projection={"_id": 0, "userId": 1, "read": 1})
+        if doc and not doc.get("read"):
+            await self.add({doc["userId"]: -1})
+        return doc is not None
+
+
+def group_key(notification: dict) -> str:
+    """Coalescing key within a recipient's notifications"""
+    if notification["type"] in RECIPIENT_WIDE_TYPES:
+        return notification["type"]
+    return f"{notification['type']}:{notification.get('link', '')}"
+
+
+class NotificationOutbox:
+    """
+    Buffered, batched notification writer.
+
+    enqueue() never touches the database. Plain notifications are written with
+    insert_many; coalesced types are upserted into the recipient's unread
+    document for the same target, bumping `actorCount` and rewriting `message`.
+    Buffered notifications are flushed on shutdown, but a hard crash loses at
+    most one flush interval's worth.
+    """
+
+    def __init__(self, db, emit: Callable[[str, str, dict], Awaitable[None]], unread: UnreadCounters):
+        """
+        Args:
+            db: Motor database handle
+            emit: Realtime push callback, called as emit(userId, event, data)
+            unread: Counters bumped for every newly unread document
+        """
+        self.db = db
+        self.collection = db.notifications
+        self.emit = emit
+        self.unread = unread
+        self._buffer: List[dict] = []
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def create_indexes(self):
+        # Coalescing upserts look up the recipient's unread document per target
+        await self.collection.create_index([("userId", 1), ("groupKey", 1), ("read", 1)])
+
+    def enqueue(self, notification: dict):
+        """Queue a notification document for the next flush"""
+        notification.pop("_id", None)
+        self._buffer.append(notification)
+        if len(self._buffer) >= MAX_BATCH:
+            self._wake.set()
+
+    def start(self):
+        """Start the background flusher (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        """Stop the flusher and write out anything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Notification flush failed: {str(e)}")
+
+    async def flush(self) -> int:
+        """Write every buffered notification; returns how many events were flushed"""
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        plain = []
+        groups: Dict[Tuple[str, str], List[dict]] = {}
+        for notification in batch:
+            if notification["type"] in COALESCED_TYPES:
+                groups.setdefault((notification["userId"], group_key(notification)), []).append(notification)
+            else:
+                plain.append(notification)
+
+        # New unread documents per recipient
+        unread_deltas: Dict[str, int] = {}
+
+        if plain:
+            failed = set()
+            try:
+                await self.collection.insert_many(plain, ordered=False)
+            except BulkWriteError as e:
+                failed = {err["index"] for err in e.details.get("writeErrors", [])}
+                logger.warning(f"{len(failed)} notifications failed to insert")
+            for i, notification in enumerate(plain):
+                notification.pop("_id", None)
+                if i not in failed and not notification.get("read"):
+                    unread_deltas[notification["userId"]] = unread_deltas.get(notification["userId"], 0) + 1
+
+        if groups:
+            keys = list(groups)
+            try:
+                result = await self.collection.bulk_write(
+                    [self._coalesce_op(userId, key, groups[(userId, key)]) for userId, key in keys],
+                    ordered=False
+                )
+                upserted = result.upserted_ids.keys()
+            except BulkWriteError as e:
+                upserted = [u["index"] for u in e.details.get("upserted", [])]
+                logger.warning(f"Failed to write some coalesced notifications: {e.details.get('writeErrors', [])[:3]}")
+            except PyMongoError as e:
+                upserted = []
+                logger.warning(f"Failed to write coalesced notifications: {str(e)}")
+            # Only a newly created group document adds to the unread count
+            for index in upserted:
+                userId = keys[index][0]
+                unread_deltas[userId] = unread_deltas.get(userId, 0) + 1
+
+        try:
+            await self.unread.add(unread_deltas)
+        except PyMongoError as e:
+            logger.warning(f"Failed to update unread counters: {str(e)}")
+
+        await self._push(plain, groups)
+        return len(batch)
+
+    @staticmethod
+    def _coalesce_op(userId: str, key: str, events: List[dict]) -> UpdateOne:
+        """Upsert one unread group document, folding in `events` (oldest first)"""
+        latest = events[-1]
+        actor_ids = list(dict.fromkeys(e.get("fromUserId") for e in events if e.get("fromUserId")))
+        anonymous = sum(1 for e in events if not e.get("fromUserId"))
+        # Actors not yet in the group, in arrival order (every $set expression sees the old document)
+        new_actors = {"$filter": {
+            "input": {"$literal": actor_ids},
+            "cond": {"$not": {"$in": ["$$this", {"$ifNull": ["$actorIds", []]}]}}
+        }}
+        name = latest.get("fromUserName") or "Someone"
+        verb = COALESCED_TYPES[latest["type"]]
+        # Pipeline update so the message can be built from the new actorCount,
+        # which counts distinct actors (like -> unlike -> like counts once).
+        # User-supplied values are wrapped in $literal so a leading "$" is never
+        # read as a field path.
+        return UpdateOne(
+            {"userId": userId, "groupKey": key, "read": False},
+            [
+                {"$set": {
+                    "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+                    "type": latest["type"],
+                    "link": {"$literal": latest.get("link", "")},
+                    "payload": {"$literal": latest.get("payload", {})},
+                    "fromUserId": {"$literal": latest.get("fromUserId", "")},
+                    "fromUserName": {"$literal": latest.get("fromUserName", "")},
+                    "fromUserAvatar": {"$literal": latest.get("fromUserAvatar", "")},
+                    "actorCount": {"$add": [{"$ifNull": ["$actorCount", 0]}, {"$size": new_actors}, anonymous]},
+                    "actorIds": {"$slice": [
+                        {"$concatArrays": [{"$ifNull": ["$actorIds", []]}, new_actors]},
+                        MAX_TRACKED_ACTORS
+                    ]},
+                    "recentActors": {"$slice": [
+                        {"$concatArrays": [{"$ifNull": ["$recentActors", []]}, new_actors]},
+                        -MAX_RECENT_ACTORS
+                    ]},
+                    "createdAt": latest.get("createdAt") or datetime.now(timezone.utc).isoformat()
+                }},
+                {"$set": {"message": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$actorCount", 1]}, "then": {"$literal": f"{name} {verb}"}},
+                        {"case": {"$eq": ["$actorCount", 2]}, "then": {"$literal": f"{name} and 1 other {verb}"}}
+                    ],
+                    "default": {"$concat": [
+                        {"$literal": name}, " and ", {"$toString": {"$subtract": ["$actorCount", 1]}}, f" others {verb}"
+                    ]}
+                }}}}
+            ],
+            upsert=True
+        )
+
+    async def _push(self, plain: List[dict], groups: Dict[Tuple[str, str], List[dict]]):
+        """Send one realtime event per recipient listing what just arrived"""
+        by_user: Dict[str, List[dict]] = {}
+        for notification in plain:
+            by_user.setdefault(notification["userId"], []).append(notification)
+        for (userId, key), events in groups.items():
+            latest = events[-1]
+            by_user.setdefault(userId, []).append({
+                "type": latest["type"],
+                "groupKey": key,
+                "link": latest.get("link", ""),
+                "fromUserId": latest.get("fromUserId", ""),
+                "fromUserName": latest.get("fromUserName", ""),
+                "count": len(events)
+            })
+
+        try:
+            unread = await self.unread.get_many(by_user)
+        except PyMongoError:
+            unread = {}
+        for userId, items in by_user.items():
+            try:
+                await self.emit(userId, "notifications", {"notifications": items, "unread": unread.get(userId)})
+            except Exception as e:
+                logger.warning(f"Failed to push notifications to {userId}: {str(e)}")
@@ -0,0 +1,256 @@
+"""
+Request Profiling Module
+Opt-in statistical profiling of single HTTP requests, triggered by an admin
+header or a sampling rate. A sampler thread records where the request's
+task is (running on the loop, or suspended at an await) every few
+milliseconds; the result is stored with wall, Mongo and CPU time as
+collapsed stacks that flamegraph tools (flamegraph.pl, speedscope) read
+directly. When neither trigger is configured the middleware is not
+installed at all.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from mongo_monitor import current_request_stats
+from metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+# Requests carrying `X-Profile: <PROFILE_TOKEN>` are profiled
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+# Fraction of all requests profiled (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+PROFILE_RETENTION_DAYS = int(os.environ.get('PROFILE_RETENTION_DAYS', 7))
+# Distinct stacks kept per profile; the rest are folded into one line
+MAX_STACKS = 5000
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+AWAIT_FRAME = "[await]"
+
+
+def _label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(";", ",")
+
+
+def _running_stack(frame) -> List[str]:
+    """Thread stack, outermost first, starting below the event loop's callback runner"""
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    for i in range(len(codes) - 1, -1, -1):
+        if codes[i].co_name == "_run" and codes[i].co_filename.endswith(os.path.join("asyncio", "events.py")):
+            codes = codes[i + 1:]
+            break
+    return [_label(code) for code in codes]
+
+
+def _await_stack(task: asyncio.Task) -> List[str]:
+    """Coroutine chain of a suspended task, outermost first, ending at the pending await"""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    stack.append(AWAIT_FRAME)
+    return stack
+
+
+class ProfileSession:
+    """
+    Samples one request's task from a background thread.
+
+    Each tick, if the task is the one running on the loop, the loop thread's
+    stack is recorded (on-CPU); otherwise the task's coroutine chain is
+    recorded, ending in "[await]" (waiting on I/O or for the loop). Work the
+    request hands to thread pools shows up as the await that waits for it.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.running_samples = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Call from the request's task"""
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()  # wakes immediately; at most one sample in progress
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # The loop mutates frames and coroutines under us; drop the odd torn sample
+                continue
+
+    def _sample(self):
+        if asyncio.current_task(self._loop) is self._task:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                return
+            stack = _running_stack(frame)
+            self.running_samples += 1
+        else:
+            stack = _await_stack(self._task)
+        key = ";".join(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text ("frame;frame;frame count" per line), heaviest first"""
+        ranked = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        lines = [f"{stack} {count}" for stack, count in ranked[:MAX_STACKS]]
+        dropped = sum(count for _, count in ranked[MAX_STACKS:])
+        if dropped:
+            lines.append(f"[truncated] {dropped}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class RequestProfiler:
+    """Decides which requests to profile and stores the results in `request_profiles`"""
+
+    def __init__(self, db, token: Optional[str] = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        """
+        Args:
+            db: Motor database handle
+            token: Value of the X-Profile header that profiles a request
+            sample_rate: Fraction of requests profiled without the header
+        """
+        self.profiles = db.request_profiles
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval_ms = interval_ms
+        self._saves = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    async def create_indexes(self):
+        await self.profiles.create_index("id", unique=True)
+        await self.profiles.create_index([("createdAt", -1)])
+        await self.profiles.create_index("expireAt", expireAfterSeconds=0)
+
+    def should_profile(self, scope: dict) -> bool:
+        if self.token:
+            for name, value in scope.get("headers", ()):
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token.encode())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def store(self, profile: dict):
+        """Save a finished profile without holding up the response"""
+        task = asyncio.create_task(self._save(profile))
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    async def _save(self, profile: dict):
+        now = datetime.now(timezone.utc)
+        try:
+            await self.profiles.insert_one({
+                **profile,
+                "createdAt": now.isoformat(),
+                "expireAt": now + timedelta(days=PROFILE_RETENTION_DAYS)
+            })
+        except PyMongoError as e:
+            logger.warning(f"Failed to store request profile {profile['id']}: {str(e)}")
+
+    async def get(self, profileId: str) -> Optional[dict]:
+        return await self.profiles.find_one({"id": profileId}, {"_id": 0, "expireAt": 0})
+
+    async def recent(self, limit: int = 50) -> List[dict]:
+        """Latest profiles, without their stacks"""
+        return await self.profiles.find(
+            {}, {"_id": 0, "expireAt": 0, "collapsed": 0}
+        ).sort("createdAt", -1).limit(limit).to_list(limit)
+
+    async def drain(self):
+        """Wait for pending saves (shutdown)"""
+        if self._saves:
+            await asyncio.gather(*list(self._saves), return_exceptions=True)
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling the requests RequestProfiler selects.
+    Profiled responses carry an X-Profile-Id header naming the stored
+    profile. Install inside MongoRequestMiddleware so Mongo time is known.
+    """
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        profile_id = str(uuid.uuid4())
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER, profile_id.encode())]
+            await send(message)
+
+        session = ProfileSession(self.profiler.interval_ms)
+        session.start()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            wall = time.perf_counter() - start
+            process_cpu = time.process_time() - cpu_start
+            session.stop()
+            mongo = current_request_stats()
+            self.profiler.store({
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route_template(scope),
+                "status": status,
+                "wallMs": round(wall * 1000, 1),
+                "mongoMs": round(mongo.seconds * 1000, 1) if mongo else None,
+                "mongoCommands": mongo.commands if mongo else None,
+                # On-loop samples of this request; processCpuMs also includes concurrent requests
+                "cpuMs": round(session.running_samples * session.interval * 1000, 1),
+                "processCpuMs": round(process_cpu * 1000, 1),
+                "samples": session.samples,
+                "intervalMs": self.profiler.interval_ms,
+                "collapsed": session.collapsed()
+            })
@@ -0,0 +1,292 @@
+"""
+Time-Series Rollup Module
+Periodically rolls platform activity (followers, posts, likes, active users, wallet
+volume) into compact hourly and daily time-series documents, and serves range
+queries over them with downsampling.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from counters import COUNTER_METRICS, PLATFORM_SCOPE_ID, day_key
+
+logger = logging.getLogger(__name__)
+
+# Platform series. Every metric except activeUsers is a per-bucket delta and is
+# summed when downsampling; activeUsers is a distinct count and takes the max.
+SERIES_METRICS = ["followers", "posts", "likes", "activeUsers", "walletVolume"]
+GAUGE_METRICS = {"activeUsers"}
+
+# Range caps keep every query to a bounded number of series documents
+MAX_HOURLY_RANGE = timedelta(days=31)
+MAX_DAILY_RANGE = timedelta(days=731)
+
+# How far back the job back-fills hours it missed while the server was down
+MAX_CATCHUP_HOURS = 48
+
+
+def floor_hour(moment: datetime) -> datetime:
+    """Truncate a datetime to the start of its UTC hour"""
+    return moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(moment: datetime) -> datetime:
+    """Truncate a datetime to the start of its UTC day"""
+    return floor_hour(moment).replace(hour=0)
+
+
+def format_growth(current: float, previous: float) -> str:
+    """Format a period-over-period change as a signed percentage, e.g. "+15%" """
+    if previous <= 0:
+        return "+0%"
+    change = (current - previous) / previous * 100
+    return f"{change:+.0f}%"
+
+
+class TimeSeriesRollup:
+    """
+    Hourly/daily rollup job and range-query service.
+
+    Platform series are bucketed into `metric_series` documents: one document per
+    day holding 24 hourly points, and one per month holding its daily points.
+    Per-user series are served from the engagement counters' daily buckets.
+    """
+
+    def __init__(self, db, counters):
+        """
+        Args:
+            db: Motor database handle
+            counters: EngagementCounters instance (source of like/follower deltas)
+        """
+        self.db = db
+        self.counters = counters
+        self.series = db.metric_series
+        self.state = db.metric_rollup_state
+        self._task = None
+
+    async def create_indexes(self):
+        """Create the series key index and the createdAt indexes the rollup scans use"""
+        await self.series.create_index(
+            [("scope", 1), ("scopeId", 1), ("resolution", 1), ("period", 1)], unique=True
+        )
+        await self.db.wallet_transactions.create_index([("createdAt", -1)])
+        await self.db.comments.create_index([("createdAt", -1)])
+        await self.db.checkins.create_index([("checkedInAt", -1)])
+
+    # ----- Rollup job -----
+
+    def start(self):
+        """Start the background rollup loop (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        """Cancel the background rollup loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.catch_up()
+            except Exception as e:
+                logger.warning(f"Metric rollup failed: {str(e)}")
+
+            # Wake a few seconds after the next hour boundary
+            now = datetime.now(timezone.utc)
+            next_hour = floor_hour(now) + timedelta(hours=1, seconds=5)
+            await asyncio.sleep((next_hour - now).total_seconds())
+
+    async def catch_up(self):
+        """Roll up every completed hour (and day) since the last run"""
+        current_hour = floor_hour(datetime.now(timezone.utc))
+        state = await self.state.find_one({"_id": PLATFORM_SCOPE_ID}) or {}
+
+        if state.get("lastHour"):
+            hour = datetime.fromisoformat(state["lastHour"]) + timedelta(hours=1)
+        else:
+            hour = current_hour - timedelta(hours=1)
+        hour = max(hour, current_hour - timedelta(hours=MAX_CATCHUP_HOURS))
+
+        while hour < current_hour:
+            await self.rollup_hour(hour)
+            if hour.hour == 23:
+                await self.rollup_day(floor_day(hour))
+            hour += timedelta(hours=1)
+
+    async def rollup_hour(self, hour_start: datetime):
+        """
+        Compute and store the platform point for one hour.
+
+        Post counts, active users and wallet volume come from createdAt range scans
+        over that hour only. Likes and followers are the change in the platform
+        engagement counters since the previous rollup, so hours missed during
+        downtime fold into the first hour processed afterwards.
+        """
+        hour_end = hour_start + timedelta(hours=1)
+        time_range = {"$gte": hour_start.isoformat(), "$lt": hour_end.isoformat()}
+
+        platform = await self.counters.get("platform", PLATFORM_SCOPE_ID)
+        totals = platform["totals"]
+        state = await self.state.find_one({"_id": PLATFORM_SCOPE_ID}) or {}
+        snapshot = state.get("snapshot") or totals
+
+        point = {
+            "posts": await self.db.posts.count_documents({"createdAt": time_range}),
+            "likes": totals["likes"] - snapshot.get("likes", 0),
+            "followers": totals["followers"] - snapshot.get("followers", 0),
+            "activeUsers": len(await self._active_users(time_range)),
+            "walletVolume": await self._wallet_volume(time_range)
+        }
+
+        await self.series.update_one(
+            {"scope": "platform", "scopeId": PLATFORM_SCOPE_ID, "resolution": "hour", "period": day_key(hour_start)},
+            {"$set": {f"points.{hour_start.strftime('%H')}": point}},
+            upsert=True
+        )
+        await self.state.update_one(
+            {"_id": PLATFORM_SCOPE_ID},
+            {"$set": {
+                "lastHour": hour_start.isoformat(),
+                "snapshot": {metric: totals[metric] for metric in COUNTER_METRICS}
+            }},
+            upsert=True
+        )
+
+    async def rollup_day(self, day_start: datetime):
+        """Fold a day's 24 hourly points into its daily point"""
+        hourly = await self.series.find_one(
+            {"scope": "platform", "scopeId": PLATFORM_SCOPE_ID, "resolution": "hour", "period": day_key(day_start)},
+            {"_id": 0, "points": 1}
+        ) or {}
+
+        point = {metric: 0 for metric in SERIES_METRICS}
+        for hour_point in hourly.get("points", {}).values():
+            for metric in SERIES_METRICS:
+                if metric not in GAUGE_METRICS:
+                    point[metric] += hour_point.get(metric, 0)
+
+        # Distinct users over the whole day, not the sum of hourly distincts
+        day_range = {"$gte": day_start.isoformat(), "$lt": (day_start + timedelta(days=1)).isoformat()}
+        point["activeUsers"] = len(await self._active_users(day_range))
+
+        await self.series.update_one(
+            {"scope": "platform", "scopeId": PLATFORM_SCOPE_ID, "resolution": "day", "period": day_start.strftime("%Y-%m")},
+            {"$set": {f"points.{day_start.strftime('%d')}": point}},
+            upsert=True
+        )
+
+    async def _active_users(self, time_range: dict) -> set:
+        """Distinct users who posted, commented, paid or checked in within a range"""
+        active = set(await self.db.posts.distinct("authorId", {"createdAt": time_range}))
+        active.update(await self.db.comments.distinct("authorId", {"createdAt": time_range}))
+        active.update(await self.db.wallet_transactions.distinct("userId", {"createdAt": time_range}))
+        active.update(await self.db.checkins.distinct("userId", {"checkedInAt": time_range}))
+        return active
+
+    async def _wallet_volume(self, time_range: dict) -> float:
+        rows = await self.db.wallet_transactions.aggregate([
+            {"$match": {"createdAt": time_range}},
+            {"$group": {"_id": None, "volume": {"$sum": "$amount"}}}
+        ]).to_list(1)
+        return round(rows[0]["volume"], 2) if rows else 0.0
+
+    # ----- Range queries -----
+
+    async def query(
+        self,
+        metric: str,
+        start: datetime,
+        end: datetime,
+        resolution: str = "hour",
+        step: int = 1,
+        userId: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Return a metric's points in [start, end), downsampled by `step` buckets.
+
+        Args:
+            metric: Platform metric (SERIES_METRICS) or, with userId, a counter metric
+            start: Range start (inclusive)
+            end: Range end (exclusive)
+            resolution: "hour" or "day" (user series are daily only)
+            step: Number of consecutive buckets merged into each returned point
+            userId: Serve the user's series from the engagement counters instead
+
+        Returns:
+            List of {"t": bucket start ISO timestamp, "value": number}
+
+        Raises:
+            ValueError: On an unknown metric/resolution or an oversized range
+        """
+        if resolution not in ("hour", "day") or (userId and resolution != "day"):
+            raise ValueError("resolution must be 'hour' or 'day' (user series are daily)")
+        valid_metrics = COUNTER_METRICS if userId else SERIES_METRICS
+        if metric not in valid_metrics:
+            raise ValueError(f"metric must be one of {', '.join(valid_metrics)}")
+        if step < 1:
+            raise ValueError("step must be at least 1")
+
+        max_range = MAX_HOURLY_RANGE if resolution == "hour" else MAX_DAILY_RANGE
+        if end <= start or end - start > max_range:
+            raise ValueError(f"range must be positive and at most {max_range.days} days")
+
+        if resolution == "hour":
+            cursor, delta = floor_hour(start), timedelta(hours=1)
+        else:
+            cursor, delta = floor_day(start), timedelta(days=1)
+
+        slots = []
+        while cursor < end:
+            slots.append(cursor)
+            cursor += delta
+
+        values = await (self._user_values(metric, slots, userId) if userId else self._platform_values(metric, slots, resolution))
+
+        points = []
+        for i in range(0, len(slots), step):
+            chunk = values[i:i + step]
+            value = max(chunk) if metric in GAUGE_METRICS else sum(chunk)
+            points.append({"t": slots[i].isoformat(), "value": value})
+        return points
+
+    async def _platform_values(self, metric: str, slots: List[datetime], resolution: str) -> List[float]:
+        if resolution == "hour":
+            period_of, slot_of = day_key, lambda s: s.strftime("%H")
+        else:
+            period_of, slot_of = (lambda s: s.strftime("%Y-%m")), (lambda s: s.strftime("%d"))
+
+        periods = sorted({period_of(s) for s in slots})
+        docs = await self.series.find(
+            {"scope": "platform", "scopeId": PLATFORM_SCOPE_ID, "resolution": resolution, "period": {"$in": periods}},
+            {"_id": 0, "period": 1, "points": 1}
+        ).to_list(len(periods))
+        by_period = {d["period"]: d.get("points", {}) for d in docs}
+
+        return [by_period.get(period_of(s), {}).get(slot_of(s), {}).get(metric, 0) for s in slots]
+
+    async def _user_values(self, metric: str, slots: List[datetime], userId: str) -> List[float]:
+        days = [day_key(s) for s in slots]
+        buckets = await self.db.engagement_daily.find(
+            {"scope": "user", "scopeId": userId, "day": {"$gte": days[0], "$lte": days[-1]}},
+            {"_id": 0, "day": 1, metric: 1}
+        ).to_list(len(days))
+        by_day = {b["day"]: b.get(metric, 0) for b in buckets}
+        return [by_day.get(day, 0) for day in days]
+
+    async def platform_window(self, metric: str, days: int, offset_days: int = 0) -> float:
+        """
+        Aggregate a platform metric over `days` whole days ending `offset_days` ago.
+
+        Reads one monthly series document per month touched.
+        """
+        end = floor_day(datetime.now(timezone.utc)) - timedelta(days=offset_days)
+        points = await self.query(metric, end - timedelta(days=days), end, resolution="day", step=days)
+        return points[0]["value"] if points else 0
@@ -0,0 +1,260 @@
+"""
+Content Safety Module
+Screens text against a categorized lexicon with a compiled Aho-Corasick
+automaton, so one pass over a message finds every listed term regardless of
+lexicon size. Text is normalized first (Unicode compatibility forms,
+accents, zero-width characters, leetspeak, spaced-out and stretched letters)
+to defeat simple obfuscation; ambiguous readings ("1" as i or l, stretched
+letters) are all matched. Write paths screen inline and hand flagged
+content to async hooks (moderation queue, alerts) without waiting on them.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import unicodedata
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Category -> terms; replaced by the JSON file at SAFETY_LEXICON_PATH when set
+DEFAULT_LEXICON = {
+    "violence": ["kill", "murder", "bomb", "shoot", "stab", "terrorist", "violence"],
+    "hate": ["hate", "racist", "bigot", "nazi"],
+    "harassment": ["kill yourself", "kys", "nobody likes you", "go die"],
+    "spam": ["free money", "click here", "crypto giveaway", "double your money"],
+}
+
+# Categories that reject a write outright (comma separated); others are only flagged
+SAFETY_BLOCK_CATEGORIES = {
+    c.strip() for c in os.environ.get('SAFETY_BLOCK_CATEGORIES', 'harassment').split(",") if c.strip()
+}
+
+_LEET = str.maketrans({"0": "o", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+# "1" stands for either letter ("k1ll", "ki11"); text is matched with both readings
+_LEET_ONE = ("i", "l")
+_ZERO_WIDTH = dict.fromkeys(map(ord, "​‌‍⁠﻿­"))
+# Single letters separated by single separators: "k.i.l.l", "k i l l"
+_SPACED = re.compile(r"\b(?:[^\W_][\W_]){2,}[^\W_]\b")
+_SEPARATOR = re.compile(r"[\W_]+")
+# Three or more of the same character: stretching ("kiiiill"), never spelling
+_STRETCH = re.compile(r"(.)\1{2,}")
+
+
+def _fold(text: str) -> str:
+    """NFKC, casefolded, accents and zero-width characters removed, leetspeak mapped (except "1")"""
+    text = unicodedata.normalize("NFKC", text or "").translate(_ZERO_WIDTH).casefold()
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return text.translate(_LEET)
+
+
+def _canonical(folded: str, one: str, stretch: str) -> str:
+    text = folded.replace("1", one)
+    text = _SPACED.sub(lambda m: _SEPARATOR.sub("", m.group(0)), text)
+    text = _STRETCH.sub(stretch, text)
+    return " " + _SEPARATOR.sub(" ", text).strip() + " "
+
+
+def normalize(text: str) -> str:
+    """
+    Canonical form used for matching: folded (see _fold), "1" read as "i",
+    spaced-out letters joined, runs of 3+ characters cut to 2 (so "shoot"
+    keeps its spelling), separators collapsed to one space.
+    """
+    return _canonical(_fold(text), "i", r"\1\1")
+
+
+def variants(text: str) -> List[str]:
+    """
+    Every reading of a text worth matching: "1" as "i" and as "l", and
+    stretched runs cut to two and to one character ("kiiiill" -> "kill").
+    Usually just the canonical form.
+    """
+    folded = _fold(text)
+    ones = _LEET_ONE if "1" in folded else _LEET_ONE[:1]
+    stretches = (r"\1\1", r"\1") if _STRETCH.search(folded) else (r"\1\1",)
+    return list(dict.fromkeys(_canonical(folded, one, stretch) for one in ones for stretch in stretches))
+
+
+def load_lexicon() -> Dict[str, List[str]]:
+    path = os.environ.get('SAFETY_LEXICON_PATH')
+    if not path:
+        return DEFAULT_LEXICON
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load safety lexicon {path}: {e}; using the default")
+        return DEFAULT_LEXICON
+
+
+class SafetyClassifier:
+    """
+    Aho-Corasick matcher over a normalized lexicon.
+
+    Terms are normalized like the text and padded with spaces, so matches
+    fall on whole words ("skill" does not match "kill"). Multi-word terms
+    are also compiled without their spaces, for fully spaced-out text
+    ("k i l l y o u r s e l f"). The automaton is built once; classify()
+    scans each reading of the message (see variants()), usually one.
+    """
+
+    def __init__(self, lexicon: Dict[str, Iterable[str]]):
+        """
+        Args:
+            lexicon: Category -> terms
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, str]]] = [[]]
+        for category, terms in lexicon.items():
+            for term in terms:
+                pattern = normalize(term)
+                if not pattern.strip():
+                    continue
+                self._add(pattern, (category, term))
+                joined = " " + pattern.replace(" ", "") + " "
+                if joined != pattern:
+                    self._add(joined, (category, term))
+        self._build()
+
+    def _add(self, pattern: str, output: Tuple[str, str]):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(output)
+
+    def _build(self):
+        """Breadth-first failure links; each node also emits its failure chain's outputs"""
+        queue = deque(self._goto[0].values())  # depth-1 nodes fail to the root
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def matches(self, text: str) -> List[Tuple[str, str]]:
+        """Distinct (category, term) pairs found in any reading of the text"""
+        found = {}
+        for variant in variants(text):
+            found.update(dict.fromkeys(self._scan(variant)))
+        return list(found)
+
+    def _scan(self, normalized: str) -> List[Tuple[str, str]]:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        found = []
+        for ch in normalized:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.extend(out[node])
+        return found
+
+    def classify(self, text: str) -> dict:
+        """{"safe", "categories", "matches"} for one text"""
+        found = self.matches(text)
+        categories = sorted({category for category, _ in found})
+        return {
+            "safe": not categories,
+            "categories": categories,
+            "matches": sorted({term for _, term in found})
+        }
+
+
+SafetyHook = Callable[[dict], Awaitable[None]]
+
+
+class SafetyScreen:
+    """
+    Inline screening for write paths.
+
+    check() classifies synchronously (no I/O). Content in a blocking category
+    is rejected; other flagged content is written and passed to every hook
+    as {"id", "kind", "refId", "userId", "text", "categories", "matches",
+    "blocked", "createdAt"}. Hooks run as background tasks.
+    """
+
+    def __init__(self, classifier: SafetyClassifier, block_categories: Iterable[str] = ()):
+        self.classifier = classifier
+        self.block_categories = set(block_categories)
+        self._hooks: List[SafetyHook] = []
+        self._tasks = set()
+
+    def add_hook(self, hook: SafetyHook):
+        self._hooks.append(hook)
+
+    def check(self, kind: str, text: Optional[str], userId: str, refId: Optional[str] = None) -> dict:
+        """
+        Screen text about to be written.
+
+        Args:
+            kind: What is being written ("post", "dm", "room_message", ...)
+            refId: ID of the document being written
+
+        Raises:
+            HTTPException: 400 when the text falls in a blocking category
+        """
+        verdict = self.classifier.classify(text or "")
+        if verdict["safe"]:
+            return verdict
+
+        blocked = bool(self.block_categories.intersection(verdict["categories"]))
+        self._dispatch({
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "refId": refId,
+            "userId": userId,
+            "text": text,
+            "categories": verdict["categories"],
+            "matches": verdict["matches"],
+            "blocked": blocked,
+            "createdAt": datetime.now(timezone.utc).isoformat()
+        })
+        if blocked:
+            raise HTTPException(status_code=400, detail="This content violates our community guidelines")
+        return verdict
+
+    def _dispatch(self, event: dict):
+        for hook in self._hooks:
+            task = asyncio.create_task(self._run_hook(hook, event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run_hook(hook: SafetyHook, event: dict):
+        try:
+            await hook(event)
+        except Exception as e:
+            logger.warning(f"Safety hook {getattr(hook, '__name__', hook)} failed: {str(e)}")
+
+    async def drain(self):
+        """Wait for running hooks (shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+def moderation_queue_hook(db) -> SafetyHook:
+    """Hook recording every flag in `safety_flags` for moderator review"""
+    async def record_flag(event: dict):
+        await db.safety_flags.insert_one({**event, "status": "pending"})
+    return record_flag
@@ -0,0 +1,337 @@
+"""
+Content Search Module
+Tokenized inverted index over posts, reels and events with BM25 scoring.
+Postings are kept in MongoDB ordered by their precomputed BM25 term impact,
+so a recommendation query reads a bounded number of postings per term and
+its cost does not grow with the size of the corpus. Also ranks ad-hoc
+document sets (the /ai/rank API) with vectorized BM25 over NumPy arrays.
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Highest-impact postings read per query term
+POSTINGS_PER_TERM = 500
+BACKFILL_BATCH = 200
+
+# Indexed kinds: collection and the fields whose text is indexed
+INDEXED_KINDS = {
+    "post": {"collection": "posts", "fields": ["text", "hashtags"]},
+    "reel": {"collection": "reels", "fields": ["caption"]},
+    "event": {"collection": "events", "fields": ["name", "description", "category", "location"]},
+}
+
+# Query terms contributed by each TasteDNA category, weighted by its score
+CATEGORY_TERMS = {
+    "food": ["food", "cafe", "restaurant", "biryani", "chai", "coffee", "brunch", "street", "dessert"],
+    "music": ["music", "concert", "gig", "dj", "live", "band", "festival", "edm", "indie"],
+    "spiritual": ["temple", "spiritual", "meditation", "yoga", "prayer", "festival", "peace"],
+    "social": ["friends", "party", "meetup", "community", "weekend", "night", "startup"],
+    "fitness": ["fitness", "gym", "run", "workout", "cycling", "trek", "sports", "yoga"],
+    "art": ["art", "design", "photography", "gallery", "creative", "books", "poetry", "comic"],
+}
+CATEGORY_WEIGHT = 0.5  # relative to an explicit interest
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its my of on or our so that the this to "
+    "was we were will with you your".split()
+)
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords ("#Biryani!" -> ["biryani"])"""
+    return [t for t in _TOKEN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def document_text(kind: str, doc: dict) -> str:
+    parts = []
+    for field in INDEXED_KINDS[kind]["fields"]:
+        value = doc.get(field)
+        if isinstance(value, list):
+            parts.extend(str(v) for v in value)
+        elif value:
+            parts.append(str(value))
+    return " ".join(parts)
+
+
+def bm25_idf(df: int, docs: int) -> float:
+    return math.log(1 + (docs - df + 0.5) / (df + 0.5))
+
+
+def bm25_tf(tf: int, length: int, avg_length: float) -> float:
+    """Term-frequency component of BM25 (saturating, length-normalized)"""
+    norm = 1 - BM25_B + BM25_B * length / max(avg_length, 1e-9)
+    return tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+
+def taste_query(interests: Iterable[str], categories: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """
+    Weighted query terms for a user: every token of their interests at 1.0,
+    plus each TasteDNA category's terms scaled by its score.
+    """
+    weights: Dict[str, float] = {}
+    for category, score in (categories or {}).items():
+        for term in CATEGORY_TERMS.get(category, []):
+            weights[term] = max(weights.get(term, 0), CATEGORY_WEIGHT * float(score or 0) / 100)
+    for interest in interests:
+        for term in tokenize(interest):
+            weights[term] = weights.get(term, 0) + 1.0
+    return weights
+
+
+class ContentIndex:
+    """
+    MongoDB-backed inverted index.
+
+    - `content_postings`: one {kind, term, docId, tf, len, impact}
+      per (document, distinct term), indexed by (kind, term, impact desc)
+    - `content_terms`: document frequency per (kind, term)
+    - `content_index_stats`: document count and total length per kind
+
+    `impact` is the BM25 tf component at indexing time and is only used to
+    choose which postings to read; candidates are re-scored with the current
+    corpus statistics. Indexed source documents get a `searchIndexedAt` mark,
+    and a background pass indexes anything created without going through add().
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self.postings = db.content_postings
+        self.terms = db.content_terms
+        self.stats = db.content_index_stats
+        self._task = None
+
+    async def create_indexes(self):
+        await self.postings.create_index([("kind", 1), ("term", 1), ("impact", -1)])
+        await self.postings.create_index([("kind", 1), ("docId", 1)])
+        await self.terms.create_index([("kind", 1), ("term", 1)], unique=True)
+        for spec in INDEXED_KINDS.values():
+            await self.db[spec["collection"]].create_index("searchIndexedAt", sparse=True)
+
+    async def _kind_stats(self, kind: str) -> Tuple[int, float]:
+        stats = await self.stats.find_one({"_id": kind}) or {}
+        docs = stats.get("docs", 0)
+        return docs, (stats.get("length", 0) / docs if docs else 0.0)
+
+    async def add(self, kind: str, doc: dict):
+        """Index (or re-index) one document"""
+        await self.add_many(kind, [doc])
+
+    async def add_many(self, kind: str, docs: List[dict]):
+        docs = [d for d in docs if d.get("id")]
+        if not docs:
+            return
+        ids = [d["id"] for d in docs]
+        await self.remove_many(kind, ids)
+
+        count, avg_length = await self._kind_stats(kind)
+        tokenized = {d["id"]: tokenize(document_text(kind, d)) for d in docs}
+        total_length = sum(len(tokens) for tokens in tokenized.values())
+        # Include this batch so early documents get sensible impacts
+        avg_length = (avg_length * count + total_length) / (count + len(docs))
+
+        inserts, df = [], Counter()
+        for doc in docs:
+            tokens = tokenized[doc["id"]]
+            for term, tf in Counter(tokens).items():
+                df[term] += 1
+                inserts.append(InsertOne({
+                    "kind": kind, "term": term, "docId": doc["id"], "tf": tf, "len": len(tokens),
+                    "impact": bm25_tf(tf, len(tokens), avg_length)
+                }))
+        if inserts:
+            await self.postings.bulk_write(inserts, ordered=False)
+        if df:
+            await self.terms.bulk_write([
+                UpdateOne({"kind": kind, "term": term}, {"$inc": {"df": n}}, upsert=True) for term, n in df.items()
+            ], ordered=False)
+        await self.stats.update_one({"_id": kind}, {"$inc": {"docs": len(docs), "length": total_length}}, upsert=True)
+        await self.db[INDEXED_KINDS[kind]["collection"]].update_many(
+            {"id": {"$in": ids}}, {"$set": {"searchIndexedAt": datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def remove_many(self, kind: str, ids: List[str]):
+        """Drop documents' postings and their share of the corpus statistics"""
+        existing = await self.postings.find(
+            {"kind": kind, "docId": {"$in": ids}}, {"_id": 0, "docId": 1, "term": 1, "len": 1}
+        ).to_list(None)
+        if not existing:
+            return
+        df = Counter(p["term"] for p in existing)
+        lengths = {p["docId"]: p["len"] for p in existing}
+        await self.postings.bulk_write([DeleteMany({"kind": kind, "docId": {"$in": ids}})])
+        await self.terms.bulk_write([
+            UpdateOne({"kind": kind, "term": term}, {"$inc": {"df": -n}}) for term, n in df.items()
+        ], ordered=False)
+        await self.stats.update_one(
+            {"_id": kind}, {"$inc": {"docs": -len(lengths), "length": -sum(lengths.values())}}
+        )
+
+    async def reset(self):
+        """Forget everything (used when the source collections are wiped)"""
+        await self.postings.delete_many({})
+        await self.terms.delete_many({})
+        await self.stats.delete_many({})
+
+    # ----- Backfill -----
+
+    def start(self):
+        """Index documents missing from the index in the background (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.index_pending())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def index_pending(self) -> int:
+        """Index every source document without a searchIndexedAt mark"""
+        indexed = 0
+        for kind, spec in INDEXED_KINDS.items():
+            projection = {"_id": 0, "id": 1, **{f: 1 for f in spec["fields"]}}
+            try:
+                while True:
+                    batch = await self.db[spec["collection"]].find(
+                        {"searchIndexedAt": {"$exists": False}}, projection
+                    ).to_list(BACKFILL_BATCH)
+                    batch = [d for d in batch if d.get("id")]
+                    if not batch:
+                        break
+                    await self.add_many(kind, batch)
+                    indexed += len(batch)
+            except PyMongoError as e:
+                logger.warning(f"Indexing {spec['collection']} failed: {str(e)}")
+        if indexed:
+            logger.info(f"Search index: indexed {indexed} documents")
+        return indexed
+
+    # ----- Queries -----
+
+    async def search(self, kind: str, query: Dict[str, float], k: int = 20) -> List[Tuple[str, float]]:
+        """
+        Top-k documents for weighted query terms by BM25.
+
+        Args:
+            query: Term -> query weight (see taste_query)
+
+        Returns:
+            [(docId, score)] best first
+        """
+        query = {t: w for t, w in query.items() if w > 0}
+        if not query:
+            return []
+        docs, avg_length = await self._kind_stats(kind)
+        if not docs:
+            return []
+        dfs = {
+            t["term"]: t["df"]
+            async for t in self.terms.find({"kind": kind, "term": {"$in": list(query)}, "df": {"$gt": 0}})
+        }
+
+        scores: Dict[str, float] = {}
+        for term, df in dfs.items():
+            weight = query[term] * bm25_idf(df, docs)
+            async for posting in self.postings.find(
+                {"kind": kind, "term": term}, {"_id": 0, "docId": 1, "tf": 1, "len": 1}
+            ).sort("impact", -1).limit(POSTINGS_PER_TERM):
+                scores[posting["docId"]] = scores.get(posting["docId"], 0.0) + \
+                    weight * bm25_tf(posting["tf"], posting["len"], avg_length)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class RankCorpus:
+    """
+    BM25 over an ad-hoc list of documents, shared by every query ranked against it.
+
+    Documents are tokenized once into a term-sorted postings array (CSR
+    layout: `offsets[t]:offsets[t + 1]` are term t's postings) holding each
+    posting's full BM25 weight, so scoring a query is a gather of its terms'
+    slices and one bincount.
+    """
+
+    def __init__(self, documents: List[str]):
+        self.size = len(documents)
+        self.vocabulary: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = [], [], []
+        lengths = np.zeros(self.size, dtype=np.float64)
+        for i, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(i)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids = term_ids[order]
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)[order]
+        tfs = np.asarray(tfs, dtype=np.float64)[order]
+        self.offsets = np.searchsorted(term_ids, np.arange(len(self.vocabulary) + 1))
+
+        df = np.diff(self.offsets)
+        idf = np.log1p((self.size - df + 0.5) / (df + 0.5))
+        avg_length = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+        self.weights = idf[term_ids] * tfs * (BM25_K1 + 1) / (tfs + norm[self.doc_ids])
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for a query (repeated query terms count again)"""
+        scores = np.zeros(self.size, dtype=np.float64)
+        terms = Counter(t for t in tokenize(query) if t in self.vocabulary)
+        if not terms:
+            return scores
+        slices = [np.arange(self.offsets[self.vocabulary[t]], self.offsets[self.vocabulary[t] + 1]) for t in terms]
+        repeat = np.concatenate([np.full(len(sl), terms[t], dtype=np.float64) for t, sl in zip(terms, slices)])
+        postings = np.concatenate(slices)
+        return np.bincount(self.doc_ids[postings], weights=self.weights[postings] * repeat, minlength=self.size)
+
+    def top_k(self, query: str, k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        The k best documents for a query, best first (all documents when k is None).
+
+        Returns:
+            [(document index, score)]; ties keep document order, including
+            at the cut-off (the earliest of equally scored documents are kept)
+        """
+        scores = self.scores(query)
+        k = self.size if k is None else max(0, min(k, self.size))
+        if k == 0:
+            return []
+        if k < self.size:
+            # Partial selection: find the k-th best score, take everything above
+            # it and fill up with the lowest-indexed documents scoring exactly it
+            kth = -np.partition(-scores, k - 1)[k - 1]
+            above = np.flatnonzero(scores > kth)
+            top = np.concatenate([above, np.flatnonzero(scores == kth)[:k - len(above)]])
+        else:
+            top = np.arange(self.size)
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(int(i), float(scores[i])) for i in top]
@@ -1,9 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Body, UploadFile, File, Depends
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, HTTPException, Body, UploadFile, File, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import socketio
 import os
 import logging
@@ -12,29 +13,53 @@ from pydantic import BaseModel, Field, ConfigDict, EmailStr, field_validator
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-import shutil
 import random
+import hmac
 import razorpay
 import jwt
-import qrcode
-import io
-import base64
 from PIL import Image
 
 # Import the Google Sheets database module
 from sheets_db import init_sheets_db
+from counters import EngagementCounters, PLATFORM_SCOPE_ID
+from rollups import TimeSeriesRollup, format_growth
+from media import MediaStore, UploadSizeGuard
+from media_http import media_file_response, etag_is_fresh
+from venues import VenueVibe, venue_room
+from stories import StoriesTray, KIND_COLLECTIONS, item_expire_at
+from views import ViewTracker
+from geo import GeoDiscovery, point as geo_point
+from taste_index import TasteIndex
+from taste_dna import TasteDNAService, default_taste_model
+from search import ContentIndex, RankCorpus, taste_query
+from translation import TranslationService, LocalTranslationProvider
+from metrics import MetricsMiddleware, PROMETHEUS_CONTENT_TYPE, instrument_socketio, registry as metrics_registry
+from mongo_monitor import MongoCommandMonitor, MongoRequestMiddleware
+from loop_monitor import LoopLagMonitor
+from profiling import RequestProfiler, ProfilingMiddleware
+from safety import SafetyClassifier, SafetyScreen, SAFETY_BLOCK_CATEGORIES, load_lexicon, moderation_queue_hook
+from notifications import NotificationOutbox, UnreadCounters
+from tickets import TicketBooking, TicketQRCodes, TICKET_QR_CACHE_CONTROL, ticket_qr_payload, ticket_qr_url, ticket_qr_etag
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Times every command and attributes it to the request that issued it
+mongo_monitor = MongoCommandMonitor()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_monitor])
 db = client[os.environ['DB_NAME']]
 
 # Initialize Google Sheets Database (in demo mode for now)
 sheets_db = init_sheets_db(demo_mode=True)
 
+# Write-time engagement counters backing the analytics dashboards
+engagement_counters = EngagementCounters(db)
+
+# Hourly/daily time-series rollups for growth metrics
+metric_rollup = TimeSeriesRollup(db, engagement_counters)
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-this-in-production')
 JWT_ALGORITHM = 'HS256'
@@ -66,9 +91,58 @@ connected_clients = {}
 UPLOAD_DIR = Path("/app/backend/uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Serve uploaded files as static (mounted under both /uploads and /api/uploads for ingress)
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
-app.mount("/api/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads_api")
+# Streaming, content-addressed upload pipeline (async disk I/O, size limits,
+# resumable sessions, deduplication, reference-counted GC and WebP image variants)
+media_store = MediaStore(db, UPLOAD_DIR)
+
+# Active-author index behind the stories / Vibe Capsules tray
+stories_tray = StoriesTray(db)
+
+# Live venue check-in counters and vibe meter
+venue_vibe = VenueVibe(db, sio)
+
+# Story/capsule viewers (capped exact edges + HyperLogLog unique counts)
+view_tracker = ViewTracker(db)
+
+# Nearby venue/event search (2dsphere + per-grid-cell candidate cache)
+geo_discovery = GeoDiscovery(db)
+
+# Every user's TasteDNA categories as one matrix for vectorized similarity
+taste_index = TasteIndex(db)
+
+# TasteDNA profiles: cached, regenerated by a rate-limited background queue
+taste_dna_service = TasteDNAService(db, default_taste_model(os.environ.get('EMERGENT_LLM_KEY')), on_update=taste_index.upsert)
+
+# BM25 inverted index over posts, reels and events for recommendations
+content_index = ContentIndex(db)
+
+# Lexicon screening for /ai/safety and user-generated writes; flags go to the moderation queue
+safety_classifier = SafetyClassifier(load_lexicon())
+safety_screen = SafetyScreen(safety_classifier, SAFETY_BLOCK_CATEGORIES)
+safety_screen.add_hook(moderation_queue_hook(db))
+
+# Cached, coalesced, batched translation (swap the provider for a real translation API)
+translation_service = TranslationService(db, LocalTranslationProvider())
+
+# Event loop lag sampling, with stacks of whatever blocks the loop
+loop_monitor = LoopLagMonitor()
+
+# Opt-in request profiling (PROFILE_TOKEN header or PROFILE_SAMPLE_RATE)
+request_profiler = RequestProfiler(db)
+
+# Ticket QR codes, rendered lazily off the event loop
+ticket_qr = TicketQRCodes()
+
+# Atomic ticket inventory with hold/confirm booking
+ticket_booking = TicketBooking(client, db)
+
+# Serve uploaded files (under both /uploads and /api/uploads for ingress)
+@app.api_route("/uploads/{file_path:path}", methods=["GET", "HEAD"])
+@app.api_route("/api/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_upload(file_path: str, request: Request, w: Optional[int] = None):
+    """Serve an uploaded file with ETag/Range support; `w` picks the closest WebP variant for images"""
+    media = await media_store.resolve_upload(file_path, w)
+    return await media_file_response(request, media["path"], etag=media["etag"], cache_control=media["cacheControl"])
 
 # ===== AI (Emergent Integrations) =====
 try:
@@ -185,7 +259,6 @@ class VibeCapsule(BaseModel):
     thumbnailUrl: Optional[str] = None
     caption: str = ""
     duration: int = 15  # seconds for video
-    views: List[str] = Field(default_factory=list)  # List of user IDs who viewed
     reactions: dict = Field(default_factory=dict)  # {userId: reaction_emoji}
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     expiresAt: str = Field(default_factory=lambda: (datetime.now(timezone.utc) + timedelta(hours=24)).isoformat())
@@ -263,6 +336,7 @@ class Venue(BaseModel):
     description: str = ""
     avatar: str = "https://api.dicebear.com/7.x/shapes/svg?seed=venue"
     location: str = ""
+    geo: Optional[dict] = None  # GeoJSON point
     rating: float = 4.5
     menuItems: List[dict] = Field(default_factory=list)
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
@@ -275,6 +349,7 @@ class Event(BaseModel):
     image: str = ""
     date: str = ""
     location: str = ""
+    geo: Optional[dict] = None  # GeoJSON point
     tiers: List[dict] = Field(default_factory=list)
     vibeMeter: int = 85
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
@@ -296,6 +371,7 @@ class WalletTransaction(BaseModel):
     userId: str
     type: str  # topup, withdraw, payment, refund
     amount: float
+    category: str = "other"  # venues, events, marketplace, other - set at write time for analytics
     status: str = "completed"
     description: str = ""
     metadata: dict = {}
@@ -630,6 +706,12 @@ async def emit_to_user(user_id: str, event: str, data: dict):
         await sio.emit(event, data, room=sid)
         logging.info(f"Emitted {event} to user {user_id}")
 
+# Per-user unread notification counters (badge count) and read-notification expiry
+notification_unread = UnreadCounters(db)
+
+# Batched, coalescing notification writes (flushed in the background)
+notification_outbox = NotificationOutbox(db, emit_to_user, notification_unread)
+
 async def emit_to_thread(thread_id: str, event: str, data: dict, exclude_user: str = None):
     """Emit event to all users in a thread"""
     # Get thread participants
@@ -770,6 +852,30 @@ async def join_thread(sid, data):
     except Exception as e:
         logging.error(f"Join thread error: {e}")
 
+@sio.event
+async def join_venue(sid, data):
+    """Subscribe to a venue's live vibe meter"""
+    try:
+        venue_id = data.get('venueId')
+        if venue_id:
+            await sio.enter_room(sid, venue_room(venue_id))
+            await sio.emit('venue_vibe', {
+                'venueId': venue_id,
+                'activeCount': await venue_vibe.active_count(venue_id)
+            }, room=sid)
+    except Exception as e:
+        logging.error(f"Join venue error: {e}")
+
+@sio.event
+async def leave_venue(sid, data):
+    """Unsubscribe from a venue's vibe meter"""
+    try:
+        venue_id = data.get('venueId')
+        if venue_id:
+            await sio.leave_room(sid, venue_room(venue_id))
+    except Exception as e:
+        logging.error(f"Leave venue error: {e}")
+
 @sio.event
 async def leave_thread(sid, data):
     """Leave a thread room"""
@@ -1396,6 +1502,9 @@ async def update_user(userId: str, data: dict):
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    if "avatar" in update_data:
+        await media_store.set_refs("avatar", userId, [update_data["avatar"]])
+    
     return {"success": True, "message": "Profile updated"}
 
 @api_router.get("/users/{userId}/settings")
@@ -1762,7 +1871,7 @@ async def send_friend_request(fromUserId: str, toUserId: str):
             fromUserAvatar=from_user.get("avatar", ""),
             link=f"/profile/{fromUserId}"
         )
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
         
         return {"success": True, "message": "Friend request accepted automatically", "nowFriends": True}
     
@@ -1786,7 +1895,7 @@ async def send_friend_request(fromUserId: str, toUserId: str):
         fromUserAvatar=from_user.get("avatar", ""),
         link=f"/profile/{fromUserId}"
     )
-    await db.notifications.insert_one(notification.model_dump())
+    notification_outbox.enqueue(notification.model_dump())
     
     return {"success": True, "message": "Friend request sent"}
 
@@ -1829,7 +1938,7 @@ async def accept_friend_request(userId: str, friendId: str):
         fromUserAvatar=user.get("avatar", ""),
         link=f"/profile/{userId}"
     )
-    await db.notifications.insert_one(notification.model_dump())
+    notification_outbox.enqueue(notification.model_dump())
     
     return {"success": True, "message": "Friend request accepted"}
 
@@ -1934,10 +2043,14 @@ async def get_posts(limit: int = 50):
 @api_router.post("/posts")
 async def create_post(post: PostCreate, authorId: str):
     post_obj = Post(authorId=authorId, **post.model_dump())
+    safety_screen.check("post", post_obj.text, authorId, post_obj.id)
     doc = post_obj.model_dump()
     result = await db.posts.insert_one(doc)
     # Remove _id from doc before returning
     doc.pop('_id', None)
+    await engagement_counters.record(authorId, "posts")
+    await content_index.add("post", doc)
+    await media_store.set_refs("post", doc["id"], [doc.get("media")])
     # Enrich with author
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
     doc["author"] = author
@@ -1967,12 +2080,16 @@ async def toggle_like_post(postId: str, userId: str):
             notification = Notification(
                 userId=post["authorId"],
                 type="like",
-                content=f"{liker.get('name', 'Someone')} liked your post",
+                message=f"{liker.get('name', 'Someone')} liked your post",
+                fromUserId=userId,
+                fromUserName=liker.get("name", ""),
+                fromUserAvatar=liker.get("avatar", ""),
                 link=f"/posts/{postId}"
             )
-            await db.notifications.insert_one(notification.model_dump())
+            notification_outbox.enqueue(notification.model_dump())
     
     await db.posts.update_one({"id": postId}, {"$set": {"likedBy": liked_by, "stats": stats}})
+    await engagement_counters.record(post["authorId"], "likes", 1 if action == "liked" else -1)
     return {"action": action, "likes": stats["likes"]}
 
 @api_router.post("/posts/{postId}/repost")
@@ -1994,6 +2111,7 @@ async def toggle_repost(postId: str, userId: str):
         action = "reposted"
     
     await db.posts.update_one({"id": postId}, {"$set": {"repostedBy": reposted_by, "stats": stats}})
+    await engagement_counters.record(post["authorId"], "shares", 1 if action == "reposted" else -1)
     return {"action": action, "reposts": stats["reposts"]}
 
 @api_router.get("/posts/{postId}/comments")
@@ -2007,20 +2125,28 @@ async def get_post_comments(postId: str):
 @api_router.delete("/posts/{postId}")
 async def delete_post(postId: str):
     """Delete a post"""
-    result = await db.posts.delete_one({"id": postId})
-    if result.deleted_count == 0:
+    post = await db.posts.find_one_and_delete({"id": postId}, projection={"_id": 0, "authorId": 1})
+    if not post:
         raise HTTPException(status_code=404, detail="Post not found")
+    await engagement_counters.record(post.get("authorId"), "posts", -1)
+    await media_store.set_refs("post", postId, [])
+    await content_index.remove_many("post", [postId])
     return {"success": True, "message": "Post deleted"}
 
 @api_router.post("/posts/{postId}/comments")
 async def create_post_comment(postId: str, comment: CommentCreate, authorId: str):
     comment_obj = Comment(postId=postId, authorId=authorId, text=comment.text)
+    safety_screen.check("comment", comment_obj.text, authorId, comment_obj.id)
     doc = comment_obj.model_dump()
     result = await db.comments.insert_one(doc)
     doc.pop('_id', None)
     
     # Update post reply count
-    await db.posts.update_one({"id": postId}, {"$inc": {"stats.replies": 1}})
+    post = await db.posts.find_one_and_update(
+        {"id": postId}, {"$inc": {"stats.replies": 1}}, projection={"_id": 0, "authorId": 1}
+    )
+    if post:
+        await engagement_counters.record(post.get("authorId"), "comments")
     
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
     doc["author"] = author
@@ -2103,13 +2229,17 @@ async def follow_user(userId: str, targetUserId: str):
         notification = Notification(
             userId=targetUserId,
             type="follow",
-            content=f"{user.get('name', 'Someone')} started following you",
+            message=f"{user.get('name', 'Someone')} started following you",
+            fromUserId=userId,
+            fromUserName=user.get("name", ""),
+            fromUserAvatar=user.get("avatar", ""),
             link=f"/profile/{userId}"
         )
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
     
     await db.users.update_one({"id": userId}, {"$set": {"following": following}})
     await db.users.update_one({"id": targetUserId}, {"$set": {"followers": followers}})
+    await engagement_counters.record(targetUserId, "followers", 1 if action == "followed" else -1)
     
     return {"action": action, "followingCount": len(following), "followersCount": len(followers)}
 
@@ -2163,10 +2293,13 @@ async def create_quote_post(postId: str, authorId: str, text: str):
         quotedPostId=postId,
         quotedPost=original_post
     )
+    safety_screen.check("post", quote_post.text, authorId, quote_post.id)
     
     doc = quote_post.model_dump()
     await db.posts.insert_one(doc)
     doc.pop('_id', None)
+    await engagement_counters.record(authorId, "posts")
+    await content_index.add("post", doc)
     
     # Enrich with author
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
@@ -2182,10 +2315,10 @@ async def create_quote_post(postId: str, authorId: str, text: str):
         notification = Notification(
             userId=original_post["authorId"],
             type="quote",
-            content=f"{author.get('name', 'Someone')} quoted your post",
+            message=f"{author.get('name', 'Someone')} quoted your post",
             link=f"/posts/{doc['id']}"
         )
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
     
     return doc
 
@@ -2264,10 +2397,14 @@ async def create_reply(postId: str, authorId: str, text: str, mediaUrl: str = No
         media=mediaUrl,  # Fixed: Use 'media' to match Post model field
         replyToPostId=postId
     )
+    safety_screen.check("post", reply.text, authorId, reply.id)
     
     doc = reply.model_dump()
     await db.posts.insert_one(doc)
     doc.pop('_id', None)
+    await engagement_counters.record(authorId, "posts")
+    await content_index.add("post", doc)
+    await media_store.set_refs("post", doc["id"], [doc.get("media")])
     
     # Enrich with author
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
@@ -2277,16 +2414,17 @@ async def create_reply(postId: str, authorId: str, text: str, mediaUrl: str = No
     stats = original_post.get("stats", {"likes": 0, "quotes": 0, "reposts": 0, "replies": 0})
     stats["replies"] = stats["replies"] + 1
     await db.posts.update_one({"id": postId}, {"$set": {"stats": stats}})
+    await engagement_counters.record(original_post["authorId"], "comments")
     
     # Notify original author
     if original_post["authorId"] != authorId:
         notification = Notification(
             userId=original_post["authorId"],
             type="reply",
-            content=f"{author.get('name', 'Someone')} replied to your post",
+            message=f"{author.get('name', 'Someone')} replied to your post",
             link=f"/posts/{postId}"
         )
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
     
     return doc
 
@@ -2439,45 +2577,48 @@ async def create_story(authorId: str, media: str, type: str = "image"):
         "media": media,
         "type": type,
         "createdAt": datetime.now(timezone.utc).isoformat(),
-        "expiresAt": (datetime.now(timezone.utc) + timedelta(hours=24)).isoformat(),
-        "views": []
+        "expiresAt": (datetime.now(timezone.utc) + timedelta(hours=24)).isoformat()
     }
     await db.stories.insert_one(story)
     story.pop("_id", None)
+    await stories_tray.add("story", story)
+    await media_store.set_refs("story", story["id"], [media])
     return story
 
 @api_router.get("/stories")
 async def get_active_stories(userId: Optional[str] = None):
     """Get active stories - Public feed like Instagram Stories"""
-    # Get non-expired stories (PUBLIC FEED - show all stories)
-    now = datetime.now(timezone.utc).isoformat()
-    stories = await db.stories.find({
-        "expiresAt": {"$gt": now}
-    }, {"_id": 0}).sort("createdAt", -1).to_list(100)
-    
-    # Group by author
-    grouped = {}
+    # PUBLIC FEED - every author with live stories; the viewer and their friends first
+    feed = await stories_tray.feed("story", userId)
+    view_counts = await view_tracker.counts("story", [story["id"] for entry in feed for story in entry["items"]])
+    for entry in feed:
+        for story in entry["items"]:
+            story["viewCount"] = view_counts[story["id"]]
+    return [{"author": entry["author"], "stories": entry["items"]} for entry in feed]
+
+@api_router.get("/stories/tray")
+async def get_stories_tray(userId: Optional[str] = None, limit: int = 100):
+    """Authors with live stories and their counts, without the stories themselves"""
+    return await stories_tray.tray("story", userId, limit)
+
+@api_router.get("/stories/authors/{authorId}")
+async def get_author_stories(authorId: str):
+    """An author's live stories, oldest first"""
+    stories = await stories_tray.author_items("story", authorId)
+    view_counts = await view_tracker.counts("story", [story["id"] for story in stories])
     for story in stories:
-        author_id = story["authorId"]
-        if author_id not in grouped:
-            author = await db.users.find_one({"id": author_id}, {"_id": 0})
-            if author:
-                grouped[author_id] = {
-                    "author": author,
-                    "stories": []
-                }
-        if author_id in grouped:
-            grouped[author_id]["stories"].append(story)
-    
-    return list(grouped.values())
+        story["viewCount"] = view_counts[story["id"]]
+    return stories
 
 @api_router.post("/stories/{storyId}/view")
 async def view_story(storyId: str, userId: str):
     """Mark story as viewed"""
-    await db.stories.update_one(
-        {"id": storyId},
-        {"$addToSet": {"views": userId}}
-    )
+    story = await db.stories.find_one({"id": storyId}, {"_id": 0, "id": 1})
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    
+    # Stories are kept after they expire, and so are their views
+    await view_tracker.record("story", storyId, userId)
     return {"success": True}
 
 # ===== GROUP CHATS =====
@@ -2653,6 +2794,9 @@ async def create_reel(reel: ReelCreate, authorId: str):
     doc = reel_obj.model_dump()
     result = await db.reels.insert_one(doc)
     doc.pop('_id', None)
+    await engagement_counters.record(authorId, "reels")
+    await content_index.add("reel", doc)
+    await media_store.set_refs("reel", doc["id"], [doc.get("videoUrl"), doc.get("thumb")])
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
     doc["author"] = author
     return doc
@@ -2662,37 +2806,33 @@ async def create_reel(reel: ReelCreate, authorId: str):
 @api_router.get("/capsules")
 async def get_active_capsules(userId: Optional[str] = None):
     """Get all active (non-expired) Vibe Capsules - Public feed like Instagram Stories"""
-    now = datetime.now(timezone.utc).isoformat()
-    
-    # Query for non-expired capsules (PUBLIC FEED - show all stories)
-    query = {"expiresAt": {"$gt": now}}
-    
     # NOTE: Not filtering by friends - showing ALL public stories like Instagram/Snapchat
-    # This makes the platform more engaging and discoverable
-    
-    capsules = await db.vibe_capsules.find(query, {"_id": 0}).sort("createdAt", -1).to_list(100)
-    
-    # Add author info and group by author
-    capsules_by_author = {}
+    # This makes the platform more engaging and discoverable. Friends come first.
+    feed = await stories_tray.feed("capsule", userId)
+    view_counts = await view_tracker.counts("capsule", [c["id"] for entry in feed for c in entry["items"]])
+    
+    stories = []
+    for entry in feed:
+        for capsule in entry["items"]:
+            capsule["author"] = entry["author"]
+            capsule["viewCount"] = view_counts[capsule["id"]]
+        stories.append({"author": entry["author"], "capsules": entry["items"]})
+    
+    return {"stories": stories}
+
+@api_router.get("/capsules/tray")
+async def get_capsules_tray(userId: Optional[str] = None, limit: int = 100):
+    """Authors with live capsules and their counts, without the capsules themselves"""
+    return await stories_tray.tray("capsule", userId, limit)
+
+@api_router.get("/capsules/authors/{authorId}")
+async def get_author_capsules(authorId: str):
+    """An author's live capsules, oldest first (loaded when their ring is opened)"""
+    capsules = await stories_tray.author_items("capsule", authorId)
+    view_counts = await view_tracker.counts("capsule", [c["id"] for c in capsules])
     for capsule in capsules:
-        author = await db.users.find_one({"id": capsule["authorId"]}, {"_id": 0})
-        if author:
-            capsule["author"] = {
-                "id": author["id"],
-                "handle": author["handle"],
-                "name": author["name"],
-                "avatar": author.get("avatar", "")
-            }
-            
-            author_id = capsule["authorId"]
-            if author_id not in capsules_by_author:
-                capsules_by_author[author_id] = {
-                    "author": capsule["author"],
-                    "capsules": []
-                }
-            capsules_by_author[author_id]["capsules"].append(capsule)
-    
-    return {"stories": list(capsules_by_author.values())}
+        capsule["viewCount"] = view_counts[capsule["id"]]
+    return capsules
 
 @api_router.post("/capsules")
 async def create_capsule(capsule: VibeCapsuleCreate, authorId: str):
@@ -2700,9 +2840,13 @@ async def create_capsule(capsule: VibeCapsuleCreate, authorId: str):
     capsule_obj = VibeCapsule(authorId=authorId, **capsule.model_dump())
     doc = capsule_obj.model_dump()
     
-    # Insert into MongoDB (with TTL index on expiresAt)
+    # Insert into MongoDB (TTL index on expireAt, the BSON date copy of expiresAt)
+    doc["expireAt"] = item_expire_at(doc)
     await db.vibe_capsules.insert_one(doc)
     doc.pop('_id', None)
+    doc.pop('expireAt', None)
+    await stories_tray.add("capsule", doc)
+    await media_store.set_refs("capsule", doc["id"], [doc.get("mediaUrl"), doc.get("thumbnailUrl")])
     
     # Add author info
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
@@ -2719,15 +2863,29 @@ async def create_capsule(capsule: VibeCapsuleCreate, authorId: str):
 @api_router.post("/capsules/{capsuleId}/view")
 async def view_capsule(capsuleId: str, userId: str):
     """Mark capsule as viewed by user"""
-    result = await db.vibe_capsules.update_one(
-        {"id": capsuleId},
-        {"$addToSet": {"views": userId}}
-    )
-    
-    if result.modified_count > 0:
-        return {"message": "View recorded"}
-    
-    raise HTTPException(status_code=404, detail="Capsule not found")
+    capsule = await db.vibe_capsules.find_one({"id": capsuleId}, {"_id": 0, "id": 1, "expireAt": 1})
+    if not capsule:
+        raise HTTPException(status_code=404, detail="Capsule not found")
+    
+    await view_tracker.record("capsule", capsuleId, userId, capsule.get("expireAt"))
+    return {"message": "View recorded"}
+
+@api_router.get("/capsules/{capsuleId}/viewers")
+async def get_capsule_viewers(capsuleId: str, limit: int = 50):
+    """Most recent viewers of a capsule ("seen by")"""
+    edges = await view_tracker.viewers("capsule", capsuleId, limit)
+    users = await db.users.find(
+        {"id": {"$in": [e["viewerId"] for e in edges]}},
+        {"_id": 0, "id": 1, "handle": 1, "name": 1, "avatar": 1}
+    ).to_list(len(edges))
+    users_by_id = {u["id"]: u for u in users}
+    
+    viewers = [
+        {"user": users_by_id[e["viewerId"]], "viewedAt": e["viewedAt"]}
+        for e in edges if e["viewerId"] in users_by_id
+    ]
+    view_counts = await view_tracker.counts("capsule", [capsuleId])
+    return {"viewCount": view_counts[capsuleId], "viewers": viewers}
 
 @api_router.post("/capsules/{capsuleId}/react")
 async def react_to_capsule(capsuleId: str, userId: str, reaction: str):
@@ -2747,13 +2905,16 @@ async def get_capsule_insights(authorId: str):
     """Get Capsule Insights for creator"""
     now = datetime.now(timezone.utc).isoformat()
     
-    # Get all capsules (including expired) for this author
+    # Get this author's capsules (expired ones are removed by the expireAt TTL)
     capsules = await db.vibe_capsules.find(
         {"authorId": authorId}, 
-        {"_id": 0}
+        {"_id": 0, "views": 0, "expireAt": 0}
     ).sort("createdAt", -1).to_list(100)
     
-    total_views = sum(len(c.get("views", [])) for c in capsules)
+    view_counts = await view_tracker.counts("capsule", [c["id"] for c in capsules])
+    for capsule in capsules:
+        capsule["viewCount"] = view_counts[capsule["id"]]
+    total_views = sum(view_counts.values())
     total_reactions = sum(len(c.get("reactions", {})) for c in capsules)
     
     # Get top reactors
@@ -2805,11 +2966,16 @@ async def toggle_like_reel(reelId: str, userId: str):
         action = "liked"
     
     await db.reels.update_one({"id": reelId}, {"$set": {"likedBy": liked_by, "stats": stats}})
+    await engagement_counters.record(reel["authorId"], "likes", 1 if action == "liked" else -1)
     return {"action": action, "likes": stats["likes"]}
 
 @api_router.post("/reels/{reelId}/view")
 async def increment_reel_view(reelId: str):
-    await db.reels.update_one({"id": reelId}, {"$inc": {"stats.views": 1}})
+    reel = await db.reels.find_one_and_update(
+        {"id": reelId}, {"$inc": {"stats.views": 1}}, projection={"_id": 0, "authorId": 1}
+    )
+    if reel:
+        await engagement_counters.record(reel.get("authorId"), "views")
     return {"success": True}
 
 @api_router.get("/reels/{reelId}/comments")
@@ -2823,11 +2989,16 @@ async def get_reel_comments(reelId: str):
 @api_router.post("/reels/{reelId}/comments")
 async def create_reel_comment(reelId: str, comment: CommentCreate, authorId: str):
     comment_obj = Comment(reelId=reelId, authorId=authorId, text=comment.text)
+    safety_screen.check("comment", comment_obj.text, authorId, comment_obj.id)
     doc = comment_obj.model_dump()
     result = await db.comments.insert_one(doc)
     doc.pop('_id', None)
     
-    await db.reels.update_one({"id": reelId}, {"$inc": {"stats.comments": 1}})
+    reel = await db.reels.find_one_and_update(
+        {"id": reelId}, {"$inc": {"stats.comments": 1}}, projection={"_id": 0, "authorId": 1}
+    )
+    if reel:
+        await engagement_counters.record(reel.get("authorId"), "comments")
     
     author = await db.users.find_one({"id": authorId}, {"_id": 0})
     doc["author"] = author
@@ -3550,6 +3721,7 @@ async def send_room_message(roomId: str, userId: str, message: str):
         message=message,
         type="text"
     )
+    safety_screen.check("room_message", message, userId, room_message.id)
     await db.room_messages.insert_one(room_message.model_dump())
     
     return room_message
@@ -3621,7 +3793,7 @@ async def invite_to_room(roomId: str, fromUserId: str, toUserId: str):
         "read": False,
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
-    await db.notifications.insert_one(notification)
+    notification_outbox.enqueue(notification)
     
     return {"message": "Invitation sent", "inviteId": invite.id}
 
@@ -3716,9 +3888,11 @@ async def seed_data():
     await db.wallet_transactions.delete_many({})
     await db.messages.delete_many({})
     await db.notifications.delete_many({})
+    await db.notification_counters.delete_many({})  # rebuilt from notifications on next read
     await db.venues.delete_many({})
     await db.events.delete_many({})
     await db.creators.delete_many({})
+    await content_index.reset()  # rebuilt from the seeded posts, reels and events below
     
     # Seed users
     users = [
@@ -3804,7 +3978,7 @@ async def seed_data():
         {"id": "v17", "name": "GVK One Mall", "type": "mall", "description": "Luxury shopping mall in Banjara Hills", "avatar": "https://images.unsplash.com/photo-1519567241046-7f570eee3ce6?w=400", "location": "Banjara Hills, Hyderabad", "rating": 4.4, "menuItems": [], "createdAt": datetime.now(timezone.utc).isoformat()},
         {"id": "v18", "name": "Prasads IMAX", "type": "entertainment", "description": "One of the world's largest IMAX screens", "avatar": "https://images.unsplash.com/photo-1594908900066-3f47337549d8?w=400", "location": "Necklace Road, Hyderabad", "rating": 4.6, "menuItems": [], "createdAt": datetime.now(timezone.utc).isoformat()},
     ]
-    await db.venues.insert_many(venues)
+    await db.venues.insert_many([geo_discovery.annotate(v) for v in venues])
     
     # Seed events - Hyderabad Based (with enhanced imagery)
     events = [
@@ -3816,7 +3990,9 @@ async def seed_data():
         {"id": "e6", "name": "Hyderabad Literary Festival", "description": "Books, authors, and poetry readings", "image": "https://images.unsplash.com/photo-1481627834876-b7833e8f5570?w=800", "date": "2025-12-05", "location": "Lamakaan, Hyderabad", "tiers": [{"name": "General", "price": 500}], "vibeMeter": 85, "createdAt": datetime.now(timezone.utc).isoformat()},
         {"id": "e7", "name": "NH7 Weekender Hyderabad", "description": "Multi-genre music festival with indie artists", "image": "https://images.unsplash.com/photo-1459749411175-04bf5292ceea?w=800", "date": "2025-11-30", "location": "Gachibowli Stadium, Hyderabad", "tiers": [{"name": "Day Pass", "price": 1999}, {"name": "Weekend Pass", "price": 3499}], "vibeMeter": 93, "createdAt": datetime.now(timezone.utc).isoformat()},
     ]
-    await db.events.insert_many(events)
+    await db.events.insert_many([geo_discovery.annotate(e) for e in events])
+    geo_discovery.invalidate("venue")
+    geo_discovery.invalidate("event")
     
     # Seed creators
     creators = [
@@ -3839,6 +4015,8 @@ async def seed_data():
     ]
     await db.notifications.insert_many(notifications)
     
+    await content_index.index_pending()
+    
     return {"message": "Data seeded successfully", "users": len(users), "posts": len(posts), "reels": len(reels), "tribes": len(tribes), "wallet_transactions": len(wallet_transactions), "venues": len(venues), "events": len(events), "creators": len(creators), "messages": len(messages), "notifications": len(notifications)}
 
 # ===== FILE UPLOAD ROUTES =====
@@ -3846,32 +4024,28 @@ async def seed_data():
 @api_router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """Upload image or video file"""
-    # Validate file type
-    allowed_types = {
-        'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp',
-        'video/mp4', 'video/quicktime', 'video/x-msvideo', 'video/webm'
-    }
-    
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="File type not supported")
-    
-    # Generate unique filename
-    file_ext = file.filename.split('.')[-1]
-    unique_filename = f"{uuid.uuid4()}.{file_ext}"
-    file_path = UPLOAD_DIR / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Return URL path
-    file_url = f"/uploads/{unique_filename}"
-    
-    return {
-        "url": file_url,
-        "filename": unique_filename,
-        "content_type": file.content_type
-    }
+    # Copies to disk off the event loop; validates type from content and enforces size limits
+    # (oversized bodies are rejected up front by UploadSizeGuard)
+    return await media_store.save_upload(file)
+
+class UploadSessionCreate(BaseModel):
+    contentType: str
+    totalSize: int
+
+@api_router.post("/upload/sessions")
+async def create_upload_session(data: UploadSessionCreate, userId: Optional[str] = None):
+    """Start a resumable chunked upload (for large reels)"""
+    return await media_store.create_session(userId, data.contentType, data.totalSize)
+
+@api_router.get("/upload/sessions/{sessionId}")
+async def get_upload_session(sessionId: str):
+    """Get upload progress - clients resume from `received`"""
+    return await media_store.get_session(sessionId)
+
+@api_router.put("/upload/sessions/{sessionId}")
+async def upload_session_chunk(sessionId: str, offset: int, request: Request):
+    """Append the raw request body at `offset`; completes the upload once all bytes arrive"""
+    return await media_store.append_chunk(sessionId, offset, request.stream())
 
 # ===== USER PROFILE UPDATE ROUTES =====
 
@@ -3916,6 +4090,10 @@ async def update_user_profile(userId: str, updates: UserProfileUpdate):
             {"id": userId},
             {"$set": update_data}
         )
+        if "avatar" in update_data:
+            await media_store.set_refs("avatar", userId, [update_data["avatar"]])
+        if "coverPhoto" in update_data:
+            await media_store.set_refs("cover", userId, [update_data["coverPhoto"]])
         
         # Get updated user
         updated_user = await db.users.find_one({"id": userId}, {"_id": 0, "password": 0})
@@ -3951,6 +4129,7 @@ async def get_messages(userId: str):
 @api_router.post("/messages")
 async def send_message(message: MessageCreate, fromId: str, toId: str):
     message_obj = Message(fromId=fromId, toId=toId, **message.model_dump())
+    safety_screen.check("message", message_obj.text, fromId, message_obj.id)
     doc = message_obj.model_dump()
     await db.messages.insert_one(doc)
     doc.pop('_id', None)
@@ -3977,12 +4156,14 @@ async def get_thread_messages(userId: str, peerId: str):
 
 @api_router.get("/notifications")
 async def get_notifications(userId: str):
-    notifications = await db.notifications.find({"userId": userId}, {"_id": 0}).sort("createdAt", -1).to_list(100)
+    notifications = await db.notifications.find(
+        {"userId": userId}, {"_id": 0, "expireAt": 0, "actorIds": 0}
+    ).sort("createdAt", -1).to_list(100)
     return notifications
 
 @api_router.post("/notifications/{notificationId}/read")
 async def mark_notification_read(notificationId: str):
-    await db.notifications.update_one({"id": notificationId}, {"$set": {"read": True}})
+    await notification_unread.mark_read(notificationId)
     return {"success": True}
 
 @api_router.post("/share")
@@ -4011,7 +4192,14 @@ async def share_content(fromUserId: str, toUserId: str, contentType: str, conten
             contentId=contentId
         )
         
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
+        
+        # Credit the share to the author of the shared post or reel
+        content_collection = {"post": db.posts, "reel": db.reels}.get(contentType)
+        if content_collection is not None:
+            content = await content_collection.find_one({"id": contentId}, {"_id": 0, "authorId": 1})
+            if content:
+                await engagement_counters.record(content.get("authorId"), "shares")
         
         return {"success": True, "message": "Content shared successfully"}
     except Exception as e:
@@ -4024,6 +4212,18 @@ async def get_venues(limit: int = 50):
     venues = await db.venues.find({}, {"_id": 0}).sort("rating", -1).to_list(limit)
     return venues
 
+@api_router.get("/venues/nearby")
+async def get_nearby_venues(
+    lat: float,
+    lng: float,
+    radiusKm: float = 5,
+    category: Optional[str] = None,
+    openNow: bool = False,
+    limit: int = 20
+):
+    """Venues within radiusKm of a point, nearest first, with distanceKm"""
+    return await geo_discovery.nearby("venue", lng, lat, radiusKm, category=category, open_now=openNow, limit=limit)
+
 @api_router.get("/venues/{venueId}")
 async def get_venue(venueId: str):
     venue = await db.venues.find_one({"id": venueId}, {"_id": 0})
@@ -4080,7 +4280,7 @@ async def create_order(order: OrderCreate, userId: str):
         type="order_placed",
         payload={"orderId": order_obj.id, "total": order.total, "venueId": order.venueId}
     )
-    await db.notifications.insert_one(notif.model_dump())
+    notification_outbox.enqueue(notif.model_dump())
     
     return doc
 
@@ -4107,7 +4307,7 @@ async def update_order_status(orderId: str, status: str):
             type="order_ready",
             payload={"orderId": orderId}
         )
-        await db.notifications.insert_one(notif.model_dump())
+        notification_outbox.enqueue(notif.model_dump())
     
     return {"success": True, "status": status}
 
@@ -4128,9 +4328,12 @@ async def create_event(
     creatorId: str,
     image: str = None,
     price: float = 0.0,
-    totalSeats: int = 100
+    totalSeats: int = 100,
+    category: str = None,
+    lat: float = None,
+    lng: float = None
 ):
-    """Create a new event"""
+    """Create a new event (lat/lng place it on the map; otherwise the location's locality is used)"""
     event = {
         "id": str(uuid.uuid4()),
         "name": name,
@@ -4148,12 +4351,31 @@ async def create_event(
         ],
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
+    if category:
+        event["category"] = category
+    if lat is not None and lng is not None:
+        event["geo"] = geo_point(lng, lat)
+    geo_discovery.annotate(event)
     
     await db.events.insert_one(event)
     event.pop("_id", None)
+    geo_discovery.invalidate("event")
+    await content_index.add("event", event)
     
     return event
 
+@api_router.get("/events/nearby")
+async def get_nearby_events(
+    lat: float,
+    lng: float,
+    radiusKm: float = 10,
+    category: Optional[str] = None,
+    upcoming: bool = True,
+    limit: int = 20
+):
+    """Events within radiusKm of a point, nearest first, with distanceKm (upcoming only by default)"""
+    return await geo_discovery.nearby("event", lng, lat, radiusKm, category=category, upcoming=upcoming, limit=limit)
+
 @api_router.get("/events/{eventId}")
 async def get_event(eventId: str):
     event = await db.events.find_one({"id": eventId}, {"_id": 0})
@@ -4161,85 +4383,58 @@ async def get_event(eventId: str):
         raise HTTPException(status_code=404, detail="Event not found")
     return event
 
-@api_router.post("/events/{eventId}/book")
-async def book_event_ticket(eventId: str, userId: str, tier: str = "General", quantity: int = 1):
-    """Book event tickets using wallet balance"""
-    # Get event
-    event = await db.events.find_one({"id": eventId}, {"_id": 0})
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
-    
-    # Get user
-    user = await db.users.find_one({"id": userId}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Find tier price
-    tiers = event.get("tiers", [])
-    tier_data = next((t for t in tiers if t.get("name") == tier), None)
-    if not tier_data:
-        raise HTTPException(status_code=400, detail="Invalid tier")
-    
-    price_per_ticket = tier_data.get("price", 0)
-    total_amount = price_per_ticket * quantity
-    
-    # Check balance
-    current_balance = user.get("walletBalance", 0.0)
-    if current_balance < total_amount:
-        raise HTTPException(status_code=400, detail="Insufficient wallet balance")
-    
-    # Deduct from wallet
-    new_balance = current_balance - total_amount
-    await db.users.update_one({"id": userId}, {"$set": {"walletBalance": new_balance}})
-    
-    # Create tickets
+async def confirm_ticket_hold(hold: dict) -> dict:
+    """Issue the tickets for a pending hold, debiting the wallet and writing the ledger atomically"""
+    event = hold["event"]
+    quantity = hold["quantity"]
+    total_amount = hold["price"] * quantity
+
     tickets = []
-    for i in range(quantity):
-        ticket = EventTicket(
-            eventId=eventId,
-            userId=userId,
-            tier=tier,
-            qrCode=str(uuid.uuid4()),
+    for _ in range(quantity):
+        ticket_dict = EventTicket(
+            eventId=hold["eventId"],
+            userId=hold["userId"],
+            tier=hold["tier"],
             status="active"
-        )
-        ticket_dict = ticket.model_dump()
-        ticket_dict["eventName"] = event.get("name", "Event")
+        ).model_dump()
+        ticket_dict["eventName"] = event.get("name") or "Event"
         ticket_dict["eventDate"] = event.get("date", "")
         ticket_dict["eventLocation"] = event.get("location", "")
         ticket_dict["eventImage"] = event.get("image", "")
-        ticket_dict["price"] = price_per_ticket
-        
-        # Generate QR code
-        qr_data = f"TICKET:{ticket_dict['id']}:QR:{ticket_dict['qrCode']}:EVENT:{eventId}"
-        ticket_dict['qrCodeImage'] = generate_qr_code_base64(qr_data)
-        
-        await db.event_tickets.insert_one(ticket_dict)
-        # Remove MongoDB ObjectId to avoid serialization issues
-        ticket_dict.pop('_id', None)
+        ticket_dict["price"] = hold["price"]
+        ticket_dict["holdId"] = hold["id"]
+        # Store only the QR payload; the image is rendered on demand
+        ticket_dict["qrPayload"] = ticket_qr_payload(ticket_dict)
         tickets.append(ticket_dict)
-    
-    # Record transaction
+
     transaction = WalletTransaction(
-        userId=userId,
+        userId=hold["userId"],
         type="payment",
         amount=total_amount,
-        description=f"Ticket purchase: {event.get('name', 'Event')} ({quantity}x {tier})",
-        metadata={"eventId": eventId, "tier": tier, "quantity": quantity}
+        category="events",
+        description=f"Ticket purchase: {event.get('name') or 'Event'} ({quantity}x {hold['tier']})",
+        metadata={"eventId": hold["eventId"], "tier": hold["tier"], "quantity": quantity, "holdId": hold["id"]}
     )
-    await db.wallet_transactions.insert_one(transaction.model_dump())
-    
     # Award Loop Credits (bonus for ticket purchase)
     credits_earned = 20 * quantity  # 20 credits per ticket
-    if credits_earned > 0:
-        credit_entry = LoopCredit(
-            userId=userId,
-            amount=credits_earned,
-            type="earn",
-            source="event",
-            description=f"Bonus for buying {quantity} ticket(s)"
-        )
-        await db.loop_credits.insert_one(credit_entry.model_dump())
-    
+    credit_entry = LoopCredit(
+        userId=hold["userId"],
+        amount=credits_earned,
+        type="earn",
+        source="event",
+        description=f"Bonus for buying {quantity} ticket(s)"
+    )
+
+    new_balance = await ticket_booking.confirm(hold, tickets, {
+        "wallet_transactions": [transaction.model_dump()],
+        "loop_credits": [credit_entry.model_dump()]
+    })
+
+    for ticket_dict in tickets:
+        # insert_many adds MongoDB ObjectIds; drop them to avoid serialization issues
+        ticket_dict.pop("_id", None)
+        ticket_dict["qrCodeUrl"] = ticket_qr_url(ticket_dict["id"])
+
     return {
         "success": True,
         "tickets": tickets,
@@ -4248,18 +4443,79 @@ async def book_event_ticket(eventId: str, userId: str, tier: str = "General", qu
         "message": f"Successfully booked {quantity} ticket(s)!"
     }
 
+@api_router.post("/events/{eventId}/book")
+async def book_event_ticket(eventId: str, userId: str, tier: str = "General", quantity: int = 1):
+    """Book event tickets using wallet balance (hold and confirm in one call)"""
+    user = await db.users.find_one({"id": userId}, {"_id": 0, "id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    hold = await ticket_booking.hold(eventId, userId, tier, quantity)
+    try:
+        return await confirm_ticket_hold(hold)
+    except Exception:
+        await ticket_booking.release(hold["id"], userId)
+        raise
+
+@api_router.post("/events/{eventId}/holds")
+async def hold_event_tickets(eventId: str, userId: str, tier: str = "General", quantity: int = 1):
+    """Reserve tickets for a few minutes while the user checks out (for high-demand drops)"""
+    user = await db.users.find_one({"id": userId}, {"_id": 0, "id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    hold = await ticket_booking.hold(eventId, userId, tier, quantity)
+    hold["expiresAt"] = hold["expiresAt"].isoformat()
+    return hold
+
+@api_router.post("/ticket-holds/{holdId}/confirm")
+async def confirm_event_ticket_hold(holdId: str, userId: str):
+    """Pay for a held reservation and issue its tickets"""
+    hold = await ticket_booking.get_hold(holdId, userId)
+    return await confirm_ticket_hold(hold)
+
+@api_router.delete("/ticket-holds/{holdId}")
+async def release_event_ticket_hold(holdId: str, userId: str):
+    """Give up a held reservation, returning its seats to inventory"""
+    if not await ticket_booking.release(holdId, userId):
+        raise HTTPException(status_code=404, detail="No pending hold found")
+    return {"success": True}
+
 @api_router.get("/tickets/{userId}")
 async def get_user_tickets(userId: str):
     """Get all tickets for a user"""
-    tickets = await db.event_tickets.find({"userId": userId}, {"_id": 0}).sort("purchasedAt", -1).to_list(100)
+    # Legacy tickets carry an embedded base64 PNG; never ship it
+    tickets = await db.event_tickets.find(
+        {"userId": userId}, {"_id": 0, "qrCodeImage": 0}
+    ).sort("purchasedAt", -1).to_list(100)
+    for ticket in tickets:
+        ticket["qrCodeUrl"] = ticket_qr_url(ticket["id"])
     return tickets
 
+@api_router.get("/tickets/{ticketId}/qr.png")
+async def get_ticket_qr(ticketId: str, request: Request):
+    """Ticket QR code as a PNG, rendered in a worker process and cached by the client"""
+    ticket = await db.event_tickets.find_one(
+        {"id": ticketId}, {"_id": 0, "id": 1, "qrCode": 1, "eventId": 1, "qrPayload": 1}
+    )
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+
+    payload = ticket.get("qrPayload") or ticket_qr_payload(ticket)
+    headers = {"etag": ticket_qr_etag(payload), "cache-control": TICKET_QR_CACHE_CONTROL}
+    if etag_is_fresh(request, headers["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    png = await ticket_qr.render(payload)
+    return Response(content=png, media_type="image/png", headers=headers)
+
 @api_router.get("/tickets/{userId}/{ticketId}")
 async def get_ticket_details(userId: str, ticketId: str):
     """Get specific ticket details"""
-    ticket = await db.event_tickets.find_one({"id": ticketId, "userId": userId}, {"_id": 0})
+    ticket = await db.event_tickets.find_one({"id": ticketId, "userId": userId}, {"_id": 0, "qrCodeImage": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
+    ticket["qrCodeUrl"] = ticket_qr_url(ticket["id"])
     return ticket
 
 # ===== CREATOR ROUTES =====
@@ -4335,6 +4591,7 @@ async def make_payment(request: PaymentRequest, userId: str):
         userId=userId,
         type="payment",
         amount=request.amount,
+        category="venues" if request.venueId else "other",
         description=request.description or f"Payment at {request.venueName or 'venue'}",
         metadata={"venueId": request.venueId, "venueName": request.venueName}
     )
@@ -4389,9 +4646,8 @@ async def get_user_credits(userId: str):
         "vibeRank": analytics.get("vibeRank", 0)
     }
 
-@api_router.post("/credits/earn")
-async def earn_credits(userId: str, amount: int, source: str, description: str = ""):
-    """Award Loop Credits to user"""
+async def award_credits(userId: str, amount: int, source: str, description: str = ""):
+    """Record earned Loop Credits without computing the new balance (for hot paths)"""
     credit = LoopCredit(
         userId=userId,
         amount=amount,
@@ -4407,7 +4663,11 @@ async def earn_credits(userId: str, amount: int, source: str, description: str =
         {"$inc": {"totalCredits": amount}, "$set": {"lastUpdated": datetime.now(timezone.utc).isoformat()}},
         upsert=True
     )
-    
+
+@api_router.post("/credits/earn")
+async def earn_credits(userId: str, amount: int, source: str, description: str = ""):
+    """Award Loop Credits to user"""
+    await award_credits(userId, amount, source, description)
     return {"success": True, "amount": amount, "balance": await get_credits_balance(userId)}
 
 @api_router.post("/credits/spend")
@@ -4437,10 +4697,20 @@ async def spend_credits(userId: str, amount: int, source: str, description: str
 
 async def get_credits_balance(userId: str) -> int:
     """Helper to get current credits balance"""
-    credits = await db.loop_credits.find({"userId": userId}, {"_id": 0}).to_list(1000)
-    earned = sum(c["amount"] for c in credits if c["type"] == "earn")
-    spent = sum(c["amount"] for c in credits if c["type"] == "spend")
-    return earned - spent
+    # Summed server-side over the (userId, createdAt) index instead of shipping the ledger
+    rows = await db.loop_credits.aggregate([
+        {"$match": {"userId": userId}},
+        {"$group": {"_id": None, "balance": {"$sum": {
+            "$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$type", "earn"]}, "then": "$amount"},
+                    {"case": {"$eq": ["$type", "spend"]}, "then": {"$multiply": ["$amount", -1]}}
+                ],
+                "default": 0
+            }
+        }}}}
+    ]).to_list(1)
+    return rows[0]["balance"] if rows else 0
 
 # ===== CHECK-IN ROUTES =====
 
@@ -4453,10 +4723,15 @@ async def create_checkin(userId: str, venueId: str):
         raise HTTPException(status_code=400, detail="Already checked in to a venue")
     
     checkin = CheckIn(userId=userId, venueId=venueId)
-    await db.checkins.insert_one(checkin.model_dump())
+    try:
+        await db.checkins.insert_one(checkin.model_dump())
+    except DuplicateKeyError:
+        # A concurrent check-in won (one active check-in per user)
+        raise HTTPException(status_code=400, detail="Already checked in to a venue")
+    await engagement_counters.record(userId, "checkins")
     
     # Award credits for check-in
-    await earn_credits(userId, 10, "checkin", f"Check-in at venue {venueId}")
+    await award_credits(userId, 10, "checkin", f"Check-in at venue {venueId}")
     
     # Update analytics
     await db.user_analytics.update_one(
@@ -4466,24 +4741,26 @@ async def create_checkin(userId: str, venueId: str):
     )
     
     # Update venue vibe meter
-    await update_venue_vibe_meter(venueId)
+    await venue_vibe.checked_in(venueId)
     
     return {"success": True, "checkin": checkin.model_dump(), "creditsEarned": 10}
 
 @api_router.post("/checkins/{checkinId}/checkout")
 async def checkout(checkinId: str):
     """Check-out from a venue"""
-    checkin = await db.checkins.find_one({"id": checkinId}, {"_id": 0})
-    if not checkin:
-        raise HTTPException(status_code=404, detail="Check-in not found")
-    
-    await db.checkins.update_one(
-        {"id": checkinId},
-        {"$set": {"checkedOutAt": datetime.now(timezone.utc).isoformat(), "status": "completed"}}
+    # Only the request that ends an active check-in adjusts the venue counter
+    checkin = await db.checkins.find_one_and_update(
+        {"id": checkinId, "status": "active"},
+        {"$set": {"checkedOutAt": datetime.now(timezone.utc).isoformat(), "status": "completed"}},
+        projection={"_id": 0, "venueId": 1}
     )
+    if not checkin:
+        if not await db.checkins.find_one({"id": checkinId}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Check-in not found")
+        return {"success": True}
     
     # Update venue vibe meter
-    await update_venue_vibe_meter(checkin["venueId"])
+    await venue_vibe.checked_out(checkin["venueId"])
     
     return {"success": True}
 
@@ -4512,21 +4789,6 @@ async def get_user_active_checkin(userId: str):
     
     return {"checkedIn": True, "checkin": checkin, "venue": venue}
 
-async def update_venue_vibe_meter(venueId: str):
-    """Update venue's vibe meter based on active check-ins"""
-    checkins = await db.checkins.find({"venueId": venueId, "status": "active"}, {"_id": 0}).to_list(100)
-    count = len(checkins)
-    
-    # Calculate vibe meter (0-100 scale)
-    vibe_meter = min(100, count * 10)  # 10 points per active user
-    
-    await db.venues.update_one(
-        {"id": venueId},
-        {"$set": {"vibeMeter": vibe_meter}}
-    )
-    
-    return vibe_meter
-
 # ===== OFFERS ROUTES =====
 
 @api_router.get("/offers/venue/{venueId}")
@@ -4751,75 +5013,53 @@ async def complete_challenge(challengeId: str, userId: str):
     
     return {"success": True, "reward": challenge["reward"]}
 
-# ===== QR CODE HELPER =====
-
-def generate_qr_code_base64(data: str) -> str:
-    """Generate QR code and return as base64 string"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    
-    return f"data:image/png;base64,{img_str}"
-
 # ===== EVENT TICKETS ROUTES =====
 
 @api_router.post("/events/{eventId}/tickets")
 async def claim_event_ticket(eventId: str, userId: str, tier: str = "General"):
-    """Claim a free event ticket"""
-    event = await db.events.find_one({"id": eventId}, {"_id": 0})
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
-    
+    """Claim a free event ticket (same seat inventory as bookings)"""
     # Check if already has ticket
     existing = await db.event_tickets.find_one({"eventId": eventId, "userId": userId, "status": "active"}, {"_id": 0})
     if existing:
         raise HTTPException(status_code=400, detail="Already have a ticket for this event")
-    
-    # Create ticket
-    ticket = EventTicket(
-        eventId=eventId,
-        userId=userId,
-        tier=tier
-    )
-    ticket_dict = ticket.model_dump()
-    
-    # Generate QR code with ticket information
-    qr_data = f"TICKET:{ticket_dict['id']}:QR:{ticket_dict['qrCode']}:EVENT:{eventId}"
-    ticket_dict['qrCodeImage'] = generate_qr_code_base64(qr_data)
-    
-    await db.event_tickets.insert_one(ticket_dict)
+
+    # Validates the tier and takes the seat atomically
+    hold = await ticket_booking.hold(eventId, userId, tier, 1)
+    try:
+        if hold["price"] > 0:
+            raise HTTPException(status_code=400, detail="This tier is not free; book it instead")
+
+        ticket_dict = EventTicket(
+            eventId=eventId,
+            userId=userId,
+            tier=hold["tier"]
+        ).model_dump()
+        ticket_dict["holdId"] = hold["id"]
+        ticket_dict["qrPayload"] = ticket_qr_payload(ticket_dict)
+        await ticket_booking.confirm(hold, [ticket_dict], {})
+    except Exception:
+        await ticket_booking.release(hold["id"], userId)
+        raise
+
     # Remove MongoDB ObjectId to avoid serialization issues
     ticket_dict.pop('_id', None)
-    
+    ticket_dict["qrCodeUrl"] = ticket_qr_url(ticket_dict["id"])
+
     return {"success": True, "ticket": ticket_dict}
 
 @api_router.get("/tickets/{userId}")
 async def get_user_tickets(userId: str):
     """Get user's event tickets"""
-    tickets = await db.event_tickets.find({"userId": userId, "status": "active"}, {"_id": 0}).to_list(100)
+    tickets = await db.event_tickets.find(
+        {"userId": userId, "status": "active"}, {"_id": 0, "qrCodeImage": 0}
+    ).to_list(100)
     
-    # Enrich with event details and regenerate QR codes if needed
+    # Enrich with event details; QR images are served by /tickets/{ticketId}/qr.png
     for ticket in tickets:
         event = await db.events.find_one({"id": ticket["eventId"]}, {"_id": 0})
         if event:
             ticket["event"] = event
-        
-        # Regenerate QR code if not present
-        if "qrCodeImage" not in ticket:
-            qr_data = f"TICKET:{ticket['id']}:QR:{ticket['qrCode']}:EVENT:{ticket['eventId']}"
-            ticket['qrCodeImage'] = generate_qr_code_base64(qr_data)
+        ticket["qrCodeUrl"] = ticket_qr_url(ticket["id"])
     
     return tickets
 
@@ -4902,18 +5142,36 @@ async def save_user_consents(userId: str, consent_data: UserConsent):
     return {"success": True, "message": "Consent preferences saved"}
 
 # ===== AI ROUTES =====
+MAX_RANK_DOCUMENTS = 10000
+MAX_RANK_QUERIES = 100
+MAX_BATCH_TOP_K = 100  # bounds a batch response to queries x 100 items
+
 class RankRequest(BaseModel):
     query: str
-    documents: List[str]
+    documents: List[str] = Field(max_length=MAX_RANK_DOCUMENTS)
+    top_k: Optional[int] = Field(default=None, ge=1)  # all documents when omitted
 
 class RankResponse(BaseModel):
     items: List[dict]
 
+class BatchRankRequest(BaseModel):
+    queries: List[str] = Field(max_length=MAX_RANK_QUERIES)
+    documents: List[str] = Field(max_length=MAX_RANK_DOCUMENTS)
+    top_k: int = Field(default=MAX_BATCH_TOP_K, ge=1, le=MAX_BATCH_TOP_K)
+
 class SafetyRequest(BaseModel):
     text: str
 
+class BatchSafetyRequest(BaseModel):
+    texts: List[str] = Field(max_length=1000)
+
 class TranslateRequest(BaseModel):
-    text: str
+    text: str = Field(max_length=5000)
+    target_language: str
+    source_language: Optional[str] = None
+
+class BatchTranslateRequest(BaseModel):
+    texts: List[str] = Field(max_length=500)
     target_language: str
     source_language: Optional[str] = None
 
@@ -4921,51 +5179,48 @@ class InsightRequest(BaseModel):
     text: str
     task: str = Field(default="summarize")  # summarize, sentiment
 
+def rank_documents(queries: List[str], documents: List[str], top_k: Optional[int]) -> List[List[dict]]:
+    """BM25-rank documents for each query; the corpus is tokenized and weighted once"""
+    corpus = RankCorpus(documents)
+    return [
+        [{"index": i, "score": round(score, 4), "document": documents[i]} for i, score in corpus.top_k(query, top_k)]
+        for query in queries
+    ]
+
 @api_router.post("/ai/rank")
 async def ai_rank(req: RankRequest):
-    # Mock implementation - ranks by keyword relevance
-    scores = []
-    query_lower = req.query.lower()
-    
-    for i, doc in enumerate(req.documents):
-        doc_lower = doc.lower()
-        # Simple scoring: count query word occurrences + exact matches
-        score = doc_lower.count(query_lower)
-        if query_lower in doc_lower:
-            score += 2  # Bonus for containing the query
-        scores.append({"index": i, "score": score, "document": doc})
-    
-    # Sort by score descending
-    items = sorted(scores, key=lambda x: x["score"], reverse=True)
-    return {"items": items}
+    """Rank documents against a query by BM25, best first"""
+    results = await run_in_threadpool(rank_documents, [req.query], req.documents, req.top_k)
+    return {"items": results[0]}
+
+@api_router.post("/ai/rank/batch")
+async def ai_rank_batch(req: BatchRankRequest):
+    """Rank one shared document set against many queries in a single call"""
+    results = await run_in_threadpool(rank_documents, req.queries, req.documents, req.top_k)
+    return {"results": [{"query": query, "items": items} for query, items in zip(req.queries, results)]}
 
 @api_router.post("/ai/safety")
 async def ai_safety(req: SafetyRequest):
-    # Mock implementation for testing - returns safe for most content
-    text_lower = req.text.lower()
-    unsafe_keywords = ["hate", "violence", "kill", "bomb", "terrorist"]
-    
-    if any(keyword in text_lower for keyword in unsafe_keywords):
-        return {"safe": False, "categories": ["violence", "hate"]}
-    else:
-        return {"safe": True, "categories": []}
+    """Classify text against the safety lexicon"""
+    return safety_classifier.classify(req.text)
+
+@api_router.post("/ai/safety/batch")
+async def ai_safety_batch(req: BatchSafetyRequest):
+    """Classify many texts in one call; results are in request order"""
+    return {"results": [safety_classifier.classify(text) for text in req.texts]}
 
 @api_router.post("/ai/translate")
 async def ai_translate(req: TranslateRequest):
-    # Mock implementation for testing
-    translations = {
-        "hello": {"hi": "नमस्ते", "es": "hola", "fr": "bonjour"},
-        "goodbye": {"hi": "अलविदा", "es": "adiós", "fr": "au revoir"},
-        "thank you": {"hi": "धन्यवाद", "es": "gracias", "fr": "merci"}
-    }
-    
-    text_lower = req.text.lower()
-    target = req.target_language.lower()
-    
-    if text_lower in translations and target in translations[text_lower]:
-        return {"translated_text": translations[text_lower][target]}
-    else:
-        return {"translated_text": f"[Mock translation of '{req.text}' to {req.target_language}]"}
+    translated = await translation_service.translate(req.text, req.target_language, req.source_language)
+    return {"translated_text": translated}
+
+@api_router.post("/ai/translate/batch")
+async def ai_translate_batch(req: BatchTranslateRequest):
+    """Translate many strings at once; cached strings are free and the rest share provider calls"""
+    if any(len(text) > 5000 for text in req.texts):
+        raise HTTPException(status_code=400, detail="Each text must be at most 5000 characters")
+    translated = await translation_service.translate_many(req.texts, req.target_language, req.source_language)
+    return {"translations": translated}
 
 @api_router.post("/ai/insight")
 async def ai_insight(req: InsightRequest):
@@ -5010,87 +5265,110 @@ async def get_user_consents(userId: str):
 
 # ===== ANALYTICS ROUTES =====
 
+@api_router.get("/analytics/timeseries")
+async def get_metric_timeseries(
+    metric: str,
+    start: str,
+    end: Optional[str] = None,
+    resolution: str = "hour",
+    step: int = 1,
+    userId: Optional[str] = None
+):
+    """Get a platform (or per-user) metric series over a time range, downsampled by step"""
+    try:
+        start_dt = datetime.fromisoformat(start)
+        end_dt = datetime.fromisoformat(end) if end else datetime.now(timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 timestamps")
+    if start_dt.tzinfo is None:
+        start_dt = start_dt.replace(tzinfo=timezone.utc)
+    if end_dt.tzinfo is None:
+        end_dt = end_dt.replace(tzinfo=timezone.utc)
+    
+    try:
+        points = await metric_rollup.query(metric, start_dt, end_dt, resolution, step, userId)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"metric": metric, "resolution": resolution, "step": step, "userId": userId, "points": points}
+
 @api_router.get("/analytics/{userId}")
 async def get_user_analytics(userId: str):
     """Get comprehensive user analytics dashboard"""
-    user = await db.users.find_one({"id": userId}, {"_id": 0})
+    user = await get_follow_counts(userId)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get all user posts
-    posts = await db.posts.find({"authorId": userId}, {"_id": 0}).to_list(None)
-    reels = await db.reels.find({"authorId": userId}, {"_id": 0}).to_list(None)
-    
-    # Calculate engagement
-    total_likes = sum(len(p.get("likes", [])) for p in posts) + sum(len(r.get("likes", [])) for r in reels)
-    total_comments = sum(len(p.get("comments", [])) for p in posts) + sum(len(r.get("comments", [])) for r in reels)
-    total_shares = sum(p.get("shares", 0) for p in posts) + sum(r.get("shares", 0) for r in reels)
-    
-    # Get follower count
-    followers_count = len(user.get("followers", []))
-    following_count = len(user.get("following", []))
-    
-    # Daily/Weekly engagement (last 7 days)
-    from datetime import timedelta
-    now = datetime.now(timezone.utc)
-    week_ago = now - timedelta(days=7)
-    
-    recent_posts = [p for p in posts if datetime.fromisoformat(p.get("createdAt", now.isoformat())) > week_ago]
-    recent_reels = [r for r in reels if datetime.fromisoformat(r.get("createdAt", now.isoformat())) > week_ago]
+    # Pre-aggregated totals and the last 7 daily buckets
+    counters = await engagement_counters.get("user", userId, [userId])
+    totals = counters["totals"]
+    weekly = await engagement_counters.window("user", userId, days=7)
     
     weekly_engagement = {
-        "posts": len(recent_posts),
-        "reels": len(recent_reels),
-        "likes": sum(len(p.get("likes", [])) for p in recent_posts) + sum(len(r.get("likes", [])) for r in recent_reels),
-        "comments": sum(len(p.get("comments", [])) for p in recent_posts) + sum(len(r.get("comments", [])) for r in recent_reels)
+        "posts": weekly["posts"],
+        "reels": weekly["reels"],
+        "likes": weekly["likes"],
+        "comments": weekly["comments"]
     }
     
     return {
         "userId": userId,
-        "totalPosts": len(posts),
-        "totalReels": len(reels),
-        "totalLikes": total_likes,
-        "totalComments": total_comments,
-        "totalShares": total_shares,
-        "followersCount": followers_count,
-        "followingCount": following_count,
+        "totalPosts": totals["posts"],
+        "totalReels": totals["reels"],
+        "totalLikes": totals["likes"],
+        "totalComments": totals["comments"],
+        "totalShares": totals["shares"],
+        "followersCount": user["followersCount"],
+        "followingCount": user["followingCount"],
         "weeklyEngagement": weekly_engagement,
-        "engagementRate": round((total_likes + total_comments) / max(len(posts) + len(reels), 1), 2),
+        "engagementRate": round((totals["likes"] + totals["comments"]) / max(totals["posts"] + totals["reels"], 1), 2),
         "tier": user.get("tier", "Bronze")
     }
 
+async def get_follow_counts(userId: str) -> Optional[dict]:
+    """Helper to get follower/following counts without loading the ID arrays"""
+    users = await db.users.aggregate([
+        {"$match": {"id": userId}},
+        {"$project": {
+            "_id": 0,
+            "tier": 1,
+            "followersCount": {"$size": {"$ifNull": ["$followers", []]}},
+            "followingCount": {"$size": {"$ifNull": ["$following", []]}}
+        }}
+    ]).to_list(1)
+    return users[0] if users else None
+
 @api_router.get("/analytics/creator/{userId}")
 async def get_creator_dashboard(userId: str):
     """Get creator-specific analytics"""
-    user = await db.users.find_one({"id": userId}, {"_id": 0})
+    user = await get_follow_counts(userId)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    posts = await db.posts.find({"authorId": userId}, {"_id": 0}).to_list(None)
-    reels = await db.reels.find({"authorId": userId}, {"_id": 0}).to_list(None)
-    
-    # Calculate total reach (views)
-    total_views = sum(p.get("views", 0) for p in posts) + sum(r.get("views", 0) for r in reels)
+    counters = await engagement_counters.get("user", userId, [userId])
+    totals = counters["totals"]
     
-    # Follower growth (mock data - in production, track historical data)
-    followers = user.get("followers", [])
+    # Growth over the last 30 days from the daily counter buckets
+    month = await engagement_counters.window("user", userId, days=30)
+    followers_count = user["followersCount"]
+    month_engagement = month["likes"] + month["comments"]
     
-    # Top performing content
-    top_posts = sorted(posts, key=lambda x: len(x.get("likes", [])), reverse=True)[:5]
-    top_reels = sorted(reels, key=lambda x: len(x.get("likes", [])), reverse=True)[:5]
+    # Top performing content (indexed by authorId + stats.likes)
+    top_posts = await db.posts.find({"authorId": userId}, {"_id": 0}).sort("stats.likes", -1).to_list(5)
+    top_reels = await db.reels.find({"authorId": userId}, {"_id": 0}).sort("stats.likes", -1).to_list(5)
     
     return {
         "userId": userId,
-        "followersCount": len(followers),
-        "followersGrowth": "+15%",  # Mock - track historical data
-        "totalReach": total_views,
-        "avgEngagementRate": "8.5%",  # Mock calculation
+        "followersCount": user["followersCount"],
+        "followersGrowth": format_growth(followers_count, followers_count - month["followers"]),
+        "totalReach": totals["views"],
+        "avgEngagementRate": f"{month_engagement / max(followers_count, 1) * 100:.1f}%",
         "topPosts": top_posts,
         "topReels": top_reels,
         "contentBreakdown": {
-            "posts": len(posts),
-            "reels": len(reels),
-            "totalEngagement": sum(len(p.get("likes", [])) for p in posts) + sum(len(r.get("likes", [])) for r in reels)
+            "posts": totals["posts"],
+            "reels": totals["reels"],
+            "totalEngagement": totals["likes"]
         }
     }
 
@@ -5103,67 +5381,100 @@ async def get_tribe_analytics(tribeId: str):
     
     members = tribe.get("members", [])
     
-    # Get tribe posts
-    tribe_posts = await db.posts.find({"authorId": {"$in": members}}, {"_id": 0}).to_list(None)
-    
-    # Most active members
-    member_activity = {}
-    for post in tribe_posts:
-        author_id = post.get("authorId")
-        member_activity[author_id] = member_activity.get(author_id, 0) + 1
+    counters = await engagement_counters.tribe(members)
+    totals = counters["totals"]
     
+    # Most active members (post counters of current members)
+    member_activity = {uid: count for uid, count in counters["contributors"].items() if count > 0}
     top_contributors = sorted(member_activity.items(), key=lambda x: x[1], reverse=True)[:5]
     
     # Popular posts
-    popular_posts = sorted(tribe_posts, key=lambda x: len(x.get("likes", [])), reverse=True)[:10]
+    popular_posts = await db.posts.find(
+        {"authorId": {"$in": members}}, {"_id": 0}
+    ).sort("stats.likes", -1).to_list(10)
     
     return {
         "tribeId": tribeId,
         "tribeName": tribe.get("name"),
         "memberCount": len(members),
-        "totalPosts": len(tribe_posts),
+        "totalPosts": totals["posts"],
         "activeMembers": len(member_activity),
         "topContributors": [{"userId": uid, "postCount": count} for uid, count in top_contributors],
         "popularPosts": popular_posts,
-        "engagementRate": round(sum(len(p.get("likes", [])) for p in tribe_posts) / max(len(tribe_posts), 1), 2)
+        "engagementRate": round(totals["likes"] / max(totals["posts"], 1), 2)
     }
 
+# Fallback for transactions written before `category` existed: infer from venueName
+LEGACY_SPENDING_CATEGORY = {
+    "$switch": {
+        "branches": [
+            {"case": {"$regexMatch": {"input": {"$ifNull": ["$metadata.venueName", ""]}, "regex": "café|restaurant", "options": "i"}}, "then": "venues"},
+            {"case": {"$regexMatch": {"input": {"$ifNull": ["$metadata.venueName", ""]}, "regex": "ticket|event", "options": "i"}}, "then": "events"}
+        ],
+        "default": "other"
+    }
+}
+
+def to_utc_iso(value: str) -> str:
+    """ISO 8601 timestamp or date as a UTC isoformat string; naive input is taken as UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc).isoformat()
+    return parsed.astimezone(timezone.utc).isoformat()
+
 @api_router.get("/analytics/wallet/{userId}")
-async def get_wallet_analytics(userId: str):
-    """Get wallet-specific analytics"""
+async def get_wallet_analytics(userId: str, start: Optional[str] = None, end: Optional[str] = None):
+    """Get wallet-specific analytics, optionally limited to an ISO 8601 date range"""
     wallet = await db.users.find_one({"id": userId}, {"_id": 0, "walletBalance": 1})
     if not wallet:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get transactions
-    transactions = await db.wallet_transactions.find({"userId": userId}, {"_id": 0}).to_list(None)
+    match = {"userId": userId}
+    created_range = {}
+    try:
+        if start:
+            created_range["$gte"] = to_utc_iso(start)
+        if end:
+            created_range["$lt"] = to_utc_iso(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 timestamps")
+    if created_range:
+        match["createdAt"] = created_range
+    
+    # Totals by type and spending by category, grouped server-side
+    facets = await db.wallet_transactions.aggregate([
+        {"$match": match},
+        {"$facet": {
+            "byType": [
+                {"$group": {"_id": "$type", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+            ],
+            "byCategory": [
+                {"$match": {"type": "payment"}},
+                {"$group": {"_id": {"$ifNull": ["$category", LEGACY_SPENDING_CATEGORY]}, "amount": {"$sum": "$amount"}}}
+            ]
+        }}
+    ]).to_list(1)
+    by_type = {row["_id"]: row for row in facets[0]["byType"]} if facets else {}
+    by_category = {row["_id"]: row["amount"] for row in facets[0]["byCategory"]} if facets else {}
     
-    # Calculate spending
-    total_spent = sum(t.get("amount", 0) for t in transactions if t.get("type") == "payment")
-    total_added = sum(t.get("amount", 0) for t in transactions if t.get("type") == "topup")
+    payments = by_type.get("payment", {"amount": 0, "count": 0})
+    total_spent = payments["amount"]
+    total_added = by_type.get("topup", {"amount": 0})["amount"]
     
-    # Get credits earned
-    credits = await db.loop_credits.find({"userId": userId}, {"_id": 0}).to_list(None)
-    total_credits_earned = sum(c.get("amount", 0) for c in credits if c.get("type") == "earn")
+    # Credits earned
+    credit_rows = await db.loop_credits.aggregate([
+        {"$match": {**match, "type": "earn"}},
+        {"$group": {"_id": None, "amount": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    total_credits_earned = credit_rows[0]["amount"] if credit_rows else 0
     
-    # Spending by category (mock)
-    spending_breakdown = {
-        "venues": 0,
-        "events": 0,
-        "marketplace": 0,
-        "other": 0
-    }
+    spending_breakdown = {"venues": 0, "events": 0, "marketplace": 0, "other": 0}
+    for category, amount in by_category.items():
+        key = category if category in spending_breakdown else "other"
+        spending_breakdown[key] += amount
     
-    for txn in transactions:
-        if txn.get("type") == "payment":
-            metadata = txn.get("metadata", {})
-            venue_name = metadata.get("venueName", "")
-            if "café" in venue_name.lower() or "restaurant" in venue_name.lower():
-                spending_breakdown["venues"] += txn.get("amount", 0)
-            elif "ticket" in venue_name.lower() or "event" in venue_name.lower():
-                spending_breakdown["events"] += txn.get("amount", 0)
-            else:
-                spending_breakdown["other"] += txn.get("amount", 0)
+    # Most recent items via the (userId, createdAt) index
+    recent_transactions = await db.wallet_transactions.find(match, {"_id": 0}).sort("createdAt", -1).to_list(10)
     
     return {
         "userId": userId,
@@ -5171,48 +5482,46 @@ async def get_wallet_analytics(userId: str):
         "totalSpent": total_spent,
         "totalAdded": total_added,
         "totalCreditsEarned": total_credits_earned,
-        "transactionCount": len(transactions),
+        "transactionCount": sum(row["count"] for row in by_type.values()),
         "spendingBreakdown": spending_breakdown,
-        "avgTransactionAmount": round(total_spent / max(len([t for t in transactions if t.get("type") == "payment"]), 1), 2),
-        "recentTransactions": sorted(transactions, key=lambda x: x.get("createdAt", ""), reverse=True)[:10]
+        "avgTransactionAmount": round(total_spent / max(payments["count"], 1), 2),
+        "recentTransactions": recent_transactions
     }
 
 @api_router.get("/analytics/admin")
 async def get_admin_dashboard(adminUserId: str):
     """Get platform-wide admin analytics"""
     # Verify admin (in production, check admin role)
-    admin = await db.users.find_one({"id": adminUserId}, {"_id": 0})
+    admin = await db.users.find_one({"id": adminUserId}, {"_id": 0, "id": 1})
     if not admin:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Count totals
-    total_users = await db.users.count_documents({})
-    total_posts = await db.posts.count_documents({})
-    total_reels = await db.reels.count_documents({})
-    total_tribes = await db.tribes.count_documents({})
-    total_rooms = await db.vibe_rooms.count_documents({})
+    # Platform totals come from the counters doc; collection sizes from metadata
+    counters = await engagement_counters.get("platform", PLATFORM_SCOPE_ID)
+    totals = counters["totals"]
+    total_users = await db.users.estimated_document_count()
+    total_tribes = await db.tribes.estimated_document_count()
+    total_rooms = await db.vibe_rooms.estimated_document_count()
     
     # Active users (posted in last 7 days)
-    from datetime import timedelta
     week_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
     active_users = await db.posts.distinct("authorId", {"createdAt": {"$gte": week_ago}})
     
-    # Platform engagement
-    all_posts = await db.posts.find({}, {"_id": 0, "likes": 1, "comments": 1}).to_list(None)
-    total_likes = sum(len(p.get("likes", [])) for p in all_posts)
-    total_comments = sum(len(p.get("comments", [])) for p in all_posts)
+    # Week-over-week change in peak daily active users, from the daily rollups
+    this_week = await metric_rollup.platform_window("activeUsers", 7)
+    last_week = await metric_rollup.platform_window("activeUsers", 7, offset_days=7)
     
     return {
         "totalUsers": total_users,
         "activeUsers": len(active_users),
-        "totalPosts": total_posts,
-        "totalReels": total_reels,
+        "totalPosts": totals["posts"],
+        "totalReels": totals["reels"],
         "totalTribes": total_tribes,
         "totalRooms": total_rooms,
-        "totalLikes": total_likes,
-        "totalComments": total_comments,
-        "platformEngagementRate": round((total_likes + total_comments) / max(total_posts, 1), 2),
-        "growthRate": "+23%",  # Mock - track historical data
+        "totalLikes": totals["likes"],
+        "totalComments": totals["comments"],
+        "platformEngagementRate": round((totals["likes"] + totals["comments"]) / max(totals["posts"], 1), 2),
+        "growthRate": format_growth(this_week, last_week),
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
@@ -5306,11 +5615,11 @@ async def send_friend_request(fromUserId: str, toUserId: str):
     notification = Notification(
         userId=toUserId,
         type="friend_request",
-        content=f"{from_user.get('name', 'Someone')} sent you a friend request",
+        message=f"{from_user.get('name', 'Someone')} sent you a friend request",
         link=f"/profile/{fromUserId}",
         payload={"fromUser": from_user}
     )
-    await db.notifications.insert_one(notification.model_dump())
+    notification_outbox.enqueue(notification.model_dump())
     
     # Real-time notification via WebSocket
     await emit_to_user(toUserId, 'friend_request', {
@@ -5408,11 +5717,11 @@ async def accept_friend_request(requestId: str):
     notification = Notification(
         userId=request["fromUserId"],
         type="friend_accepted",
-        content=f"{to_user.get('name', 'Someone')} accepted your friend request",
+        message=f"{to_user.get('name', 'Someone')} accepted your friend request",
         link=f"/profile/{request['toUserId']}",
         payload={"toUser": to_user}
     )
-    await db.notifications.insert_one(notification.model_dump())
+    notification_outbox.enqueue(notification.model_dump())
     
     # Real-time notifications via WebSocket
     await emit_to_user(request["fromUserId"], 'friend_event', {
@@ -5795,7 +6104,9 @@ async def send_message(threadId: str, userId: str, payload: SendMessageInput = B
         mediaUrl=payload.mediaUrl,
         mimeType=payload.mimeType
     )
+    safety_screen.check("dm", message.text, userId, message.id)
     await db.messages.insert_one(message.model_dump())
+    await media_store.set_refs("message", message.id, [message.mediaUrl])
     
     # Update thread's lastMessageAt
     await db.dm_threads.update_one(
@@ -5824,11 +6135,11 @@ async def send_message(threadId: str, userId: str, payload: SendMessageInput = B
         notification = Notification(
             userId=peer_id,
             type="dm",
-            content=payload.text[:50] if payload.text else "Sent a photo",
+            message=payload.text[:50] if payload.text else "Sent a photo",
             link=f"/messenger/{threadId}",
             payload={"sender": sender, "threadId": threadId}
         )
-        await db.notifications.insert_one(notification.model_dump())
+        notification_outbox.enqueue(notification.model_dump())
     
     return {"messageId": message.id, "timestamp": message.createdAt}
 
@@ -5875,6 +6186,7 @@ async def edit_message(messageId: str, userId: str, text: str):
     if message.get("deletedAt"):
         raise HTTPException(status_code=400, detail="Cannot edit deleted message")
     
+    safety_screen.check("dm", text, userId, messageId)
     await db.messages.update_one(
         {"id": messageId},
         {"$set": {
@@ -5906,6 +6218,7 @@ async def delete_message(messageId: str, userId: str):
         {"id": messageId},
         {"$set": {"deletedAt": datetime.now(timezone.utc).isoformat()}}
     )
+    await media_store.set_refs("message", messageId, [])
     
     # Real-time: emit deletion to thread
     await emit_to_thread(message["threadId"], 'message_deleted', {
@@ -6208,6 +6521,7 @@ async def create_order(
         "userId": userId,
         "type": "payment",
         "amount": totalAmount,
+        "category": "marketplace",
         "description": f"Order #{order['id']}",
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
@@ -6347,7 +6661,7 @@ async def initiate_call(callerId: str, recipientId: str, callType: str = "video"
             "read": False,
             "createdAt": datetime.now(timezone.utc).isoformat()
         }
-        await db.notifications.insert_one(notification)
+        notification_outbox.enqueue(notification)
         
         # Emit WebSocket event to recipient for real-time call notification
         try:
@@ -6476,8 +6790,7 @@ async def send_notification(userId: str, type: str, title: str, message: str, da
         "read": False,
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
-    await db.notifications.insert_one(notification)
-    notification.pop("_id", None)
+    notification_outbox.enqueue(dict(notification))
     
     # In production, this would also trigger browser push notification
     # For now, just store in database
@@ -6491,31 +6804,32 @@ async def get_notifications(userId: str, limit: int = 50, unreadOnly: bool = Fal
     if unreadOnly:
         query["read"] = False
     
-    notifications = await db.notifications.find(query, {"_id": 0}).sort("createdAt", -1).limit(limit).to_list(limit)
+    notifications = await db.notifications.find(
+        query, {"_id": 0, "expireAt": 0, "actorIds": 0}
+    ).sort("createdAt", -1).limit(limit).to_list(limit)
     return notifications
 
+@api_router.get("/notifications/{userId}/count")
+async def get_unread_notification_count(userId: str):
+    """Unread badge count (a single counter document read)"""
+    return {"unread": await notification_unread.get(userId)}
+
 @api_router.post("/notifications/{notificationId}/read")
 async def mark_notification_read(notificationId: str):
     """Mark notification as read"""
-    await db.notifications.update_one(
-        {"id": notificationId},
-        {"$set": {"read": True, "readAt": datetime.now(timezone.utc).isoformat()}}
-    )
+    await notification_unread.mark_read(notificationId)
     return {"success": True}
 
 @api_router.post("/notifications/{userId}/read-all")
 async def mark_all_notifications_read(userId: str):
     """Mark all notifications as read"""
-    await db.notifications.update_many(
-        {"userId": userId, "read": False},
-        {"$set": {"read": True, "readAt": datetime.now(timezone.utc).isoformat()}}
-    )
-    return {"success": True}
+    updated = await notification_unread.mark_all_read(userId)
+    return {"success": True, "updated": updated}
 
 @api_router.delete("/notifications/{notificationId}")
 async def delete_notification(notificationId: str):
     """Delete notification"""
-    await db.notifications.delete_one({"id": notificationId})
+    await notification_unread.delete(notificationId)
     return {"success": True}
 
     analytics["creditsBalance"] = credits_info["balance"]
@@ -6545,227 +6859,108 @@ async def delete_notification(notificationId: str):
 # ===== PARALLELS AI ENGINE =====
 # AI-powered recommendation and matching system
 
-from emergentintegrations.llm.chat import LlmChat, UserMessage
-import json
-
-# Initialize LLM with Emergent LLM key
-EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
-
 @api_router.get("/ai/taste-dna/{userId}")
-async def get_taste_dna(userId: str):
-    """Generate user's TasteDNA based on their activity"""
-    try:
-        # Fetch user activity data
-        user = await db.users.find_one({"id": userId}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get user's posts, likes, check-ins
-        posts = await db.posts.find({"author": userId}, {"_id": 0}).to_list(100)
-        liked_posts = await db.posts.find({"likes": userId}, {"_id": 0}).to_list(100)
-        
-        # Get interests from onboarding
-        interests = user.get("interests", [])
-        
-        # Initialize AI chat
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"taste-dna-{userId}",
-            system_message="You are an AI that analyzes user behavior to generate taste profiles. Return ONLY valid JSON, no markdown formatting."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        # Create prompt for AI
-        prompt = f"""Analyze this user's activity and generate their TasteDNA profile.
-
-User Interests: {', '.join(interests) if interests else 'Not specified'}
-Number of Posts: {len(posts)}
-Number of Likes: {len(liked_posts)}
-
-Based on this data, generate a taste profile with:
-1. categories: food, music, spiritual, social, fitness, art (each 0-100%)
-2. topInterests: array of 3-5 specific interests
-3. personalityType: one of [Explorer, Creator, Social, Spiritual]
-
-Return ONLY this JSON structure:
-{{
-  "categories": {{
-    "food": <number>,
-    "music": <number>,
-    "spiritual": <number>,
-    "social": <number>,
-    "fitness": <number>,
-    "art": <number>
-  }},
-  "topInterests": [<interests>],
-  "personalityType": "<type>"
-}}"""
-        
-        message = UserMessage(text=prompt)
-        response = await chat.send_message(message)
-        
-        # Parse AI response
-        try:
-            # Clean response - remove markdown code blocks if present
-            clean_response = response.strip()
-            if clean_response.startswith("```json"):
-                clean_response = clean_response[7:]
-            if clean_response.startswith("```"):
-                clean_response = clean_response[3:]
-            if clean_response.endswith("```"):
-                clean_response = clean_response[:-3]
-            clean_response = clean_response.strip()
-            
-            taste_dna = json.loads(clean_response)
-            
-            # Store in database
-            await db.taste_dna.update_one(
-                {"userId": userId},
-                {"$set": {**taste_dna, "updatedAt": datetime.now(timezone.utc).isoformat()}},
-                upsert=True
-            )
-            
-            return taste_dna
-        except json.JSONDecodeError:
-            # Fallback to rule-based generation
-            return generate_fallback_taste_dna(user, posts, liked_posts, interests)
-            
-    except Exception as e:
-        logger.error(f"Error generating taste DNA: {str(e)}")
-        # Return fallback
-        return generate_fallback_taste_dna(user, [], [], [])
-
-def generate_fallback_taste_dna(user, posts, liked_posts, interests):
-    """Generate taste DNA without AI"""
-    # Simple rule-based approach
-    categories = {
-        "food": min(100, len([i for i in interests if 'food' in i.lower() or 'cafe' in i.lower()]) * 20 + 50),
-        "music": min(100, len([i for i in interests if 'music' in i.lower()]) * 20 + 40),
-        "spiritual": min(100, len([i for i in interests if 'spiritual' in i.lower() or 'temple' in i.lower()]) * 20 + 30),
-        "social": min(100, len(posts) * 5 + len(liked_posts) * 2 + 40),
-        "fitness": min(100, len([i for i in interests if 'fitness' in i.lower() or 'gym' in i.lower()]) * 20 + 30),
-        "art": min(100, len([i for i in interests if 'art' in i.lower() or 'creative' in i.lower()]) * 20 + 40)
-    }
-    
-    return {
-        "categories": categories,
-        "topInterests": interests[:3] if interests else ["Social", "Food", "Music"],
-        "personalityType": "Explorer"
-    }
+async def get_taste_dna(userId: str, refresh: bool = False):
+    """
+    User's TasteDNA. Served from the stored profile (or a rule-based fallback)
+    without waiting on the LLM; refresh=true waits for a regenerated profile.
+    """
+    if refresh:
+        profile = await taste_dna_service.regenerate(userId)
+        if profile:
+            return profile
+    return await taste_dna_service.get(userId)
 
 @api_router.get("/ai/find-parallels/{userId}")
-async def find_parallels(userId: str):
+async def find_parallels(userId: str, limit: int = 10):
     """Find users with similar tastes and interests"""
     try:
-        # Get user's taste DNA
-        user_taste = await db.taste_dna.find_one({"userId": userId}, {"_id": 0})
-        if not user_taste:
-            # Generate it first
-            user_taste = await get_taste_dna(userId)
-        
         # Get current user
-        current_user = await db.users.find_one({"id": userId}, {"_id": 0})
+        current_user = await db.users.find_one({"id": userId}, {"_id": 0, "password": 0})
         if not current_user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Get all other users
-        all_users = await db.users.find({"id": {"$ne": userId}}, {"_id": 0}).to_list(None)
+        # Get user's taste DNA; users without one are matched on their
+        # interests rather than waiting on the LLM
+        user_taste = taste_index.get(userId) or await taste_dna_service.get(userId, current_user)
+        
+        # Top matches across every indexed profile (match score = 1 - L1 distance / max distance)
+        matches = taste_index.similar(user_taste, k=min(max(limit, 1), 50), min_score=60, exclude=[userId])
+        users = await db.users.find(
+            {"id": {"$in": [matchId for matchId, _ in matches]}}, {"_id": 0, "password": 0}
+        ).to_list(len(matches))
+        users_by_id = {u["id"]: u for u in users}
         
-        # Get taste DNA for all users
+        user_interests = set(user_taste.get("topInterests", []))
         parallels = []
-        for user in all_users[:20]:  # Limit to 20 for performance
-            other_taste = await db.taste_dna.find_one({"userId": user["id"]}, {"_id": 0})
-            
-            if not other_taste:
-                # Generate taste DNA for this user
-                try:
-                    other_taste = await get_taste_dna(user["id"])
-                except:
-                    continue
-            
-            # Calculate match score based on category similarity
-            user_cats = user_taste.get("categories", {})
-            other_cats = other_taste.get("categories", {})
-            
-            # Calculate similarity (inverse of total difference)
-            total_diff = sum(abs(user_cats.get(cat, 0) - other_cats.get(cat, 0)) for cat in user_cats.keys())
-            max_diff = 600  # Max possible difference (6 categories * 100)
-            match_score = int(100 * (1 - total_diff / max_diff))
+        for matchId, score in matches:
+            user = users_by_id.get(matchId)
+            if not user:
+                continue
             
             # Find common interests
-            user_interests = set(user_taste.get("topInterests", []))
-            other_interests = set(other_taste.get("topInterests", []))
-            common_interests = list(user_interests & other_interests)
-            
-            # Only include if match score is above 60%
-            if match_score >= 60:
-                parallels.append({
-                    **user,
-                    "matchScore": match_score,
-                    "commonInterests": common_interests if common_interests else ["Similar taste in content"],
-                    "reason": f"You both love {', '.join(common_interests[:2])}" if common_interests else "Similar activity patterns and interests"
-                })
-        
-        # Sort by match score
-        parallels.sort(key=lambda x: x["matchScore"], reverse=True)
+            common_interests = list(user_interests & set(taste_index.interests(matchId)))
+            parallels.append({
+                **user,
+                "matchScore": int(score),
+                "commonInterests": common_interests if common_interests else ["Similar taste in content"],
+                "reason": f"You both love {', '.join(common_interests[:2])}" if common_interests else "Similar activity patterns and interests"
+            })
         
-        return parallels[:10]  # Return top 10 matches
+        return parallels
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error finding parallels: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def ranked_documents(kind: str, collection, query: dict, limit: int) -> List[dict]:
+    """Top BM25 matches for a weighted query, as documents carrying recommendationScore"""
+    ranked = await content_index.search(kind, query, k=limit)
+    docs = await collection.find(
+        {"id": {"$in": [docId for docId, _ in ranked]}}, {"_id": 0, "searchIndexedAt": 0}
+    ).to_list(len(ranked))
+    by_id = {doc["id"]: doc for doc in docs}
+    return [
+        {**by_id[docId], "recommendationScore": round(score, 2)}
+        for docId, score in ranked if docId in by_id
+    ]
+
 @api_router.get("/ai/recommend/content")
 async def recommend_content(userId: str, type: str = "posts"):
     """Recommend posts or reels based on user's taste"""
     try:
         # Get user's taste DNA
-        user_taste = await db.taste_dna.find_one({"userId": userId}, {"_id": 0})
-        if not user_taste:
-            user_taste = await get_taste_dna(userId)
+        user_taste = await taste_dna_service.get(userId)
         
-        # Get user's interests
-        interests = user_taste.get("topInterests", [])
+        # Interests and TasteDNA categories as weighted BM25 query terms
+        query = taste_query(user_taste.get("topInterests", []), user_taste.get("categories"))
         
-        # Get content (posts or reels)
-        collection = db.posts if type == "posts" else db.reels
-        all_content = await collection.find({}, {"_id": 0}).to_list(100)
-        
-        # Simple keyword matching for now
-        recommended = []
-        for content in all_content:
-            score = 0
-            text = content.get("text", "") + " " + content.get("caption", "")
-            
-            for interest in interests:
-                if interest.lower() in text.lower():
-                    score += 20
-            
-            if score > 0:
-                recommended.append({**content, "recommendationScore": score})
-        
-        # Sort by score
-        recommended.sort(key=lambda x: x.get("recommendationScore", 0), reverse=True)
-        
-        return recommended[:20]
+        if type == "posts":
+            return await ranked_documents("post", db.posts, query, 20)
+        return await ranked_documents("reel", db.reels, query, 20)
         
     except Exception as e:
         logger.error(f"Error recommending content: {str(e)}")
         return []
 
 @api_router.get("/ai/recommend/venues")
-async def recommend_venues(userId: str):
-    """Recommend venues based on user's taste"""
+async def recommend_venues(userId: str, lat: Optional[float] = None, lng: Optional[float] = None,
+                           radiusKm: float = 10):
+    """Recommend venues based on user's taste (only venues near lat/lng when given)"""
     try:
         # Get user's taste DNA
-        user_taste = await db.taste_dna.find_one({"userId": userId}, {"_id": 0})
-        if not user_taste:
-            user_taste = await get_taste_dna(userId)
+        user_taste = await taste_dna_service.get(userId)
         
         # Get user's categories
         categories = user_taste.get("categories", {})
         
-        # Get all venues
-        venues = await db.venues.find({}, {"_id": 0}).to_list(100)
+        # Candidate venues: nearby ones when the user shared a location
+        if lat is not None and lng is not None:
+            venues = await geo_discovery.nearby("venue", lng, lat, radiusKm, limit=100)
+        else:
+            venues = await db.venues.find({}, {"_id": 0}).to_list(100)
         
         # Score venues based on user's preferences
         scored_venues = []
@@ -6803,53 +6998,73 @@ async def recommend_events(userId: str):
     """Recommend events based on user's taste"""
     try:
         # Get user's taste DNA
-        user_taste = await db.taste_dna.find_one({"userId": userId}, {"_id": 0})
-        if not user_taste:
-            user_taste = await get_taste_dna(userId)
-        
-        # Get user's interests
-        interests = user_taste.get("topInterests", [])
-        categories = user_taste.get("categories", {})
-        
-        # Get all events
-        events = await db.events.find({}, {"_id": 0}).to_list(100)
-        
-        # Score events
-        scored_events = []
-        for event in events:
-            score = 0
-            event_name = event.get("name", "").lower()
-            event_desc = event.get("description", "").lower()
-            
-            # Match with interests
-            for interest in interests:
-                if interest.lower() in event_name or interest.lower() in event_desc:
-                    score += 20
-            
-            # Match with categories
-            if "music" in event_name or "concert" in event_name:
-                score += categories.get("music", 0) * 0.5
-            if "food" in event_name or "festival" in event_name:
-                score += categories.get("food", 0) * 0.5
-            if "tech" in event_name or "startup" in event_name:
-                score += categories.get("social", 0) * 0.3
-            
-            # Add vibe meter bonus
-            score += event.get("vibeMeter", 0) * 0.5
-            
-            if score > 20:
-                scored_events.append({**event, "recommendationScore": int(score)})
+        user_taste = await taste_dna_service.get(userId)
         
-        # Sort by score
-        scored_events.sort(key=lambda x: x.get("recommendationScore", 0), reverse=True)
+        # Interests and TasteDNA categories as weighted BM25 query terms
+        query = taste_query(user_taste.get("topInterests", []), user_taste.get("categories"))
         
-        return scored_events[:10]
+        return await ranked_documents("event", db.events, query, 10)
         
     except Exception as e:
         logger.error(f"Error recommending events: {str(e)}")
         return []
 
 
+# ===== METRICS =====
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def require_metrics_token(request: Request):
+    """
+    Bearer METRICS_TOKEN. Fails closed: without a configured token the
+    metrics and debug endpoints (query shapes, stacks, profiles) do not exist.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+@app.get("/metrics", include_in_schema=False)
+@app.get("/api/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    require_metrics_token(request)
+    return Response(metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/api/metrics/mongo/slow", include_in_schema=False)
+async def get_slow_mongo_commands(request: Request, limit: int = 50):
+    """Recent slow Mongo commands with their query shapes and routes, newest first"""
+    require_metrics_token(request)
+    return {"slowMs": mongo_monitor.slow_seconds * 1000, "commands": mongo_monitor.slow_commands(min(limit, 200))}
+
+@app.get("/api/metrics/loop/blocks", include_in_schema=False)
+async def get_loop_blocks(request: Request, limit: int = 20):
+    """Recent event loop stalls with the stack that blocked the loop, newest first"""
+    require_metrics_token(request)
+    return {"thresholdMs": loop_monitor.threshold * 1000, "blocks": loop_monitor.recent_blocks(min(limit, 100))}
+
+@app.get("/api/metrics/profiles", include_in_schema=False)
+async def list_request_profiles(request: Request, limit: int = 50):
+    """Recently profiled requests (timings only), newest first"""
+    require_metrics_token(request)
+    return {"profiles": await request_profiler.recent(min(limit, 200))}
+
+@app.get("/api/metrics/profiles/{profileId}", include_in_schema=False)
+async def download_request_profile(request: Request, profileId: str):
+    """A profile as collapsed stacks, ready for flamegraph.pl or speedscope"""
+    require_metrics_token(request)
+    profile = await request_profiler.get(profileId)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        profile.get("collapsed", ""),
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profileId}.collapsed"'}
+    )
+
+# Count and time every Socket.IO event handler registered above
+instrument_socketio(sio)
+
 # Include router
 app.include_router(api_router)
 
@@ -6861,6 +7076,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Installed only when enabled, so unprofiled deployments pay nothing
+if request_profiler.enabled:
+    app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
+app.add_middleware(MongoRequestMiddleware, monitor=mongo_monitor)
+app.add_middleware(UploadSizeGuard)
+# Outermost, so latency covers CORS and error handling too
+app.add_middleware(MetricsMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -6886,11 +7109,13 @@ async def startup_db_indexes():
         await db.posts.create_index("authorId")  # For user's posts
         await db.posts.create_index([("createdAt", -1)])  # For timeline sorting
         await db.posts.create_index("likes")  # For like lookups
+        await db.posts.create_index([("authorId", 1), ("stats.likes", -1)])  # For top content
         
         # Reels collection indexes
         await db.reels.create_index("id", unique=True)
         await db.reels.create_index("authorId")
         await db.reels.create_index([("createdAt", -1)])
+        await db.reels.create_index([("authorId", 1), ("stats.likes", -1)])
         
         # DM threads indexes
         await db.dm_threads.create_index("id", unique=True)
@@ -6909,6 +7134,10 @@ async def startup_db_indexes():
         await db.calls.create_index("recipientId")
         await db.calls.create_index([("startedAt", -1)])
         
+        # Wallet and credit ledger indexes (per-user history, newest first)
+        await db.wallet_transactions.create_index([("userId", 1), ("createdAt", -1)])
+        await db.loop_credits.create_index([("userId", 1), ("createdAt", -1)])
+        
         # Notifications indexes
         await db.notifications.create_index("id", unique=True)
         await db.notifications.create_index("userId")
@@ -6925,18 +7154,74 @@ async def startup_db_indexes():
         
         # TasteDNA indexes
         await db.taste_dna.create_index("userId", unique=True)
+        await db.safety_flags.create_index([("status", 1), ("createdAt", -1)])  # moderation queue
         
         # Vibe Capsules (Stories) indexes with TTL for 24-hour expiration
         await db.vibe_capsules.create_index("id", unique=True)
         await db.vibe_capsules.create_index("authorId")
         await db.vibe_capsules.create_index([("createdAt", -1)])
-        await db.vibe_capsules.create_index("expiresAt", expireAfterSeconds=0)  # TTL index for auto-deletion
         
         logger.info("✅ Database indexes created successfully - Ready for 100k+ users")
     except Exception as e:
         logger.warning(f"⚠️ Some indexes already exist or had issues: {str(e)}")
         logger.info("✅ Database is ready for operations")
 
+    # Each subsystem sets up on its own, so one failing index or rebuild
+    # cannot silently skip the others
+    subsystems = [
+        ("geo discovery", geo_discovery.create_indexes),  # 2dsphere on venue/event points
+        ("geo backfill", geo_discovery.backfill),
+        ("taste index", taste_index.create_indexes),
+        ("content index", content_index.create_indexes),  # BM25 postings, term frequencies, backfill marker
+        ("translation cache", translation_service.create_indexes),  # TTL on cached translations
+        ("request profiles", request_profiler.create_indexes),  # TTL on stored profiles
+        ("media store", media_store.create_indexes),  # upload sessions (TTL), media records and references
+        # Coalesced notification groups, unread badge lookups and read-notification TTL
+        ("notification outbox", notification_outbox.create_indexes),
+        ("unread counters", notification_unread.create_indexes),
+        ("ticket booking", ticket_booking.create_indexes),  # hold sweeper scan and per-user tickets
+        # Engagement counters and time-series rollups for analytics dashboards
+        ("engagement counters", engagement_counters.create_indexes),
+        ("metric rollups", metric_rollup.create_indexes),
+        ("stories tray", stories_tray.create_indexes),  # Capsule TTL on expireAt (expiresAt is a string) and the tray's author set
+        ("stories tray rebuild", stories_tray.rebuild),
+        ("view tracker", view_tracker.create_indexes),
+        ("venue vibe", venue_vibe.create_indexes),  # dedupes active check-ins first
+        ("venue vibe rebuild", venue_vibe.rebuild),
+    ]
+    for name, setup in subsystems:
+        try:
+            await setup()
+        except Exception as e:
+            logger.error(f"Startup step '{name}' failed: {str(e)}")
+
+@app.on_event("startup")
+async def start_background_jobs():
+    """Start periodic background jobs"""
+    loop_monitor.start()
+    metric_rollup.start()
+    media_store.start()
+    ticket_booking.start()
+    notification_outbox.start()
+    view_tracker.start(KIND_COLLECTIONS)
+    venue_vibe.start()
+    taste_index.start()
+    taste_dna_service.start()
+    content_index.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await metric_rollup.stop()
+    await media_store.shutdown()
+    await ticket_booking.stop()
+    await notification_outbox.stop()
+    await view_tracker.stop()
+    await venue_vibe.stop()
+    await taste_index.stop()
+    await taste_dna_service.stop()
+    await content_index.stop()
+    await safety_screen.drain()
+    await loop_monitor.stop()
+    await request_profiler.drain()
+    ticket_qr.shutdown()
     client.close()
\ No newline at end of file
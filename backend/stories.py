@@ -0,0 +1,193 @@
+"""
+Stories Tray Module
+Keeps a small set of authors with live stories / Vibe Capsules so the tray is
+one aggregation over active authors (friends first, with item counts) instead
+of scanning every live item, and loads an author's items on demand.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+# Tray kind -> collection holding its items
+KIND_COLLECTIONS = {
+    "capsule": "vibe_capsules",
+    "story": "stories",
+}
+
+# Kinds whose items are deleted once they expire; expired stories are kept
+EXPIRING_KINDS = ("capsule",)
+
+# Fields returned for each tray author
+AUTHOR_FIELDS = ["id", "handle", "name", "avatar"]
+
+
+def item_expire_at(item: dict) -> datetime:
+    """BSON expiry date for an item whose expiresAt is an ISO string (TTL indexes need dates)"""
+    return datetime.fromisoformat(item["expiresAt"])
+
+
+class StoriesTray:
+    """
+    Active-author index for stories and capsules.
+
+    `story_authors` holds one document per (kind, author) with the expiry time
+    of each live item; its expireAt TTL removes the author once their last
+    item lapses. Capsules expire through a TTL on their expireAt; stories are
+    kept after they lapse and live reads filter on expiresAt.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self.authors = db.story_authors
+
+    async def create_indexes(self):
+        await self.authors.create_index([("kind", 1), ("authorId", 1)], unique=True)
+        await self.authors.create_index([("kind", 1), ("expireAt", 1)])
+        await self.authors.create_index("expireAt", expireAfterSeconds=0)
+        for kind, collection in KIND_COLLECTIONS.items():
+            if kind in EXPIRING_KINDS:
+                # expiresAt is an ISO string and cannot drive a TTL; expireAt is its BSON date twin
+                await self.db[collection].create_index("expireAt", expireAfterSeconds=0)
+            await self.db[collection].create_index([("authorId", 1), ("expiresAt", 1)])
+        # Live-item scans; vibe_capsules already has an expiresAt index (declared as a
+        # TTL, which never fires on strings)
+        await self.db.stories.create_index("expiresAt")
+        # Stories are not deleted on expiry: remove a TTL an earlier build created
+        if "expireAt_1" in await self.db.stories.index_information():
+            await self.db.stories.drop_index("expireAt_1")
+            await self.db.stories.update_many({"expireAt": {"$exists": True}}, {"$unset": {"expireAt": ""}})
+
+    async def add(self, kind: str, item: dict):
+        """Register a newly created item (must carry authorId, createdAt and expiresAt)"""
+        await self.authors.bulk_write([self._add_op(kind, item["authorId"], [item])])
+
+    @staticmethod
+    def _add_op(kind: str, authorId: str, items: List[dict]) -> UpdateOne:
+        now = datetime.now(timezone.utc)
+        expiries = [item_expire_at(item) for item in items]
+        latest = max(item["createdAt"] for item in items)
+        # Drop lapsed expiries while appending, so the array stays at the live item count
+        return UpdateOne(
+            {"kind": kind, "authorId": authorId},
+            [{"$set": {
+                "expiries": {"$concatArrays": [
+                    {"$filter": {"input": {"$ifNull": ["$expiries", []]}, "cond": {"$gt": ["$$this", now]}}},
+                    {"$literal": expiries}
+                ]},
+                "latestAt": {"$max": [{"$ifNull": ["$latestAt", ""]}, latest]},
+                "expireAt": {"$max": [{"$ifNull": ["$expireAt", now]}, max(expiries)]}
+            }}],
+            upsert=True
+        )
+
+    async def rebuild(self):
+        """Re-derive the active-author set from live items (startup backfill for older items)"""
+        now = datetime.now(timezone.utc)
+        for kind, collection in KIND_COLLECTIONS.items():
+            by_author: Dict[str, List[dict]] = {}
+            backfill = []
+            async for item in self.db[collection].find(
+                {"expiresAt": {"$gt": now.isoformat()}},
+                {"_id": 0, "id": 1, "authorId": 1, "createdAt": 1, "expiresAt": 1, "expireAt": 1}
+            ):
+                by_author.setdefault(item["authorId"], []).append(item)
+                if kind in EXPIRING_KINDS and "expireAt" not in item:
+                    backfill.append(UpdateOne({"id": item["id"]}, {"$set": {"expireAt": item_expire_at(item)}}))
+
+            if backfill:
+                await self.db[collection].bulk_write(backfill, ordered=False)
+            if by_author:
+                await self.authors.bulk_write([
+                    UpdateOne(
+                        {"kind": kind, "authorId": authorId},
+                        {"$set": {
+                            "expiries": [item_expire_at(i) for i in items],
+                            "latestAt": max(i["createdAt"] for i in items),
+                            "expireAt": max(item_expire_at(i) for i in items)
+                        }},
+                        upsert=True
+                    )
+                    for authorId, items in by_author.items()
+                ], ordered=False)
+
+    async def tray(self, kind: str, viewerId: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """
+        Authors with live items: the viewer first, then friends, then everyone
+        else, each group newest first.
+
+        Returns:
+            List of {"author", "count", "latestAt", "isFriend"}
+        """
+        now = datetime.now(timezone.utc)
+        friends = []
+        if viewerId:
+            viewer = await self.db.users.find_one({"id": viewerId}, {"_id": 0, "friends": 1})
+            friends = (viewer or {}).get("friends", [])
+
+        return await self.authors.aggregate([
+            {"$match": {"kind": kind, "expireAt": {"$gt": now}}},
+            {"$addFields": {
+                "count": {"$size": {"$filter": {"input": "$expiries", "cond": {"$gt": ["$$this", now]}}}},
+                "rank": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$authorId", viewerId]}, "then": 0},
+                        {"case": {"$in": ["$authorId", {"$literal": friends}]}, "then": 1}
+                    ],
+                    "default": 2
+                }}
+            }},
+            {"$match": {"count": {"$gt": 0}}},
+            {"$sort": {"rank": 1, "latestAt": -1}},
+            {"$limit": limit},
+            {"$lookup": {"from": "users", "localField": "authorId", "foreignField": "id", "as": "author"}},
+            {"$unwind": "$author"},
+            {"$project": {
+                "_id": 0,
+                **{f"author.{field}": 1 for field in AUTHOR_FIELDS},
+                "count": 1,
+                "latestAt": 1,
+                "isFriend": {"$eq": ["$rank", 1]}
+            }}
+        ]).to_list(limit)
+
+    async def author_items(self, kind: str, authorId: str, limit: int = 100) -> List[dict]:
+        """An author's live items, oldest first (playback order)"""
+        return await self.db[KIND_COLLECTIONS[kind]].find(
+            {"authorId": authorId, "expiresAt": {"$gt": datetime.now(timezone.utc).isoformat()}},
+            {"_id": 0, "expireAt": 0, "views": 0}
+        ).sort("createdAt", 1).to_list(limit)
+
+    async def feed(self, kind: str, viewerId: Optional[str] = None, max_authors: int = 50,
+                   max_items: int = 100) -> List[dict]:
+        """
+        Tray authors with their live items inlined, for clients that render the
+        whole tray at once: one aggregation plus one indexed item query.
+
+        Returns:
+            List of {"author", "items"} in tray order, items newest first
+        """
+        tray = await self.tray(kind, viewerId, limit=max_authors)
+        if not tray:
+            return []
+
+        items = await self.db[KIND_COLLECTIONS[kind]].find(
+            {
+                "authorId": {"$in": [entry["author"]["id"] for entry in tray]},
+                "expiresAt": {"$gt": datetime.now(timezone.utc).isoformat()}
+            },
+            {"_id": 0, "expireAt": 0, "views": 0}
+        ).sort("createdAt", -1).to_list(max_items)
+
+        by_author: Dict[str, List[dict]] = {}
+        for item in items:
+            by_author.setdefault(item["authorId"], []).append(item)
+        return [
+            {"author": entry["author"], "items": by_author[entry["author"]["id"]]}
+            for entry in tray if entry["author"]["id"] in by_author
+        ]
@@ -0,0 +1,356 @@
+"""
+TasteDNA Service Module
+Serves TasteDNA profiles without putting the LLM on the request path: fresh
+stored profiles are returned as-is, and stale or missing ones are returned
+immediately (the stored profile, or a rule-based fallback) while a single
+regeneration per user runs on a rate- and concurrency-limited background
+queue.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+try:
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+except Exception as e:
+    logging.error(f"Failed to import emergentintegrations: {e}")
+    LlmChat = None
+    UserMessage = None
+
+logger = logging.getLogger(__name__)
+
+# Stored profiles older than this are served but regenerated in the background
+TASTE_DNA_MAX_AGE_HOURS = int(os.environ.get('TASTE_DNA_MAX_AGE_HOURS', 24))
+# LLM budget for regeneration
+TASTE_DNA_CONCURRENCY = int(os.environ.get('TASTE_DNA_CONCURRENCY', 2))
+TASTE_DNA_RATE_PER_MINUTE = int(os.environ.get('TASTE_DNA_RATE_PER_MINUTE', 30))
+# A failed regeneration is not retried for this long
+RETRY_AFTER_SECONDS = 600
+MAX_QUEUED = 1000
+
+CATEGORIES = ("food", "music", "spiritual", "social", "fitness", "art")
+PERSONALITY_TYPES = ("Explorer", "Creator", "Social", "Spiritual")
+
+SYSTEM_MESSAGE = "You are an AI that analyzes user behavior to generate taste profiles. Return ONLY valid JSON, no markdown formatting."
+
+
+def generate_fallback_taste_dna(user, posts, liked_posts, interests):
+    """Generate taste DNA without AI"""
+    # Simple rule-based approach
+    categories = {
+        "food": min(100, len([i for i in interests if 'food' in i.lower() or 'cafe' in i.lower()]) * 20 + 50),
+        "music": min(100, len([i for i in interests if 'music' in i.lower()]) * 20 + 40),
+        "spiritual": min(100, len([i for i in interests if 'spiritual' in i.lower() or 'temple' in i.lower()]) * 20 + 30),
+        "social": min(100, len(posts) * 5 + len(liked_posts) * 2 + 40),
+        "fitness": min(100, len([i for i in interests if 'fitness' in i.lower() or 'gym' in i.lower()]) * 20 + 30),
+        "art": min(100, len([i for i in interests if 'art' in i.lower() or 'creative' in i.lower()]) * 20 + 40)
+    }
+
+    return {
+        "categories": categories,
+        "topInterests": interests[:3] if interests else ["Social", "Food", "Music"],
+        "personalityType": "Explorer"
+    }
+
+
+def build_prompt(interests: List[str], post_count: int, like_count: int) -> str:
+    return f"""Analyze this user's activity and generate their TasteDNA profile.
+
+User Interests: {', '.join(interests) if interests else 'Not specified'}
+Number of Posts: {post_count}
+Number of Likes: {like_count}
+
+Based on this data, generate a taste profile with:
+1. categories: food, music, spiritual, social, fitness, art (each 0-100%)
+2. topInterests: array of 3-5 specific interests
+3. personalityType: one of [Explorer, Creator, Social, Spiritual]
+
+Return ONLY this JSON structure:
+{{
+  "categories": {{
+    "food": <number>,
+    "music": <number>,
+    "spiritual": <number>,
+    "social": <number>,
+    "fitness": <number>,
+    "art": <number>
+  }},
+  "topInterests": [<interests>],
+  "personalityType": "<type>"
+}}"""
+
+
+def parse_taste_dna(response: str) -> dict:
+    """
+    Parse and validate a model response.
+
+    Raises:
+        ValueError: The response is not a usable TasteDNA profile
+    """
+    # Clean response - remove markdown code blocks if present
+    clean = response.strip()
+    if clean.startswith("```json"):
+        clean = clean[7:]
+    if clean.startswith("```"):
+        clean = clean[3:]
+    if clean.endswith("```"):
+        clean = clean[:-3]
+    data = json.loads(clean.strip())
+
+    categories = data.get("categories")
+    if not isinstance(categories, dict):
+        raise ValueError("TasteDNA response has no categories")
+    return {
+        "categories": {c: max(0, min(100, int(float(categories.get(c, 0) or 0)))) for c in CATEGORIES},
+        "topInterests": [str(i) for i in (data.get("topInterests") or [])][:5],
+        "personalityType": data.get("personalityType") if data.get("personalityType") in PERSONALITY_TYPES else "Explorer"
+    }
+
+
+# ----- Models -----
+
+class TasteModel(ABC):
+    """Generates the raw TasteDNA response text for a prompt"""
+
+    name = "base"
+
+    @abstractmethod
+    async def complete(self, userId: str, prompt: str) -> str:
+        """Raw model response for a TasteDNA prompt"""
+
+
+class EmergentTasteModel(TasteModel):
+    """gpt-4o-mini through the Emergent integrations client"""
+
+    name = "emergent"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def complete(self, userId: str, prompt: str) -> str:
+        if LlmChat is None or not self.api_key:
+            raise RuntimeError("LLM is not configured")
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=f"taste-dna-{userId}",
+            system_message=SYSTEM_MESSAGE
+        ).with_model("openai", "gpt-4o-mini")
+        return await chat.send_message(UserMessage(text=prompt))
+
+
+class LocalTasteModel(TasteModel):
+    """
+    Deterministic stand-in for the LLM (tests and local development).
+
+    Scores are seeded from the user ID, so repeated runs return the same
+    profile; `delay` simulates model latency.
+    """
+
+    name = "local"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def complete(self, userId: str, prompt: str) -> str:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        rng = random.Random(userId)
+        interests_line = next((line for line in prompt.splitlines() if line.startswith("User Interests:")), "")
+        interests = [i.strip() for i in interests_line.partition(":")[2].split(",") if i.strip() and i.strip() != "Not specified"]
+        return json.dumps({
+            "categories": {c: rng.randint(20, 95) for c in CATEGORIES},
+            "topInterests": interests[:5] or ["Social", "Food", "Music"],
+            "personalityType": rng.choice(PERSONALITY_TYPES)
+        })
+
+
+def default_taste_model(api_key: Optional[str]) -> Optional[TasteModel]:
+    """
+    The LLM when configured; the stand-in only when TASTE_DNA_MODEL=local.
+
+    Returns None when the LLM is unavailable, in which case users get the
+    rule-based fallback and nothing is generated or stored.
+    """
+    if os.environ.get('TASTE_DNA_MODEL', '').lower() == "local":
+        return LocalTasteModel()
+    if not api_key or LlmChat is None:
+        logger.warning("TasteDNA LLM is not configured (EMERGENT_LLM_KEY or emergentintegrations missing); "
+                       "serving rule-based profiles only")
+        return None
+    return EmergentTasteModel(api_key)
+
+
+# ----- Service -----
+
+class RateLimiter:
+    """Token bucket shared by the regeneration workers"""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / max(per_minute, 1)
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class TasteDNAService:
+    """
+    Cached, deduplicated TasteDNA generation.
+
+    get() never waits on the model: it returns the stored profile (queueing a
+    refresh when older than TASTE_DNA_MAX_AGE_HOURS) or, for users without one,
+    the rule-based fallback while the first profile is generated. Each user
+    has at most one regeneration queued or running; callers that need the
+    new profile await regenerate(), which joins it. Without a model nothing
+    is queued and the fallback is never stored.
+    """
+
+    def __init__(self, db, model: Optional[TasteModel], on_update=None):
+        """
+        Args:
+            db: Motor database handle
+            model: Generates profiles (EmergentTasteModel or LocalTasteModel);
+                None disables generation
+            on_update: Called as on_update(userId, profile) after a profile is stored
+        """
+        self.db = db
+        self.model = model
+        self.on_update = on_update
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUED)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._failed: Dict[str, float] = {}
+        self._limiter = RateLimiter(TASTE_DNA_RATE_PER_MINUTE)
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        """Start the regeneration workers (idempotent)"""
+        if self.model is None:
+            return
+        self._workers = [w for w in self._workers if not w.done()]
+        for _ in range(TASTE_DNA_CONCURRENCY - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._work()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    @staticmethod
+    def is_fresh(profile: dict) -> bool:
+        updated = profile.get("updatedAt")
+        if not updated:
+            return False
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(updated)
+        return age < timedelta(hours=TASTE_DNA_MAX_AGE_HOURS)
+
+    async def get(self, userId: str, user: Optional[dict] = None) -> dict:
+        """
+        A user's TasteDNA, instantly.
+
+        Args:
+            user: The user document, when the caller already has it
+
+        Raises:
+            HTTPException: 404 when the user does not exist
+        """
+        profile = await self.db.taste_dna.find_one({"userId": userId}, {"_id": 0})
+        if profile:
+            if not self.is_fresh(profile):
+                self.refresh(userId)
+            return profile
+
+        user = user or await self.db.users.find_one({"id": userId}, {"_id": 0, "interests": 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        self.refresh(userId)
+        return generate_fallback_taste_dna(user, [], [], user.get("interests", []))
+
+    def refresh(self, userId: str, force: bool = False) -> Optional[asyncio.Future]:
+        """
+        Queue a regeneration unless one is already queued or running.
+
+        Returns:
+            Future resolving to the new profile (None if it failed), or None
+            when there is no model, the queue is full or the user recently
+            failed and not forced
+        """
+        if self.model is None:
+            return None
+        pending = self._pending.get(userId)
+        if pending is not None:
+            return pending
+        if not force and time.monotonic() - self._failed.get(userId, float("-inf")) < RETRY_AFTER_SECONDS:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(userId)
+        except asyncio.QueueFull:
+            logger.warning(f"TasteDNA queue full; not regenerating {userId}")
+            return None
+        self._pending[userId] = future
+        return future
+
+    async def regenerate(self, userId: str) -> Optional[dict]:
+        """Force a regeneration (joining one already in flight) and wait for it; None on failure"""
+        pending = self.refresh(userId, force=True)
+        # Shielded: a disconnecting caller must not cancel the job other callers share
+        return await asyncio.shield(pending) if pending else None
+
+    async def _work(self):
+        while True:
+            userId = await self._queue.get()
+            future = self._pending.get(userId)
+            try:
+                await self._limiter.acquire()
+                profile = await self.generate(userId)
+                self._failed.pop(userId, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"TasteDNA generation failed for {userId}: {str(e)}")
+                self._failed[userId] = time.monotonic()
+                profile = None
+            finally:
+                self._pending.pop(userId, None)
+                self._queue.task_done()
+            if future is not None and not future.done():
+                future.set_result(profile)
+
+    async def generate(self, userId: str) -> dict:
+        """Call the model and store the profile (runs on a queue worker)"""
+        user = await self.db.users.find_one({"id": userId}, {"_id": 0, "interests": 1})
+        if not user:
+            raise ValueError("user not found")
+        post_count = await self.db.posts.count_documents({"authorId": userId})
+        like_count = await self.db.posts.count_documents({"likedBy": userId})
+
+        response = await self.model.complete(userId, build_prompt(user.get("interests", []), post_count, like_count))
+        profile = parse_taste_dna(response)
+        profile["updatedAt"] = datetime.now(timezone.utc).isoformat()
+        profile["model"] = self.model.name
+
+        await self.db.taste_dna.update_one({"userId": userId}, {"$set": profile}, upsert=True)
+        if self.on_update:
+            self.on_update(userId, profile)
+        return profile
@@ -0,0 +1,178 @@
+"""
+TasteDNA Similarity Module
+Keeps every user's TasteDNA category scores in one dense NumPy matrix so
+"find parallels" is a single vectorized distance pass with an argpartition
+top-k over the whole user base, instead of per-user database reads and LLM
+calls inside the request.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Column order of the matrix
+CATEGORIES = ("food", "music", "spiritual", "social", "fitness", "art")
+
+# Largest possible L1 distance (every category 0 vs 100)
+MAX_L1_DISTANCE = 100.0 * len(CATEGORIES)
+
+SYNC_INTERVAL = 30  # seconds between catch-up reads of profiles written by other workers
+INITIAL_CAPACITY = 1024
+
+
+def taste_vector(taste: dict) -> np.ndarray:
+    """Category scores of a TasteDNA document as a float32 row"""
+    categories = taste.get("categories") or {}
+    return np.array([float(categories.get(c, 0) or 0) for c in CATEGORIES], dtype=np.float32)
+
+
+class TasteIndex:
+    """
+    In-memory TasteDNA matrix.
+
+    Row i holds the category vector of `self._ids[i]`. Upserts overwrite a row
+    in place (or append, doubling capacity as needed); removals swap the last
+    row into the hole. Profiles written by other workers are picked up by a
+    background catch-up on `updatedAt`.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self._matrix = np.zeros((INITIAL_CAPACITY, len(CATEGORIES)), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._interests: List[List[str]] = []
+        self._synced_at = ""
+        self._task = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    async def create_indexes(self):
+        await self.db.taste_dna.create_index("updatedAt")  # incremental catch-up
+
+    # ----- Maintenance -----
+
+    def upsert(self, userId: str, taste: dict):
+        """Insert or refresh one user's row"""
+        row = self._rows.get(userId)
+        if row is None:
+            row = len(self._ids)
+            if row == self._matrix.shape[0]:
+                grown = np.zeros((row * 2, len(CATEGORIES)), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+            self._ids.append(userId)
+            self._interests.append([])
+            self._rows[userId] = row
+        self._matrix[row] = taste_vector(taste)
+        self._interests[row] = list(taste.get("topInterests") or [])
+
+    def remove(self, userId: str):
+        row = self._rows.pop(userId, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = self._ids[last]
+            self._interests[row] = self._interests[last]
+            self._rows[self._ids[row]] = row
+        self._ids.pop()
+        self._interests.pop()
+
+    async def sync(self) -> int:
+        """Load profiles updated since the last sync; returns how many rows changed"""
+        query = {"updatedAt": {"$gt": self._synced_at}} if self._synced_at else {}
+        changed = 0
+        async for taste in self.db.taste_dna.find(
+            query, {"_id": 0, "userId": 1, "categories": 1, "topInterests": 1, "updatedAt": 1}
+        ):
+            self.upsert(taste["userId"], taste)
+            self._synced_at = max(self._synced_at, taste.get("updatedAt") or "")
+            changed += 1
+        return changed
+
+    def start(self):
+        """Load the matrix and keep it caught up in the background (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                changed = await self.sync()
+                if changed:
+                    logger.info(f"TasteDNA index: {changed} profiles loaded ({len(self)} users)")
+            except Exception as e:
+                logger.warning(f"TasteDNA index sync failed: {str(e)}")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    # ----- Queries -----
+
+    def get(self, userId: str) -> Optional[dict]:
+        """Indexed profile of a user (categories and topInterests only)"""
+        row = self._rows.get(userId)
+        if row is None:
+            return None
+        return {
+            "categories": {c: float(v) for c, v in zip(CATEGORIES, self._matrix[row])},
+            "topInterests": list(self._interests[row])
+        }
+
+    def interests(self, userId: str) -> List[str]:
+        row = self._rows.get(userId)
+        return list(self._interests[row]) if row is not None else []
+
+    def similar(self, taste: dict, k: int = 10, metric: str = "l1", min_score: float = 0,
+                exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """
+        The k users closest to a TasteDNA profile.
+
+        Args:
+            taste: TasteDNA document (only its categories are used)
+            metric: "l1" (score = 100 * (1 - L1 / MAX_L1_DISTANCE)) or "cosine"
+                (score = 100 * cosine similarity)
+            min_score: Drop users scoring below this
+            exclude: User IDs never returned (e.g. the caller)
+
+        Returns:
+            [(userId, score)] best first
+        """
+        n = len(self._ids)
+        if n == 0 or k <= 0:
+            return []
+        matrix = self._matrix[:n]
+        vector = taste_vector(taste)
+
+        if metric == "cosine":
+            norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+            scores = 100.0 * np.divide(matrix @ vector, norms, out=np.zeros(n, dtype=np.float32), where=norms > 0)
+        else:
+            scores = 100.0 * (1.0 - np.abs(matrix - vector).sum(axis=1) / MAX_L1_DISTANCE)
+
+        excluded = [self._rows[u] for u in exclude if u in self._rows]
+        if excluded:
+            scores[excluded] = -np.inf
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self._ids[i], float(scores[i])) for i in top if scores[i] >= min_score]
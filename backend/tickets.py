@@ -0,0 +1,346 @@
+"""
+Event Tickets Module
+Ticket booking with atomic per-tier inventory (hold, then confirm in one
+transaction with the wallet debit and ledger entries), and ticket QR codes:
+documents store only the QR payload, and the PNG is rendered on demand in
+worker processes, cached in memory and served with long-lived cache headers.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+from cachetools import LRUCache
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from imaging import render_qr_png
+
+logger = logging.getLogger(__name__)
+
+# How long a hold reserves seats before the sweeper returns them to inventory
+TICKET_HOLD_SECONDS = int(os.environ.get('TICKET_HOLD_SECONDS', 600))
+HOLD_SWEEP_INTERVAL = 30
+MAX_TICKETS_PER_BOOKING = 10
+
+# A ticket's payload never changes, but the image is a credential: browsers may
+# keep it forever, shared caches may not
+TICKET_QR_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def ticket_qr_payload(ticket: dict) -> str:
+    """Build the string encoded in a ticket's QR code"""
+    return f"TICKET:{ticket['id']}:QR:{ticket['qrCode']}:EVENT:{ticket['eventId']}"
+
+
+def ticket_qr_url(ticketId: str) -> str:
+    """Relative URL of a ticket's QR image"""
+    return f"/api/tickets/{ticketId}/qr.png"
+
+
+def ticket_qr_etag(payload: str) -> str:
+    """Strong ETag for a QR image, derived from its payload"""
+    return f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+
+
+class TicketQRCodes:
+    """
+    Renders ticket QR codes in a process pool.
+
+    Concurrent requests for the same payload share one render, and recent PNGs
+    are kept in an LRU cache so re-opening a ticket costs no CPU.
+    """
+
+    def __init__(self, workers: int = 2, cache_size: int = 2048):
+        """
+        Args:
+            workers: Worker processes for PNG encoding
+            cache_size: Number of rendered PNGs kept in memory
+        """
+        self._workers = workers
+        self._pool = None  # created on first use; workers are spawned, never forked
+        self._cache = LRUCache(maxsize=cache_size)
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def render(self, payload: str) -> bytes:
+        """Return the PNG bytes for a QR payload"""
+        png = self._cache.get(payload)
+        if png is not None:
+            return png
+
+        pending = self._pending.get(payload)
+        if pending is None:
+            if self._pool is None:
+                # Not forked: children would inherit locks held by this process's threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            pending = asyncio.ensure_future(
+                asyncio.get_running_loop().run_in_executor(self._pool, render_qr_png, payload)
+            )
+            self._pending[payload] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(payload, None))
+
+        png = await asyncio.shield(pending)
+        self._cache[payload] = png
+        return png
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class TicketBooking:
+    """
+    Oversell-proof ticket booking.
+
+    A hold atomically takes seats from a tier's `available` counter with a
+    single conditional update on the event document (tiers without `available`
+    are uncapped). Confirming a hold debits the wallet, issues every ticket
+    with one insert_many and writes the ledger entries inside one transaction.
+    Unconfirmed holds are returned to inventory by a background sweeper.
+
+    On a standalone MongoDB, where transactions are unavailable, the same steps
+    run unsessioned and are compensated on failure.
+    """
+
+    def __init__(self, client, db):
+        """
+        Args:
+            client: Motor client (sessions are started from it)
+            db: Motor database handle
+        """
+        self.client = client
+        self.db = db
+        self.holds = db.ticket_holds
+        self._transactions = None  # detected on first confirm
+        self._task = None
+
+    async def create_indexes(self):
+        await self.holds.create_index("id", unique=True)
+        await self.holds.create_index([("status", 1), ("expiresAt", 1)])  # sweeper scan
+        await self.db.event_tickets.create_index([("userId", 1), ("purchasedAt", -1)])
+
+    def start(self):
+        """Start the expired-hold sweeper (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.release_expired()
+            except Exception as e:
+                logger.warning(f"Ticket hold sweep failed: {str(e)}")
+            await asyncio.sleep(HOLD_SWEEP_INTERVAL)
+
+    # ----- Holds -----
+
+    async def hold(self, eventId: str, userId: str, tier: str, quantity: int) -> dict:
+        """
+        Reserve `quantity` seats of a tier for TICKET_HOLD_SECONDS.
+
+        Raises:
+            HTTPException: 400 for a bad quantity or tier, 404 for a missing
+                event, 409 when the tier does not have enough seats left
+        """
+        if not 1 <= quantity <= MAX_TICKETS_PER_BOOKING:
+            raise HTTPException(status_code=400, detail=f"Quantity must be between 1 and {MAX_TICKETS_PER_BOOKING}")
+
+        event = await self.db.events.find_one(
+            {"id": eventId}, {"_id": 0, "name": 1, "date": 1, "location": 1, "image": 1, "tiers": 1}
+        )
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        tier_data = next((t for t in event.get("tiers", []) if t.get("name") == tier), None)
+        if not tier_data:
+            raise HTTPException(status_code=400, detail="Invalid tier")
+
+        capped = "available" in tier_data
+        if capped:
+            # The seat check and the decrement are one atomic operation
+            result = await self.db.events.update_one(
+                {"id": eventId, "tiers": {"$elemMatch": {"name": tier, "available": {"$gte": quantity}}}},
+                {"$inc": {"tiers.$.available": -quantity, "bookedSeats": quantity}}
+            )
+            if result.modified_count == 0:
+                raise HTTPException(status_code=409, detail="Not enough tickets left in this tier")
+        else:
+            await self.db.events.update_one({"id": eventId}, {"$inc": {"bookedSeats": quantity}})
+
+        now = datetime.now(timezone.utc)
+        hold = {
+            "id": str(uuid.uuid4()),
+            "eventId": eventId,
+            "userId": userId,
+            "tier": tier,
+            "quantity": quantity,
+            "price": tier_data.get("price", 0),
+            "capped": capped,
+            "event": {k: event.get(k, "") for k in ("name", "date", "location", "image")},
+            "status": "held",
+            "createdAt": now.isoformat(),
+            "expiresAt": now + timedelta(seconds=TICKET_HOLD_SECONDS)
+        }
+        try:
+            await self.holds.insert_one(hold)
+        except PyMongoError:
+            await self._restore_inventory(hold)
+            raise
+        hold.pop("_id", None)
+        return hold
+
+    async def get_hold(self, holdId: str, userId: str) -> dict:
+        """Raises HTTPException 404 when the hold does not exist for this user"""
+        hold = await self.holds.find_one({"id": holdId, "userId": userId}, {"_id": 0})
+        if not hold:
+            raise HTTPException(status_code=404, detail="Hold not found")
+        return hold
+
+    async def release(self, holdId: str, userId: str) -> bool:
+        """Cancel a pending hold and return its seats; False if it was not pending"""
+        hold = await self.holds.find_one_and_update(
+            {"id": holdId, "userId": userId, "status": "held"},
+            {"$set": {"status": "released", "releasedAt": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0}
+        )
+        if hold:
+            await self._restore_inventory(hold)
+        return hold is not None
+
+    async def release_expired(self) -> int:
+        """Return the seats of every lapsed hold to inventory"""
+        released = 0
+        now = datetime.now(timezone.utc)
+        while True:
+            # Claim one at a time so concurrent sweepers never double-restore
+            hold = await self.holds.find_one_and_update(
+                {"status": "held", "expiresAt": {"$lte": now}},
+                {"$set": {"status": "expired"}},
+                projection={"_id": 0}
+            )
+            if not hold:
+                return released
+            await self._restore_inventory(hold)
+            released += 1
+
+    async def _restore_inventory(self, hold: dict):
+        inc = {"bookedSeats": -hold["quantity"]}
+        query = {"id": hold["eventId"]}
+        if hold["capped"]:
+            query["tiers.name"] = hold["tier"]
+            inc["tiers.$.available"] = hold["quantity"]
+        await self.db.events.update_one(query, {"$inc": inc})
+
+    # ----- Confirmation -----
+
+    async def confirm(self, hold: dict, tickets: List[dict], ledger: Dict[str, List[dict]]) -> float:
+        """
+        Turn a pending hold into tickets.
+
+        Debits the hold's total from the wallet, marks the hold confirmed and
+        inserts the tickets and ledger documents as one unit.
+
+        Args:
+            hold: Hold document from hold()/get_hold()
+            tickets: Ticket documents to issue
+            ledger: Collection name -> documents to insert alongside (wallet
+                transaction, loop credits)
+
+        Returns:
+            The user's wallet balance after the debit
+
+        Raises:
+            HTTPException: 400 on insufficient balance, 409 when the hold has
+                expired or was already confirmed or released
+        """
+        total = hold["price"] * hold["quantity"]
+
+        async def apply(session):
+            balance = await self._debit(hold["userId"], total, session)
+            claimed = False
+            try:
+                result = await self.holds.update_one(
+                    {"id": hold["id"], "status": "held", "expiresAt": {"$gt": datetime.now(timezone.utc)}},
+                    {"$set": {"status": "confirmed", "confirmedAt": datetime.now(timezone.utc).isoformat()}},
+                    session=session
+                )
+                if result.modified_count == 0:
+                    raise HTTPException(status_code=409, detail="Hold expired or already used")
+                claimed = True
+                await self.db.event_tickets.insert_many(tickets, session=session)
+                for collection, docs in ledger.items():
+                    if docs:
+                        await self.db[collection].insert_many(docs, session=session)
+            except Exception:
+                if session is None:
+                    await self._compensate(hold, total, claimed, tickets, ledger)
+                raise
+            return balance
+
+        if await self._supports_transactions():
+            async with await self.client.start_session() as session:
+                return await session.with_transaction(apply)
+        return await apply(None)
+
+    async def _debit(self, userId: str, amount: float, session) -> float:
+        if amount <= 0:
+            user = await self.db.users.find_one({"id": userId}, {"_id": 0, "walletBalance": 1}, session=session)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            return user.get("walletBalance", 0.0)
+
+        user = await self.db.users.find_one_and_update(
+            {"id": userId, "walletBalance": {"$gte": amount}},
+            {"$inc": {"walletBalance": -amount}},
+            projection={"_id": 0, "walletBalance": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not user:
+            raise HTTPException(status_code=400, detail="Insufficient wallet balance")
+        return user["walletBalance"]
+
+    async def _compensate(self, hold: dict, total: float, claimed: bool, tickets: List[dict],
+                          ledger: Dict[str, List[dict]]):
+        """Undo a partially applied confirmation when running without transactions"""
+        try:
+            if total > 0:
+                await self.db.users.update_one({"id": hold["userId"]}, {"$inc": {"walletBalance": total}})
+            if not claimed:
+                return
+            await self.holds.update_one({"id": hold["id"], "status": "confirmed"}, {"$set": {"status": "held"}})
+            await self.db.event_tickets.delete_many({"id": {"$in": [t["id"] for t in tickets]}})
+            for collection, docs in ledger.items():
+                if docs:
+                    await self.db[collection].delete_many({"id": {"$in": [d["id"] for d in docs]}})
+        except PyMongoError as e:
+            logger.error(f"Failed to roll back ticket hold {hold['id']}: {str(e)}")
+
+    async def _supports_transactions(self) -> bool:
+        if self._transactions is None:
+            try:
+                hello = await self.client.admin.command("hello")
+                self._transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+            except PyMongoError:
+                self._transactions = False
+            if not self._transactions:
+                logger.warning("MongoDB is standalone; ticket confirmation runs without transactions")
+        return self._transactions
@@ -0,0 +1,222 @@
+"""
+Translation Module
+Translation behind a pluggable provider, with a persistent cache keyed by
+(text hash, source, target), an in-memory LRU in front of it, coalescing of
+identical in-flight translations and batching of many strings into one
+provider call. Repeat translations of popular content never reach the
+provider.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Cached translations are kept this long after their last use (TTL on expireAt)
+TRANSLATION_CACHE_DAYS = int(os.environ.get('TRANSLATION_CACHE_DAYS', 90))
+MEMORY_CACHE_SIZE = 10000
+# Strings served from memory push back their persistent expiry at most this often
+TOUCH_INTERVAL_SECONDS = 24 * 3600
+AUTO = "auto"
+
+
+def cache_key(text: str, source: str, target: str, provider: str) -> str:
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return f"{provider}:{source}:{target}:{digest}"
+
+
+class TranslationProvider(ABC):
+    """Translates batches of strings; implementations set max_batch/max_chars to their API limits"""
+
+    name = "base"
+    max_batch = 50  # strings per call
+    max_chars = 20000  # characters per call
+
+    @abstractmethod
+    async def translate_batch(self, texts: List[str], source: str, target: str) -> List[str]:
+        """Translations of `texts`, in order (`source` may be "auto")"""
+
+
+class LocalTranslationProvider(TranslationProvider):
+    """Offline stand-in: a few stock phrases, anything else is tagged as a mock translation"""
+
+    name = "local"
+
+    PHRASES = {
+        "hello": {"hi": "नमस्ते", "es": "hola", "fr": "bonjour"},
+        "goodbye": {"hi": "अलविदा", "es": "adiós", "fr": "au revoir"},
+        "thank you": {"hi": "धन्यवाद", "es": "gracias", "fr": "merci"}
+    }
+
+    def __init__(self):
+        self.calls = 0
+
+    async def translate_batch(self, texts: List[str], source: str, target: str) -> List[str]:
+        self.calls += 1
+        target = target.lower()
+        return [
+            self.PHRASES.get(text.lower(), {}).get(target) or f"[Mock translation of '{text}' to {target}]"
+            for text in texts
+        ]
+
+
+class TranslationService:
+    """
+    Cached, coalesced, batched translation.
+
+    Lookups go LRU -> `translation_cache` (one $in query per request) ->
+    in-flight translations of the same key -> the provider, with the
+    remaining strings packed into as few calls as its limits allow.
+    """
+
+    def __init__(self, db, provider: TranslationProvider):
+        """
+        Args:
+            db: Motor database handle
+            provider: Backend that performs the actual translations
+        """
+        self.cache = db.translation_cache
+        self.provider = provider
+        self._memory = LRUCache(maxsize=MEMORY_CACHE_SIZE)
+        self._touched = LRUCache(maxsize=MEMORY_CACHE_SIZE)  # key -> monotonic time expireAt was last pushed back
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._touches = set()
+
+    async def create_indexes(self):
+        await self.cache.create_index("expireAt", expireAfterSeconds=0)
+
+    async def translate(self, text: str, target: str, source: Optional[str] = None) -> str:
+        return (await self.translate_many([text], target, source))[0]
+
+    async def translate_many(self, texts: List[str], target: str, source: Optional[str] = None) -> List[str]:
+        """Translations of `texts` in order; duplicates and cached strings cost nothing"""
+        source = (source or AUTO).lower()
+        target = target.lower()
+        keys = [cache_key(text, source, target, self.provider.name) for text in texts]
+        results: Dict[str, str] = {}
+
+        missing = []
+        stale = []
+        now = time.monotonic()
+        for key in dict.fromkeys(keys):
+            if key in self._memory:
+                results[key] = self._memory[key]
+                if now - self._touched.get(key, float("-inf")) > TOUCH_INTERVAL_SECONDS:
+                    stale.append(key)
+            else:
+                missing.append(key)
+        # Popular strings live in memory; keep their persistent copies from expiring
+        self._touch(stale)
+
+        if missing:
+            try:
+                async for doc in self.cache.find({"_id": {"$in": missing}}, {"translated": 1}):
+                    results[doc["_id"]] = self._memory[doc["_id"]] = doc["translated"]
+            except PyMongoError as e:
+                logger.warning(f"Translation cache read failed: {str(e)}")
+            self._touch([k for k in missing if k in results])
+
+        # Join identical translations already in flight, start the rest
+        waiting: Dict[str, asyncio.Future] = {}
+        todo: List[Tuple[str, str]] = []
+        text_by_key = dict(zip(keys, texts))
+        for key in missing:
+            if key in results:
+                continue
+            if key in self._pending:
+                waiting[key] = self._pending[key]
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._pending[key] = waiting[key] = future
+                todo.append((key, text_by_key[key]))
+
+        if todo:
+            await self._run(todo, source, target)
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+        return [results[key] for key in keys]
+
+    async def _run(self, todo: List[Tuple[str, str]], source: str, target: str):
+        """Translate claimed keys in provider-sized batches and resolve their futures"""
+        try:
+            for batch in self._batches(todo):
+                translated = await self.provider.translate_batch([text for _, text in batch], source, target)
+                if len(translated) != len(batch):
+                    raise ValueError(
+                        f"{self.provider.name} returned {len(translated)} translations for {len(batch)} texts"
+                    )
+                for (key, _), value in zip(batch, translated):
+                    self._memory[key] = value
+                    future = self._pending.pop(key, None)
+                    if future and not future.done():
+                        future.set_result(value)
+                await self._store(batch, translated, source, target)
+        except BaseException as e:
+            for key, _ in todo:
+                future = self._pending.pop(key, None)
+                if future and not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError("translation cancelled"))
+                    future.exception()  # retrieved; callers re-raise it themselves
+            raise
+
+    def _batches(self, todo: List[Tuple[str, str]]):
+        batch, chars = [], 0
+        for item in todo:
+            if batch and (len(batch) >= self.provider.max_batch or chars + len(item[1]) > self.provider.max_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(item)
+            chars += len(item[1])
+        if batch:
+            yield batch
+
+    async def _store(self, batch: List[Tuple[str, str]], translated: List[str], source: str, target: str):
+        touched = time.monotonic()
+        for key, _ in batch:
+            self._touched[key] = touched
+        now = datetime.now(timezone.utc)
+        try:
+            await self.cache.bulk_write([
+                UpdateOne({"_id": key}, {"$set": {
+                    "translated": value,
+                    "source": source,
+                    "target": target,
+                    "provider": self.provider.name,
+                    "createdAt": now.isoformat(),
+                    "expireAt": now + timedelta(days=TRANSLATION_CACHE_DAYS)
+                }}, upsert=True)
+                for (key, _), value in zip(batch, translated)
+            ], ordered=False)
+        except PyMongoError as e:
+            logger.warning(f"Translation cache write failed: {str(e)}")
+
+    def _touch(self, keys: List[str]):
+        """Push back the expiry of cache entries that were just used (fire and forget)"""
+        if not keys:
+            return
+        touched = time.monotonic()
+        for key in keys:
+            self._touched[key] = touched
+
+        async def touch():
+            try:
+                await self.cache.update_many(
+                    {"_id": {"$in": keys}},
+                    {"$set": {"expireAt": datetime.now(timezone.utc) + timedelta(days=TRANSLATION_CACHE_DAYS)}}
+                )
+            except PyMongoError:
+                pass
+
+        task = asyncio.create_task(touch())
+        self._touches.add(task)
+        task.add_done_callback(self._touches.discard)
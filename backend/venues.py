@@ -0,0 +1,175 @@
+"""
+Venue Vibe Module
+Keeps each venue's live check-in count in a counter adjusted atomically on
+check-in and checkout, derives the vibe meter from it, checks out abandoned
+check-ins in the background and pushes vibe changes to Socket.IO subscribers.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Check-ins still active after this long are treated as abandoned
+CHECKIN_MAX_HOURS = int(os.environ.get('CHECKIN_MAX_HOURS', 6))
+CHECKIN_SWEEP_INTERVAL = 600  # seconds
+
+# 10 vibe points per checked-in user, capped at 100
+VIBE_POINTS_PER_CHECKIN = 10
+
+
+def venue_room(venueId: str) -> str:
+    """Socket.IO room for a venue's live vibe updates"""
+    return f"venue:{venueId}"
+
+
+def vibe_for(active: int) -> int:
+    """Vibe meter (0-100) for a number of active check-ins"""
+    return min(100, max(active, 0) * VIBE_POINTS_PER_CHECKIN)
+
+
+class VenueVibe:
+    """
+    O(1) venue presence.
+
+    `venue_presence` holds one {_id: venueId, active} counter per venue. Every
+    change is a single $inc; the venue's vibeMeter is only rewritten when the
+    derived value moves, and subscribers of the venue's room are notified.
+    """
+
+    def __init__(self, db, sio):
+        """
+        Args:
+            db: Motor database handle
+            sio: Socket.IO server used to push vibe updates
+        """
+        self.db = db
+        self.presence = db.venue_presence
+        self.sio = sio
+        self._task = None
+
+    async def create_indexes(self):
+        await self.dedupe_active_checkins()
+        # At most one active check-in per user; also makes concurrent check-ins safe
+        await self.db.checkins.create_index(
+            "userId", unique=True, partialFilterExpression={"status": "active"}, name="one_active_checkin_per_user"
+        )
+        await self.db.checkins.create_index([("status", 1), ("checkedInAt", 1)])  # abandoned check-in sweep
+        await self.db.checkins.create_index([("venueId", 1), ("status", 1)])
+
+    async def dedupe_active_checkins(self) -> int:
+        """
+        Check out all but the newest active check-in of each user, so the
+        partial unique index can be built on data written before it existed.
+        Returns the number of check-ins closed; run rebuild() afterwards.
+        """
+        duplicates = await self.db.checkins.aggregate([
+            {"$match": {"status": "active"}},
+            {"$sort": {"checkedInAt": -1}},
+            {"$group": {"_id": "$userId", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ]).to_list(None)
+        stale = [_id for group in duplicates for _id in group["ids"][1:]]
+        if not stale:
+            return 0
+        result = await self.db.checkins.update_many(
+            {"_id": {"$in": stale}, "status": "active"},
+            {"$set": {"status": "completed", "checkedOutAt": datetime.now(timezone.utc).isoformat(), "autoCheckedOut": True}}
+        )
+        logger.warning(f"Closed {result.modified_count} duplicate active check-ins")
+        return result.modified_count
+
+    async def checked_in(self, venueId: str) -> int:
+        """Count a new active check-in; returns the venue's vibe meter"""
+        return await self._adjust(venueId, 1)
+
+    async def checked_out(self, venueId: str) -> int:
+        """Count an ended check-in; returns the venue's vibe meter"""
+        return await self._adjust(venueId, -1)
+
+    async def _adjust(self, venueId: str, delta: int) -> int:
+        query = {"_id": venueId}
+        if delta < 0:
+            query["active"] = {"$gte": -delta}  # never go negative
+        presence = await self.presence.find_one_and_update(
+            query,
+            {"$inc": {"active": delta}, "$set": {"updatedAt": datetime.now(timezone.utc).isoformat()}},
+            upsert=delta > 0,
+            return_document=ReturnDocument.AFTER
+        )
+        active = presence["active"] if presence else 0
+        vibe = vibe_for(active)
+
+        changed = await self.db.venues.update_one(
+            {"id": venueId, "vibeMeter": {"$ne": vibe}}, {"$set": {"vibeMeter": vibe}}
+        )
+        if changed.modified_count:
+            try:
+                await self.sio.emit("venue_vibe", {"venueId": venueId, "activeCount": active, "vibeMeter": vibe},
+                                    room=venue_room(venueId))
+            except Exception as e:
+                logger.warning(f"Failed to push vibe for venue {venueId}: {str(e)}")
+        return vibe
+
+    async def active_count(self, venueId: str) -> int:
+        presence = await self.presence.find_one({"_id": venueId})
+        return max(presence.get("active", 0), 0) if presence else 0
+
+    async def rebuild(self):
+        """Reset every counter from the active check-ins (startup reconciliation)"""
+        counts = {
+            row["_id"]: row["active"]
+            async for row in self.db.checkins.aggregate([
+                {"$match": {"status": "active"}},
+                {"$group": {"_id": "$venueId", "active": {"$sum": 1}}}
+            ])
+        }
+        await self.presence.update_many({"_id": {"$nin": list(counts)}}, {"$set": {"active": 0}})
+        for venueId, active in counts.items():
+            await self.presence.update_one({"_id": venueId}, {"$set": {"active": active}}, upsert=True)
+
+    # ----- Abandoned check-in sweeper -----
+
+    def start(self):
+        """Start the abandoned check-in sweeper (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"Check-in sweep failed: {str(e)}")
+            await asyncio.sleep(CHECKIN_SWEEP_INTERVAL)
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """Check out every check-in older than CHECKIN_MAX_HOURS; returns how many"""
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(hours=CHECKIN_MAX_HOURS)).isoformat()
+        swept = 0
+        while True:
+            # Claim one at a time so a concurrent checkout never double-decrements
+            checkin = await self.db.checkins.find_one_and_update(
+                {"status": "active", "checkedInAt": {"$lt": cutoff}},
+                {"$set": {"status": "completed", "checkedOutAt": now.isoformat(), "autoCheckedOut": True}},
+                projection={"_id": 0, "venueId": 1}
+            )
+            if not checkin:
+                return swept
+            await self.checked_out(checkin["venueId"])
+            swept += 1
@@ -0,0 +1,202 @@
+"""
+View Tracking Module
+Records who viewed a story or Vibe Capsule outside the item document: exact
+"seen by" edges (capped per item) in `content_views`, plus a HyperLogLog sketch
+per item in `view_sketches` for unique-view counts past the cap. Item reads no
+longer carry ever-growing viewer arrays. Sketches and edges carry their item's
+expireAt, so a TTL removes them together with a capsule; stories are kept after
+they lapse and so are their views.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# 2^10 registers: ~3.3% standard error, at most 1024 small fields per sketch
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+# Exact viewer edges kept per item; counts are exact below this
+MAX_VIEW_EDGES = 1000
+
+
+def hll_register(value: str) -> Tuple[int, int]:
+    """Map a value to its (register index, rank) in the sketch"""
+    h = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+    index = h >> (64 - HLL_PRECISION)
+    rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    return index, rank
+
+
+def hll_estimate(registers: Dict[str, int]) -> int:
+    """Cardinality estimate from a sparse {register index: rank} map"""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    total = sum(2.0 ** -rank for rank in registers.values()) + (m - len(registers))
+    estimate = alpha * m * m / total
+    zeros = m - len(registers)
+    if estimate <= 2.5 * m and zeros:
+        # Small-range correction (linear counting)
+        estimate = m * math.log(m / zeros)
+    return round(estimate)
+
+
+class ViewTracker:
+    """
+    Per-item unique-view tracking for stories and capsules.
+
+    Each view $max-es one register of the item's sketch (an atomic HyperLogLog
+    merge), and claims one of MAX_VIEW_EDGES edge slots for first-time viewers.
+    While an item is under the cap its edge count is the exact unique count.
+    """
+
+    def __init__(self, db):
+        """
+        Args:
+            db: Motor database handle
+        """
+        self.db = db
+        self.edges = db.content_views
+        self.sketches = db.view_sketches
+        self._migration = None
+
+    async def create_indexes(self):
+        await self.sketches.create_index([("kind", 1), ("itemId", 1)], unique=True)
+        await self.edges.create_index([("kind", 1), ("itemId", 1), ("viewerId", 1)], unique=True)
+        await self.edges.create_index([("kind", 1), ("itemId", 1), ("viewedAt", -1)])
+        # Expire with the item they describe
+        await self.sketches.create_index("expireAt", expireAfterSeconds=0)
+        await self.edges.create_index("expireAt", expireAfterSeconds=0)
+
+    async def record(self, kind: str, itemId: str, viewerId: str, expireAt: Optional[datetime] = None):
+        """
+        Record a view; repeat views by the same viewer are not double counted.
+
+        Args:
+            expireAt: The item's expiry (BSON date); the view data expires with it
+        """
+        index, rank = hll_register(viewerId)
+        now = datetime.now(timezone.utc).isoformat()
+        on_insert = {"edges": 0}
+        if expireAt is not None:
+            on_insert["expireAt"] = expireAt
+        await self.sketches.update_one(
+            {"kind": kind, "itemId": itemId},
+            {"$max": {f"registers.{index}": rank}, "$inc": {"totalViews": 1}, "$setOnInsert": on_insert},
+            upsert=True
+        )
+
+        # Claim an edge slot, then give it back if this viewer already has an edge
+        claimed = await self.sketches.update_one(
+            {"kind": kind, "itemId": itemId, "edges": {"$lt": MAX_VIEW_EDGES}},
+            {"$inc": {"edges": 1}}
+        )
+        if not claimed.modified_count:
+            return
+        edge = {"kind": kind, "itemId": itemId, "viewerId": viewerId, "viewedAt": now}
+        if expireAt is not None:
+            edge["expireAt"] = expireAt
+        try:
+            await self.edges.insert_one(edge)
+        except DuplicateKeyError:
+            await self.sketches.update_one({"kind": kind, "itemId": itemId}, {"$inc": {"edges": -1}})
+
+    async def counts(self, kind: str, itemIds: Iterable[str]) -> Dict[str, int]:
+        """Unique-view counts for several items in one query (0 for unseen items)"""
+        itemIds = list(itemIds)
+        sketches = await self.sketches.find(
+            {"kind": kind, "itemId": {"$in": itemIds}}, {"_id": 0}
+        ).to_list(len(itemIds))
+        counts = {itemId: 0 for itemId in itemIds}
+        for sketch in sketches:
+            counts[sketch["itemId"]] = self._unique(sketch)
+        return counts
+
+    @staticmethod
+    def _unique(sketch: dict) -> int:
+        if sketch.get("edges", 0) < MAX_VIEW_EDGES:
+            return sketch.get("edges", 0)
+        # Past the cap: never report fewer than the edges actually stored
+        return max(hll_estimate(sketch.get("registers", {})), MAX_VIEW_EDGES)
+
+    async def viewers(self, kind: str, itemId: str, limit: int = 50) -> List[dict]:
+        """Most recent viewers ({"viewerId", "viewedAt"}) from the exact edge store"""
+        return await self.edges.find(
+            {"kind": kind, "itemId": itemId}, {"_id": 0, "viewerId": 1, "viewedAt": 1}
+        ).sort("viewedAt", -1).to_list(limit)
+
+    # ----- Legacy viewer arrays -----
+
+    def start(self, collections: Dict[str, str]):
+        """Fold legacy `views` arrays into the edge store in the background (idempotent)"""
+        if self._migration is None or self._migration.done():
+            self._migration = asyncio.create_task(self._migrate(collections))
+
+    async def stop(self):
+        if self._migration:
+            self._migration.cancel()
+            try:
+                await self._migration
+            except asyncio.CancelledError:
+                pass
+            self._migration = None
+
+    async def _migrate(self, collections: Dict[str, str]):
+        """
+        Move each item's `views` array into edges and its sketch, then $unset it.
+
+        Args:
+            collections: Kind -> collection name
+        """
+        for kind, collection in collections.items():
+            migrated = 0
+            try:
+                async for item in self.db[collection].find(
+                    {"views.0": {"$exists": True}}, {"_id": 0, "id": 1, "views": 1, "expireAt": 1}
+                ):
+                    for viewerId in item["views"]:
+                        await self.record(kind, item["id"], viewerId, item.get("expireAt"))
+                    await self.db[collection].update_one({"id": item["id"]}, {"$unset": {"views": ""}})
+                    migrated += 1
+                # Drop empty arrays left on items nobody viewed
+                await self.db[collection].update_many({"views": {"$size": 0}}, {"$unset": {"views": ""}})
+            except PyMongoError as e:
+                logger.warning(f"Migrating {collection} viewer arrays failed: {str(e)}")
+            if migrated:
+                logger.info(f"Moved viewer arrays of {migrated} {collection} items to the view store")
+            try:
+                await self._expire_untracked(kind, collection)
+            except PyMongoError as e:
+                logger.warning(f"Setting expiry on {collection} view data failed: {str(e)}")
+
+    async def _expire_untracked(self, kind: str, collection: str, batch_size: int = 500):
+        """Give view data recorded without an expiry its item's expireAt; drop it if the item is gone"""
+        while True:
+            sketches = await self.sketches.find(
+                {"kind": kind, "expireAt": {"$exists": False}}, {"_id": 0, "itemId": 1}
+            ).to_list(batch_size)
+            if not sketches:
+                return
+            itemIds = [sketch["itemId"] for sketch in sketches]
+            items = await self.db[collection].find(
+                {"id": {"$in": itemIds}}, {"_id": 0, "id": 1, "expireAt": 1}
+            ).to_list(len(itemIds))
+            expiry = {item["id"]: item.get("expireAt") for item in items}
+            for itemId in itemIds:
+                query = {"kind": kind, "itemId": itemId}
+                if itemId not in expiry:
+                    # The item already expired; its views have nothing left to count for
+                    await self.sketches.delete_one(query)
+                    await self.edges.delete_many(query)
+                    continue
+                # A null expireAt marks the sketch as handled without ever matching the TTL
+                await self.sketches.update_one(query, {"$set": {"expireAt": expiry[itemId]}})
+                await self.edges.update_many(query, {"$set": {"expireAt": expiry[itemId]}})
@@ -187,7 +187,7 @@ const VibeCapsuleViewer = ({ stories, currentUserId, onClose }) => {
         {/* View Count */}
         <div className="flex items-center justify-center gap-2 mt-3 text-white text-sm">
           <Eye size={16} />
-          <span>{currentCapsule.views?.length || 0} views</span>
+          <span>{currentCapsule.viewCount || 0} views</span>
         </div>
       </div>
 
@@ -243,11 +243,11 @@ const ProfileVibe = () => {
                   </div>
                   
                   {/* QR Code - Prominent Display */}
-                  {ticket.qrCodeImage && (
+                  {ticket.id && (
                     <div className="flex justify-center mb-4">
                       <div className="bg-white rounded-2xl p-4 shadow-lg">
                         <img 
-                          src={ticket.qrCodeImage} 
+                          src={`${API}/tickets/${ticket.id}/qr.png`} 
                           alt="Ticket QR Code" 
                           className="w-48 h-48 object-contain"
                         />
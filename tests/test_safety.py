@@ -0,0 +1,44 @@
+"""Regression cases for the content safety classifier (backend/safety.py)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from safety import DEFAULT_LEXICON, SafetyClassifier, normalize  # noqa: E402
+
+classifier = SafetyClassifier(DEFAULT_LEXICON)
+
+
+def categories(text):
+    return classifier.classify(text)["categories"]
+
+
+def test_terms_keep_their_spelling():
+    assert normalize("shoot") == " shoot "
+    assert categories("Nice shot!") == []
+    assert categories("Good book, great food") == []
+
+
+def test_plain_terms_match():
+    assert categories("they want to shoot") == ["violence"]
+    assert "harassment" in categories("kill yourself")
+
+
+def test_whole_words_only():
+    assert categories("what a skill") == []
+
+
+def test_stretched_letters():
+    assert categories("kiiiill") == ["violence"]
+    assert categories("shoooooot") == ["violence"]
+
+
+def test_leet_one_as_i_or_l():
+    assert "harassment" in categories("ki11 yourself")
+    assert categories("k1ll") == ["violence"]
+
+
+def test_spaced_out_phrases():
+    assert "harassment" in categories("k i l l y o u r s e l f")
+    assert categories("k.i.l.l") == ["violence"]
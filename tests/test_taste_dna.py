@@ -0,0 +1,62 @@
+"""Activity counts fed into the TasteDNA prompt (backend/taste_dna.py)"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from taste_dna import LocalTasteModel, TasteDNAService  # noqa: E402
+
+
+def matches(doc, query):
+    for field, value in query.items():
+        stored = doc.get(field)
+        if stored != value and not (isinstance(stored, list) and value in stored):
+            return False
+    return True
+
+
+class FakeCollection:
+    """The slice of a Motor collection TasteDNAService.generate uses"""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if matches(doc, query)), None)
+
+    async def count_documents(self, query):
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs.append({**query, **update["$set"]})
+
+
+class FakeDB:
+    def __init__(self, **collections):
+        self.collections = collections
+
+    def __getattr__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class RecordingModel(LocalTasteModel):
+    async def complete(self, userId, prompt):
+        self.prompt = prompt
+        return await super().complete(userId, prompt)
+
+
+def test_prompt_counts_authored_and_liked_posts():
+    db = FakeDB(
+        users=FakeCollection([{"id": "u1", "interests": ["music"]}]),
+        posts=FakeCollection([
+            {"id": "p1", "authorId": "u1", "likedBy": ["u2"], "stats": {"likes": 1}},
+            {"id": "p2", "authorId": "u2", "likedBy": ["u1", "u3"], "stats": {"likes": 2}},
+            {"id": "p3", "authorId": "u3", "likedBy": ["u1"], "stats": {"likes": 1}},
+        ])
+    )
+    model = RecordingModel()
+    asyncio.run(TasteDNAService(db, model).generate("u1"))
+    assert "Number of Posts: 1" in model.prompt
+    assert "Number of Likes: 2" in model.prompt